@@ -0,0 +1,316 @@
+"""
+Emulate CloudFormation driving the custom resources of a stack, to load test the handler locally.
+
+A stack of --resources custom resources goes through the event sequences CloudFormation sends,
+with up to --concurrency invocations of the handler at the same time:
+
+- lifecycle: Create, Update and Delete of every resource.
+- create-rollback: the Create of --failures resources fails, the stack goes to ROLLBACK_IN_PROGRESS
+  and every resource gets a Delete.
+- update-rollback: the Update of --failures resources fails, the stack goes to
+  UPDATE_ROLLBACK_IN_PROGRESS and the updated resources get an Update back to their old
+  properties, then the stack is deleted.
+
+Terraform is the stub binary of the handler benchmark, AWS services are its in-process stand-ins,
+and the stack status is served by a CloudFormation stand-in following the emulated stack. The
+emulator hosts the ResponseURL itself and checks every response: exactly one per event, matching
+identifiers, the expected status, a PhysicalResourceId which doesn't change during the life of the
+resource (CloudFormation would replace the resource otherwise) and a body within the 4 KB limit.
+Throughput, response latency percentiles by request type and check failures are printed as JSON.
+
+Usage:
+    python benchmarks/cloudformation_emulator.py [--resources 50] [--concurrency 50] [--failures 2] [--scenarios lifecycle create-rollback update-rollback]
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import http.server
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError
+
+import main
+from handler import STUB_TERRAFORM, Context, DynamoDBStandIn, LogsStandIn, S3StandIn
+
+SCENARIOS = ['lifecycle', 'create-rollback', 'update-rollback']
+
+STACK_NAME = 'emulated'
+
+CONFIGURATION = 'resource "stub_resource" "example" {}\n'
+
+
+class CloudFormationStandIn:
+    """
+    Reports the status of the emulated stack.
+    """
+
+    exceptions = type('Exceptions', (), {'ClientError': ClientError})
+
+    def __init__(self):
+        self.stack_status = None
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': self.stack_status}]}
+
+
+class ResponseServer(http.server.ThreadingHTTPServer):
+    """
+    Hosts the ResponseURL and records the responses by request ID with the time they were received.
+    """
+
+    # All resources of a stack may respond at once, connections beyond the backlog would wait for TCP retransmissions
+    request_queue_size = 1024
+
+    def __init__(self):
+        self.responses = {}
+        self.responses_lock = threading.Lock()
+
+        class ResponseHandler(http.server.BaseHTTPRequestHandler):
+            def do_PUT(handler):
+                body = handler.rfile.read(int(handler.headers['Content-Length']))
+                response = json.loads(body)
+                with self.responses_lock:
+                    self.responses.setdefault(response.get('RequestId'), []).append({'time': time.perf_counter(), 'size': len(body), 'body': response})
+                handler.send_response(200)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+
+            def log_message(handler, format, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), ResponseHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server_address[1]}/response'
+
+
+class StackEmulator:
+    """
+    Sends the events of a stack operation to the handler and checks the responses.
+
+    Args:
+        stack_id (str): The ID of the emulated stack.
+        cloudformation (CloudFormationStandIn): The stand-in reporting the stack status.
+        server (ResponseServer): The server hosting the ResponseURL.
+        concurrency (int): The maximum number of concurrent invocations.
+    """
+
+    def __init__(self, stack_id, cloudformation, server, concurrency):
+        self.stack_id = stack_id
+        self.cloudformation = cloudformation
+        self.server = server
+        self.concurrency = concurrency
+        self.physical_resource_ids = {}
+        self.samples = []
+        self.problems = []
+
+    def build_event(self, request_type, logical_resource_id, properties, old_properties=None):
+        event = {
+            'RequestType': request_type,
+            'ServiceToken': properties['ServiceToken'],
+            'ResponseURL': self.server.url,
+            'StackId': self.stack_id,
+            'RequestId': str(uuid.uuid4()),
+            'ResourceType': 'Custom::TerraformConfiguration',
+            'LogicalResourceId': logical_resource_id,
+            'ResourceProperties': properties,
+        }
+        if request_type != 'Create':
+            event['PhysicalResourceId'] = self.physical_resource_ids[logical_resource_id]
+        if old_properties is not None:
+            event['OldResourceProperties'] = old_properties
+        return event
+
+    def invoke(self, event, expected_status):
+        start_time = time.perf_counter()
+        main.handler(event, Context())
+        handler_duration = time.perf_counter() - start_time
+
+        with self.server.responses_lock:
+            responses = self.server.responses.pop(event['RequestId'], [])
+        sample = {'request_type': event['RequestType'], 'handler_duration': handler_duration, 'status': None, 'latency': None}
+        self.samples.append(sample)
+
+        def problem(check, detail):
+            self.problems.append({'check': check, 'request_type': event['RequestType'], 'logical_resource_id': event['LogicalResourceId'], 'detail': detail})
+
+        if len(responses) != 1:
+            problem('responses_per_event', f"{len(responses)} responses")
+        if not responses:
+            return None
+
+        response = responses[0]
+        body = response['body']
+        sample.update(status=body.get('Status'), latency=response['time'] - start_time)
+
+        for key in ['StackId', 'RequestId', 'LogicalResourceId']:
+            if body.get(key) != event[key]:
+                problem('identifiers', f"{key} {body.get(key)!r} instead of {event[key]!r}")
+        if body.get('Status') != expected_status:
+            problem('status', f"{body.get('Status')} instead of {expected_status}: {body.get('Reason')}")
+        if body.get('Status') == 'FAILED' and not body.get('Reason'):
+            problem('status', 'FAILED without a reason')
+        if response['size'] > main.CLOUDFORMATION_RESPONSE_MAX_SIZE:
+            problem('response_size', f"{response['size']} bytes")
+        if 'PhysicalResourceId' in event and body.get('PhysicalResourceId') != event['PhysicalResourceId']:
+            problem('physical_resource_id', f"{body.get('PhysicalResourceId')!r} instead of {event['PhysicalResourceId']!r}")
+
+        return body
+
+    def run_operation(self, stack_status, events):
+        """
+        Sends the events of a stack operation concurrently, as CloudFormation does for resources
+        without dependencies between them.
+
+        Args:
+            stack_status (str): The status of the stack during the operation.
+            events (list): The events with their expected response status.
+
+        Returns:
+            dict: The responses by logical resource ID.
+        """
+        self.cloudformation.stack_status = stack_status
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.invoke, event, expected_status): event for event, expected_status in events}
+            responses = {futures[future]['LogicalResourceId']: future.result() for future in concurrent.futures.as_completed(futures)}
+
+        for logical_resource_id, response in responses.items():
+            if response and logical_resource_id not in self.physical_resource_ids:
+                self.physical_resource_ids[logical_resource_id] = response.get('PhysicalResourceId')
+        return responses
+
+
+def build_properties(revision, fail=None):
+    properties = {
+        'ServiceToken': 'arn:aws:lambda:us-east-1:123456789012:function:emulated',
+        'Configuration': CONFIGURATION,
+        'ExecutionLogsTargetArn': 'arn:aws:logs:us-east-1:123456789012:log-group:emulated:*',
+        'Variables': {'revision': str(revision)},
+    }
+    if fail:
+        properties['Environment'] = {'STUB_TERRAFORM_FAIL': fail}
+    return properties
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        **{f'p{percentile}_ms': round(values[max(0, math.ceil(percentile / 100 * len(values)) - 1)] * 1000, 2) for percentile in [50, 90, 99]},
+        'max_ms': round(values[-1] * 1000, 2),
+    }
+
+
+def run_scenario(scenario, resources, concurrency, failures, server):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-cloudformation-emulator-')
+    try:
+        # Fresh /tmp layout and module caches, like in a new execution environment
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        main.TERRAFORM_PLUGIN_CACHE_DIR = os.path.join(tmp_dir, 'terraform-plugin-cache')
+        main.TERRAFORM_PLUGIN_CACHE_INDEX_PATH = os.path.join(tmp_dir, 'terraform-plugin-cache.index.json')
+        main.TERRAFORM_WORKSPACES_DIR = os.path.join(tmp_dir, 'workspaces')
+        main.CONFIGURATION_CACHE_DIR = os.path.join(tmp_dir, 'configuration-cache')
+        main.configuration_cache.clear()
+        main.terraform_versions.clear()
+
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        cloudformation = CloudFormationStandIn()
+        main.aws_clients.clear()
+        main.aws_clients.update({'s3': S3StandIn({}), 'logs': LogsStandIn(), 'cloudformation': cloudformation, 'dynamodb': DynamoDBStandIn()})
+
+        emulator = StackEmulator(f'arn:aws:cloudformation:us-east-1:123456789012:stack/{STACK_NAME}/{uuid.uuid4()}', cloudformation, server, concurrency)
+        logical_resource_ids = [f'Resource{index:03d}' for index in range(resources)]
+        failing = set(logical_resource_ids[:failures]) if scenario != 'lifecycle' else set()
+
+        start_time = time.perf_counter()
+        create_fail = 'apply' if scenario == 'create-rollback' else None
+        responses = emulator.run_operation('CREATE_IN_PROGRESS', [
+            (emulator.build_event('Create', logical_resource_id, build_properties(0, create_fail if logical_resource_id in failing else None)), 'FAILED' if create_fail and logical_resource_id in failing else 'SUCCESS')
+            for logical_resource_id in logical_resource_ids
+        ])
+
+        if scenario == 'create-rollback':
+            # CloudFormation deletes the created resources and the ones which failed to create
+            emulator.run_operation('ROLLBACK_IN_PROGRESS', [
+                (emulator.build_event('Delete', logical_resource_id, build_properties(0)), 'SUCCESS')
+                for logical_resource_id in logical_resource_ids if responses.get(logical_resource_id)
+            ])
+        else:
+            update_fail = 'apply' if scenario == 'update-rollback' else None
+            responses = emulator.run_operation('UPDATE_IN_PROGRESS', [
+                (emulator.build_event('Update', logical_resource_id, build_properties(1, update_fail if logical_resource_id in failing else None), build_properties(0)), 'FAILED' if update_fail and logical_resource_id in failing else 'SUCCESS')
+                for logical_resource_id in logical_resource_ids
+            ])
+            if scenario == 'update-rollback':
+                # CloudFormation updates the resources which were updated back to their old properties
+                emulator.run_operation('UPDATE_ROLLBACK_IN_PROGRESS', [
+                    (emulator.build_event('Update', logical_resource_id, build_properties(0), build_properties(1)), 'SUCCESS')
+                    for logical_resource_id in logical_resource_ids if (responses.get(logical_resource_id) or {}).get('Status') == 'SUCCESS'
+                ])
+            emulator.run_operation('DELETE_IN_PROGRESS', [
+                (emulator.build_event('Delete', logical_resource_id, build_properties(0)), 'SUCCESS')
+                for logical_resource_id in logical_resource_ids
+            ])
+        duration = time.perf_counter() - start_time
+
+        request_types = sorted({sample['request_type'] for sample in emulator.samples})
+        checks = {check: sum(1 for problem in emulator.problems if problem['check'] == check) for check in ['responses_per_event', 'identifiers', 'status', 'physical_resource_id', 'response_size']}
+        return {
+            'scenario': scenario,
+            'events': len(emulator.samples),
+            'duration_s': round(duration, 2),
+            'throughput_events_per_s': round(len(emulator.samples) / duration, 2),
+            'latency': {request_type: percentiles([sample['latency'] for sample in emulator.samples if sample['request_type'] == request_type and sample['latency'] is not None]) for request_type in request_types},
+            'statuses': {status: sum(1 for sample in emulator.samples if sample['status'] == status) for status in ['SUCCESS', 'FAILED', None]},
+            'checks': checks,
+            'problems': emulator.problems[:10],
+        }
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def run(scenarios, resources, concurrency, failures):
+    server = ResponseServer()
+    os.environ.update({
+        'OUTPUTS_OFFLOAD_S3_BUCKET': 'emulated',
+        'TERRAFORM_BACKEND_S3_BUCKET': 'emulated',
+        'TERRAFORM_BACKEND_S3_DYNAMODB_TABLE': 'emulated',
+        'STUB_TERRAFORM_LATENCY': '0.05',
+        'STUB_TERRAFORM_STDOUT_LINES': '20',
+        'STUB_TERRAFORM_OUTPUTS': '5',
+        'STUB_TERRAFORM_OUTPUT_SIZE': '32',
+    })
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            results = [run_scenario(scenario, resources, concurrency, failures, server) for scenario in scenarios]
+    finally:
+        server.shutdown()
+
+    return {'resources': resources, 'concurrency': concurrency, 'failures': failures, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--failures', type=int, default=2, help='Resources whose Create or Update fails in the rollback scenarios')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.scenarios, args.resources, args.concurrency, args.failures), indent=2))
@@ -0,0 +1,79 @@
+"""
+Benchmark sequential and parallel download of multi-file Terraform configurations from an S3 prefix.
+
+The S3 API is replaced by an in-process stand-in which adds a fixed latency to every request, so
+the benchmark measures how well download_s3_configuration_prefix overlaps requests rather than
+network throughput. Results are printed as JSON.
+
+Usage:
+    python benchmarks/configuration_fetch.py [--objects 120] [--latency-ms 20] [--workers 1 4 16]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import main
+
+
+class S3StandIn:
+    """
+    Serves objects from memory, sleeping for the configured latency on every request.
+    """
+
+    def __init__(self, objects, latency):
+        self.objects = objects
+        self.latency = latency
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        time.sleep(self.latency)
+        yield {'Contents': [{'Key': key, 'Size': len(body)} for key, body in self.objects.items() if key.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def run(object_count, latency, workers):
+    objects = {
+        f"configuration/{'modules/module-%d/' % (index % 10) if index >= 10 else ''}file-{index}.tf": f'# file {index}\n'.encode('utf-8') * 20
+        for index in range(object_count)
+    }
+    s3 = S3StandIn(objects, latency)
+
+    results = []
+    for max_workers in workers:
+        working_dir = tempfile.mkdtemp()
+        try:
+            start_time = time.perf_counter()
+            file_count = main.download_s3_configuration_prefix('s3://bucket/configuration/', working_dir, max_workers=max_workers, s3=s3)
+            duration = time.perf_counter() - start_time
+        finally:
+            shutil.rmtree(working_dir)
+        results.append({'workers': max_workers, 'files': file_count, 'seconds': round(duration, 4)})
+
+    sequential = next((result['seconds'] for result in results if result['workers'] == 1), None)
+    for result in results:
+        result['speedup'] = round(sequential / result['seconds'], 2) if sequential else None
+
+    return {'benchmark': 'configuration_fetch', 'objects': object_count, 'latency_ms': latency * 1000, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=120)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, main.CONFIGURATION_DOWNLOAD_WORKERS])
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.objects, args.latency_ms / 1000, args.workers), indent=2))
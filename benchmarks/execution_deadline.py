@@ -0,0 +1,159 @@
+"""
+Check that the handler responds before the Lambda function times out, with a slow stub Terraform.
+
+The handler runs with a fake Lambda context that times out after a few seconds, against the AWS
+stand-ins of the handler benchmark. The reserves of the execution phases and the grace period of
+SIGINT are scaled down accordingly. The stub Terraform binary records the commands it runs and
+never finishes 'apply' on its own:
+
+- graceful: the apply is interrupted with SIGINT, the stub stops right away.
+- killed: the stub ignores SIGINT, it is killed after the grace period.
+- short-budget: the context leaves less than the grace period to 'terraform init', which must
+  not be started at all.
+
+Every scenario checks that a single FAILED response naming the phase is sent before the context
+times out. Results are printed as JSON, the exit status is 1 if any check fails.
+
+Usage:
+    python benchmarks/execution_deadline.py [--scenarios graceful killed short-budget]
+"""
+import argparse
+import contextlib
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import main
+from handler import CloudFormationStandIn, Context, DynamoDBStandIn, LogsStandIn, ResponseHandler, S3StandIn, build_event
+
+# Context timeout (seconds) and expectations by scenario
+SCENARIOS = {
+    'graceful': {'timeout': 6, 'ignore_sigint': False, 'reason': 'apply phase ran out of time', 'outcome': 'Terraform stopped gracefully', 'commands': ['init', 'apply']},
+    'killed': {'timeout': 6, 'ignore_sigint': True, 'reason': 'apply phase ran out of time', 'outcome': 'Terraform was killed', 'commands': ['init', 'apply']},
+    'short-budget': {'timeout': 3.9, 'ignore_sigint': False, 'reason': 'Not enough time left to start the init phase', 'outcome': '', 'commands': []},
+}
+
+# Scaled down reserves (seconds), the fetch phase keeps more time than init needs with the grace period
+EXECUTION_RESPONSE_RESERVE = 0.5
+EXECUTION_PHASE_RESERVES = {'fetch': 3, 'init': 2, 'apply': 1, 'output': 0, 'destroy': 0}
+TERRAFORM_INTERRUPT_GRACE_PERIOD = 1.5
+
+STUB_TERRAFORM = """#!{python}
+import os
+import signal
+import sys
+import time
+
+command = sys.argv[1]
+if command != 'version':
+    with open(os.environ['STUB_TERRAFORM_CALLS'], 'a') as calls_file:
+        calls_file.write(command + '\\n')
+
+def interrupt(signum, frame):
+    print('Interrupt received. Gracefully shutting down...', file=sys.stderr)
+    sys.exit(1)
+
+signal.signal(signal.SIGINT, signal.SIG_IGN if os.environ.get('STUB_TERRAFORM_IGNORE_SIGINT') else interrupt)
+
+if command == 'version':
+    print('{{"terraform_version": "1.9.8"}}')
+elif command == 'init':
+    os.makedirs('.terraform', exist_ok=True)
+elif command in ('apply', 'destroy'):
+    time.sleep(600)
+"""
+
+
+def run_scenario(name, scenario, response_url):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-execution-deadline-')
+    try:
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        main.TERRAFORM_PLUGIN_CACHE_DIR = os.path.join(tmp_dir, 'terraform-plugin-cache')
+        main.TERRAFORM_PLUGIN_CACHE_INDEX_PATH = os.path.join(tmp_dir, 'terraform-plugin-cache.index.json')
+        main.TERRAFORM_WORKSPACES_DIR = os.path.join(tmp_dir, 'workspaces')
+        main.CONFIGURATION_CACHE_DIR = os.path.join(tmp_dir, 'configuration-cache')
+        main.configuration_cache.clear()
+        main.terraform_versions.clear()
+
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        calls_path = os.path.join(tmp_dir, 'calls')
+        open(calls_path, 'w').close()
+        os.environ['STUB_TERRAFORM_CALLS'] = calls_path
+        os.environ['STUB_TERRAFORM_IGNORE_SIGINT'] = '1' if scenario['ignore_sigint'] else ''
+
+        main.aws_clients.clear()
+        main.aws_clients.update({'s3': S3StandIn({}), 'logs': LogsStandIn(), 'cloudformation': CloudFormationStandIn(), 'dynamodb': DynamoDBStandIn()})
+
+        event = build_event('Create', response_url, {
+            'ServiceToken': 'arn:aws:lambda:us-east-1:123456789012:function:benchmark',
+            'Configuration': 'resource "stub_resource" "example" {}\n',
+        })
+        ResponseHandler.responses.clear()
+        context = Context(scenario['timeout'])
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            main.handler(event, context)
+        duration = time.perf_counter() - start_time
+        remaining_time = context.get_remaining_time_in_millis() / 1000
+
+        with open(calls_path) as calls_file:
+            commands = calls_file.read().split()
+        reason = ResponseHandler.responses[-1].get('Reason', '') if ResponseHandler.responses else ''
+
+        return {
+            'scenario': name,
+            'context_timeout_s': scenario['timeout'],
+            'handler_ms': round(duration * 1000, 2),
+            'remaining_ms': round(remaining_time * 1000, 2),
+            'commands': commands,
+            'reason': reason,
+            'checks': {
+                'single_response': len(ResponseHandler.responses) == 1,
+                'failed': bool(ResponseHandler.responses) and ResponseHandler.responses[-1]['Status'] == 'FAILED',
+                'reason': scenario['reason'] in reason and scenario['outcome'] in reason,
+                'before_timeout': remaining_time > 0,
+                'commands': commands == scenario['commands'],
+            },
+        }
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def run(scenarios):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ResponseHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    response_url = f'http://127.0.0.1:{server.server_address[1]}/response'
+
+    defaults = (main.EXECUTION_RESPONSE_RESERVE, main.EXECUTION_PHASE_RESERVES, main.TERRAFORM_INTERRUPT_GRACE_PERIOD)
+    main.EXECUTION_RESPONSE_RESERVE = EXECUTION_RESPONSE_RESERVE
+    main.EXECUTION_PHASE_RESERVES = EXECUTION_PHASE_RESERVES
+    main.TERRAFORM_INTERRUPT_GRACE_PERIOD = TERRAFORM_INTERRUPT_GRACE_PERIOD
+    try:
+        results = [run_scenario(name, SCENARIOS[name], response_url) for name in scenarios]
+    finally:
+        main.EXECUTION_RESPONSE_RESERVE, main.EXECUTION_PHASE_RESERVES, main.TERRAFORM_INTERRUPT_GRACE_PERIOD = defaults
+        server.shutdown()
+
+    return {'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    results = run(args.scenarios)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(all(result['checks'].values()) for result in results['results']) else 1)
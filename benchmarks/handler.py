@@ -0,0 +1,513 @@
+"""
+Benchmark the Lambda function handler end to end, without AWS and without Terraform.
+
+Terraform is replaced by a stub script with configurable latency, stdout size and outputs, AWS
+services by in-process stand-ins of S3, CloudWatch Logs, DynamoDB and CloudFormation, and the CloudFormation
+ResponseURL by a local HTTP server. Every scenario runs a cold Create, a number of warm Updates and
+a Delete in fresh /tmp directories, and reports how long each phase of the handler took:
+configuration fetch, variable rendering, init, apply, output and response send, as well as the
+handler overhead outside of them, i.e. the time during which no phase was running. The Updates of the unchanged-updates scenario don't change any
+property, so they are answered from the record of the last apply. The configurations scenario runs a tree of
+configurations with the 'Configurations' property, each depending on its parent. In the throttled scenario, the stub
+fails applies and destroys running more than 8 operations concurrently like a throttled cloud API, so that they are
+retried with reduced parallelism. Results are printed as JSON, or
+written to a file.
+
+Usage:
+    python benchmarks/handler.py [--iterations 5] [--scenarios small large-configuration large-outputs unchanged-updates configurations throttled] [--output results.json]
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import http.server
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError
+
+import main
+
+SCENARIOS = {
+    'small': {
+        'configuration': 'inline',
+        'configuration_files': 1,
+        'configuration_file_size': 1024,
+        'variables': 5,
+        'outputs': 5,
+        'output_size': 32,
+        'stdout_lines': 20,
+        'latency': 0.05,
+        'unchanged_updates': False,
+        'configurations': 0,
+        'parallelism': None,
+        'throttle_above': 0,
+    },
+    'large-configuration': {
+        'configuration': 's3-prefix',
+        'configuration_files': 500,
+        'configuration_file_size': 16 * 1024,
+        'variables': 2000,
+        'outputs': 5,
+        'output_size': 32,
+        'stdout_lines': 20,
+        'latency': 0.05,
+        'unchanged_updates': False,
+        'configurations': 0,
+        'parallelism': None,
+        'throttle_above': 0,
+    },
+    'large-outputs': {
+        'configuration': 's3',
+        'configuration_files': 1,
+        'configuration_file_size': 1024 * 1024,
+        'variables': 5,
+        'outputs': 500,
+        'output_size': 1024,
+        'stdout_lines': 100000,
+        'latency': 0.05,
+        'unchanged_updates': False,
+        'configurations': 0,
+        'parallelism': None,
+        'throttle_above': 0,
+    },
+    'unchanged-updates': {
+        'configuration': 's3',
+        'configuration_files': 1,
+        'configuration_file_size': 1024,
+        'variables': 5,
+        'outputs': 5,
+        'output_size': 32,
+        'stdout_lines': 20,
+        'latency': 0.05,
+        'unchanged_updates': True,
+        'configurations': 0,
+        'parallelism': None,
+        'throttle_above': 0,
+    },
+    'configurations': {
+        'configuration': 's3',
+        'configuration_files': 1,
+        'configuration_file_size': 1024,
+        'variables': 5,
+        'outputs': 5,
+        'output_size': 32,
+        'stdout_lines': 20,
+        'latency': 0.05,
+        'unchanged_updates': False,
+        'configurations': 8,
+        'parallelism': None,
+        'throttle_above': 0,
+    },
+    'throttled': {
+        'configuration': 'inline',
+        'configuration_files': 1,
+        'configuration_file_size': 1024,
+        'variables': 5,
+        'outputs': 5,
+        'output_size': 32,
+        'stdout_lines': 20,
+        'latency': 0.05,
+        'unchanged_updates': False,
+        'configurations': 0,
+        'parallelism': 32,
+        'throttle_above': 8,
+    },
+}
+
+PHASES = ['fetch', 'variables', 'init', 'apply', 'output', 'response']
+
+# Terraform subcommands by the handler phase they belong to
+TERRAFORM_COMMAND_PHASES = {'init': 'init', 'plan': 'apply', 'apply': 'apply', 'destroy': 'apply', 'state': 'apply', 'output': 'output', 'show': 'output'}
+
+STUB_TERRAFORM = """#!{python}
+import json
+import os
+import sys
+import time
+
+command = sys.argv[1]
+outputs = {{
+    f'output_{{index}}': {{'sensitive': False, 'type': 'string', 'value': 'x' * int(os.environ['STUB_TERRAFORM_OUTPUT_SIZE'])}}
+    for index in range(int(os.environ['STUB_TERRAFORM_OUTPUTS']))
+}}
+
+parallelism = [int(argument[13:]) for argument in sys.argv if argument.startswith('-parallelism=')]
+throttle_above = int(os.environ.get('STUB_TERRAFORM_THROTTLE_ABOVE') or 0)
+if os.environ.get('STUB_TERRAFORM_FAIL') == command:
+    print('Error: Stub failure', file=sys.stderr)
+    sys.exit(1)
+elif parallelism and throttle_above and parallelism[0] > throttle_above:
+    time.sleep(float(os.environ['STUB_TERRAFORM_LATENCY']))
+    print('Error: creating stub resource: operation error Stub: CreateResource, api error ThrottlingException: Rate exceeded', file=sys.stderr)
+    sys.exit(1)
+elif command == 'version':
+    print(json.dumps({{'terraform_version': '1.9.8'}}))
+elif command in ('init', 'plan', 'apply', 'destroy'):
+    time.sleep(float(os.environ['STUB_TERRAFORM_LATENCY']))
+    for index in range(int(os.environ['STUB_TERRAFORM_STDOUT_LINES'])):
+        print(f'stub_resource.example[{{index}}]: Modifications complete after 0s [id={{index:020d}}]')
+    if command == 'init':
+        os.makedirs('.terraform', exist_ok=True)
+    if command == 'apply' and '-json' in sys.argv:
+        print(json.dumps({{'type': 'outputs', 'outputs': outputs}}))
+    if command == 'plan':
+        with open([argument for argument in sys.argv if argument.startswith('-out=')][0][5:], 'w') as plan_file:
+            plan_file.write('stub')
+        sys.exit(2)
+elif command == 'output':
+    print(json.dumps(outputs))
+elif command == 'show':
+    print(json.dumps({{'planned_values': {{'outputs': outputs}}}}))
+elif command == 'state':
+    print('stub_resource.example')
+"""
+
+
+class S3StandIn:
+    """
+    Serves objects from memory, with ETags for conditional requests, and stores offloaded outputs.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'GetObject')
+        etag = f'"{hash(self.objects[Key])}"'
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]), 'ETag': etag}
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key, 'Size': len(body)} for key, body in self.objects.items() if key.startswith(Prefix)]}
+
+
+class LogsStandIn:
+    """
+    Accepts log streams and log events, counting the events.
+    """
+
+    def __init__(self):
+        self.events = 0
+
+    def create_log_stream(self, logGroupName, logStreamName):
+        return {}
+
+    def put_log_events(self, logGroupName, logStreamName, logEvents):
+        self.events += len(logEvents)
+        return {}
+
+
+class DynamoDBStandIn:
+    """
+    Accepts the owner markers of abandoned state locks, the stub Terraform binary doesn't lock the state.
+    """
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        return {}
+
+    def put_item(self, TableName, Item, **kwargs):
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        return {}
+
+
+class CloudFormationStandIn:
+    """
+    Reports every stack as being updated.
+    """
+
+    exceptions = type('Exceptions', (), {'ClientError': ClientError})
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': 'UPDATE_IN_PROGRESS'}]}
+
+
+class ResponseHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Records custom resource responses sent to the ResponseURL.
+    """
+
+    responses = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.responses.append(json.loads(body))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Context:
+    """
+    Imitates the Lambda context object.
+    """
+
+    log_stream_name = 'benchmark'
+
+    def __init__(self, timeout=900):
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+class PhaseTimer:
+    """
+    Wraps functions of the main module to accumulate their durations by handler phase.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.intervals = []
+        self.originals = {}
+
+    def reset(self):
+        self.timings = {}
+        self.intervals = []
+
+    def add(self, phase, start_time, end_time):
+        self.timings[phase] = self.timings.get(phase, 0) + end_time - start_time
+        self.intervals.append((start_time, end_time))
+
+    def span(self):
+        """
+        Returns the wall-clock time covered by any phase, phases of configurations running in parallel overlap.
+        """
+        span, covered_until = 0, None
+        for start_time, end_time in sorted(self.intervals):
+            if covered_until is not None and start_time < covered_until:
+                start_time = covered_until
+            if end_time > start_time:
+                span += end_time - start_time
+            covered_until = end_time if covered_until is None else max(covered_until, end_time)
+        return span
+
+    def wrap(self, name, get_phase):
+        original = getattr(main, name)
+        self.originals[name] = original
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(get_phase(*args, **kwargs), start_time, time.perf_counter())
+
+        setattr(main, name, wrapper)
+
+    def install(self):
+        self.wrap('get_terraform_configuration_content', lambda *args, **kwargs: 'fetch')
+        self.wrap('fetch_terraform_configuration_files', lambda *args, **kwargs: 'fetch')
+        self.wrap('write_terraform_variables', lambda *args, **kwargs: 'variables')
+        self.wrap('run_terraform_command', lambda command, *args, **kwargs: TERRAFORM_COMMAND_PHASES.get(command[1], 'apply'))
+        self.wrap('encode_terraform_outputs', lambda *args, **kwargs: 'output')
+        self.wrap('send_response', lambda *args, **kwargs: 'response')
+
+    def uninstall(self):
+        for name, original in self.originals.items():
+            setattr(main, name, original)
+
+
+def build_configuration(scenario):
+    """
+    Returns the S3 objects and the 'Configuration' property of a scenario.
+    """
+    files = {
+        f"configuration/{'modules/module-%d/' % (index % 10) if index else ''}file-{index}.tf": (f'# file {index}\n' * (scenario['configuration_file_size'] // 10)).encode('utf-8')
+        for index in range(scenario['configuration_files'])
+    }
+    if scenario['configuration'] == 's3-prefix':
+        return files, 's3://benchmark/configuration/'
+
+    content = next(iter(files.values()))
+    if scenario['configuration'] == 's3':
+        return {'configuration/terraform.tf': content}, 's3://benchmark/configuration/terraform.tf'
+
+    return {}, content.decode('utf-8')
+
+
+def build_event(request_type, response_url, properties, old_properties=None):
+    event = {
+        'RequestType': request_type,
+        'ResponseURL': response_url,
+        'StackId': 'arn:aws:cloudformation:us-east-1:123456789012:stack/benchmark/00000000-0000-0000-0000-000000000000',
+        'RequestId': f'benchmark-{time.monotonic_ns()}',
+        'LogicalResourceId': 'Benchmark',
+        'ResourceType': 'Custom::TerraformConfiguration',
+        'ResourceProperties': properties,
+    }
+    if old_properties is not None:
+        event['OldResourceProperties'] = old_properties
+    return event
+
+
+def summarize(samples):
+    summary = {}
+    for phase in [*PHASES, 'overhead', 'total']:
+        values = [sample.get(phase, 0) for sample in samples]
+        summary[phase] = {'median_ms': round(statistics.median(values) * 1000, 2), 'max_ms': round(max(values) * 1000, 2)}
+    return summary
+
+
+def run_scenario(name, scenario, iterations, execution_mode, response_url):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-handler-')
+    try:
+        # Fresh /tmp layout and module caches, like in a new execution environment
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        main.TERRAFORM_PLUGIN_CACHE_DIR = os.path.join(tmp_dir, 'terraform-plugin-cache')
+        main.TERRAFORM_PLUGIN_CACHE_INDEX_PATH = os.path.join(tmp_dir, 'terraform-plugin-cache.index.json')
+        main.TERRAFORM_WORKSPACES_DIR = os.path.join(tmp_dir, 'workspaces')
+        main.CONFIGURATION_CACHE_DIR = os.path.join(tmp_dir, 'configuration-cache')
+        main.configuration_cache.clear()
+        main.terraform_versions.clear()
+
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        objects, configuration = build_configuration(scenario)
+        logs = LogsStandIn()
+        main.aws_clients.clear()
+        main.aws_clients.update({'s3': S3StandIn(objects), 'logs': logs, 'cloudformation': CloudFormationStandIn(), 'dynamodb': DynamoDBStandIn()})
+
+        os.environ.update({
+            'OUTPUTS_OFFLOAD_S3_BUCKET': 'benchmark',
+            'TERRAFORM_BACKEND_S3_BUCKET': 'benchmark',
+            'TERRAFORM_BACKEND_S3_DYNAMODB_TABLE': 'benchmark',
+            'STUB_TERRAFORM_LATENCY': str(scenario['latency']),
+            'STUB_TERRAFORM_STDOUT_LINES': str(scenario['stdout_lines']),
+            'STUB_TERRAFORM_OUTPUTS': str(scenario['outputs']),
+            'STUB_TERRAFORM_OUTPUT_SIZE': str(scenario['output_size']),
+            'STUB_TERRAFORM_THROTTLE_ABOVE': str(scenario['throttle_above']),
+        })
+
+        def properties(revision):
+            # Unchanged Updates repeat the properties of the Create, with the Auto backend next to which the last successful apply is recorded
+            if scenario['unchanged_updates']:
+                revision = 0
+            resource_properties = {
+                'ServiceToken': 'arn:aws:lambda:us-east-1:123456789012:function:benchmark',
+                'Configuration': configuration,
+                'ExecutionMode': execution_mode,
+                'ExecutionLogsTargetArn': 'arn:aws:logs:us-east-1:123456789012:log-group:benchmark:*',
+                'Variables': {f'variable_{index}': f'value-{revision}-{index}' for index in range(scenario['variables'])},
+            }
+            if scenario['parallelism']:
+                resource_properties['Parallelism'] = str(scenario['parallelism'])
+            if scenario['unchanged_updates'] or scenario['configurations']:
+                resource_properties['Backend'] = 'Auto'
+            if scenario['configurations']:
+                # A binary tree of configurations, each one depending on its parent
+                resource_properties['Configurations'] = [
+                    {'Name': f'root_{index}', 'Configuration': resource_properties['Configuration'], 'Variables': resource_properties['Variables'], **({'DependsOn': f'root_{(index - 1) // 2}'} if index else {})}
+                    for index in range(scenario['configurations'])
+                ]
+                del resource_properties['Configuration'], resource_properties['Variables']
+            return resource_properties
+
+        events = [build_event('Create', response_url, properties(0))]
+        events += [build_event('Update', response_url, properties(index), properties(index - 1)) for index in range(1, iterations + 1)]
+        events.append(build_event('Delete', response_url, properties(iterations)))
+
+        samples = {'Create': [], 'Update': [], 'Delete': []}
+        failures = []
+        timer = PhaseTimer()
+        timer.install()
+        try:
+            for event in events:
+                timer.reset()
+                ResponseHandler.responses.clear()
+                start_time = time.perf_counter()
+                with contextlib.redirect_stdout(sys.stderr):
+                    main.handler(event, Context())
+                timings = dict(timer.timings, total=time.perf_counter() - start_time)
+                # Phase durations of parallel configurations add up to more than the wall-clock time they took
+                timings['overhead'] = timings['total'] - timer.span()
+                samples[event['RequestType']].append(timings)
+
+                status = ResponseHandler.responses[-1]['Status'] if ResponseHandler.responses else 'NO RESPONSE'
+                if status != 'SUCCESS':
+                    failures.append({'request_type': event['RequestType'], 'status': status, 'reason': ResponseHandler.responses[-1].get('Reason') if ResponseHandler.responses else None})
+        finally:
+            timer.uninstall()
+
+        return {
+            'scenario': name,
+            'parameters': scenario,
+            'execution_mode': execution_mode,
+            'phases': {request_type: summarize(request_samples) for request_type, request_samples in samples.items()},
+            'log_events': logs.events,
+            'failures': failures,
+        }
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scenarios, iterations, execution_mode):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ResponseHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    response_url = f'http://127.0.0.1:{server.server_address[1]}/response'
+
+    try:
+        results = [run_scenario(name, SCENARIOS[name], iterations, execution_mode, response_url) for name in scenarios]
+    finally:
+        server.shutdown()
+
+    return {
+        'revision': get_revision(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5, help='Number of warm Updates per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--execution-mode', choices=main.SUPPORTED_EXECUTION_MODES, default='Apply')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = json.dumps(run(args.scenarios, args.iterations, args.execution_mode), indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(results + '\n')
+    else:
+        print(results)
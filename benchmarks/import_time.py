@@ -0,0 +1,82 @@
+"""
+Benchmark the cold start of the Lambda function: import time of the main module and latency of
+the first and the following AWS client lookups.
+
+Every sample runs in a fresh Python interpreter, so nothing is cached between samples except the
+operating system file cache. AWS credentials and region are taken from the environment, like in
+Lambda, and dummy values are used if they are not set. No AWS requests are sent. Results are
+printed as JSON.
+
+Usage:
+    python benchmarks/import_time.py [--samples 10] [--services cloudformation logs s3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+SAMPLE_SCRIPT = """
+import json
+import sys
+import time
+
+start_time = time.perf_counter()
+import main
+import_time = time.perf_counter() - start_time
+
+first_call = {}
+next_call = {}
+for service_name in sys.argv[1:]:
+    start_time = time.perf_counter()
+    main.get_aws_client(service_name)
+    first_call[service_name] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    main.get_aws_client(service_name)
+    next_call[service_name] = time.perf_counter() - start_time
+
+print(json.dumps({'import': import_time, 'first_call': first_call, 'next_call': next_call}))
+"""
+
+
+def run_sample(services):
+    environment = dict(os.environ)
+    environment.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    environment.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    environment.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    environment['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    result = subprocess.run([sys.executable, '-c', SAMPLE_SCRIPT, *services], cwd=SRC_DIR, env=environment, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    return {
+        'min_ms': round(min(values) * 1000, 3),
+        'median_ms': round(statistics.median(values) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3),
+    }
+
+
+def run(samples, services):
+    results = [run_sample(services) for _ in range(samples)]
+
+    return {
+        'samples': samples,
+        'import': summarize([result['import'] for result in results]),
+        'first_call': {service_name: summarize([result['first_call'][service_name] for result in results]) for service_name in services},
+        'next_call': {service_name: summarize([result['next_call'][service_name] for result in results]) for service_name in services},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--services', nargs='+', default=['cloudformation', 'logs', 's3'])
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.samples, args.services), indent=2))
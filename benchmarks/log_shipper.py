@@ -0,0 +1,208 @@
+"""
+Check shipping Terraform output to CloudWatch Logs against a stub of the PutLogEvents API.
+
+The stub enforces the PutLogEvents limits (at most 10,000 events and 1 MB per batch, 256 KB per
+event, no empty messages, events in chronological order) and can throttle calls or answer them
+slowly. Every scenario ships lines with the CloudWatchLogsShipper and checks that all of them
+arrive, complete and in order, and that no call violates the limits:
+
+- lines: lines of mixed sizes, from a stdout and a stderr thread like run_terraform_command does.
+- large-lines: lines of multibyte characters larger than an event, which are split.
+- throttled: every other call is throttled, and retried.
+- flush-interval: a single line is shipped within the flush interval, before the shipper is closed.
+- backpressure: slow calls, the number of queued lines stays bounded.
+- terraform: the output of a stub Terraform binary run with run_terraform_command, shipped before
+  flush_cloudwatch_logs returns.
+
+Results are printed as JSON, the exit status is 1 if any check fails.
+
+Usage:
+    python benchmarks/log_shipper.py [--lines 50000] [--scenarios lines large-lines throttled flush-interval backpressure terraform]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError
+
+import main
+
+SCENARIOS = ['lines', 'large-lines', 'throttled', 'flush-interval', 'backpressure', 'terraform']
+
+STUB_TERRAFORM = """#!{python}
+import sys
+
+for index in range(int(sys.argv[2])):
+    print(f'line {{index}}', file=sys.stdout if index % 2 else sys.stderr, flush=index % 100 == 0)
+"""
+
+
+class LogsStub:
+    """
+    Records log events sent with PutLogEvents and reports calls which violate its limits.
+    """
+
+    def __init__(self, throttle_every=0, latency=0):
+        self.throttle_every = throttle_every
+        self.latency = latency
+        self.calls = 0
+        self.throttled = 0
+        self.messages = []
+        self.violations = []
+        self.lock = threading.Lock()
+
+    def create_log_stream(self, logGroupName, logStreamName):
+        return {}
+
+    def put_log_events(self, logGroupName, logStreamName, logEvents):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if self.throttle_every and self.calls % self.throttle_every == 0:
+                self.throttled += 1
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'PutLogEvents')
+
+            sizes = [len(event['message'].encode('utf-8')) + main.CLOUDWATCH_LOGS_EVENT_OVERHEAD for event in logEvents]
+            if not logEvents:
+                self.violations.append('empty batch')
+            if len(logEvents) > main.CLOUDWATCH_LOGS_MAX_BATCH_EVENTS:
+                self.violations.append(f'{len(logEvents)} events in a batch')
+            if sum(sizes) > main.CLOUDWATCH_LOGS_MAX_BATCH_SIZE:
+                self.violations.append(f'batch of {sum(sizes)} bytes')
+            if max(sizes, default=0) > 256 * 1024:
+                self.violations.append(f'event of {max(sizes)} bytes')
+            if any(not event['message'] for event in logEvents):
+                self.violations.append('empty message')
+            if any(previous['timestamp'] > event['timestamp'] for previous, event in zip(logEvents, logEvents[1:])):
+                self.violations.append('events out of chronological order')
+            self.messages.extend(event['message'] for event in logEvents)
+
+        return {}
+
+
+def ship(lines, stub, sources=1):
+    """
+    Ships the lines from the given number of threads, each putting every n-th line, and returns
+    the duration and the largest number of queued lines seen.
+    """
+    shipper = main.CloudWatchLogsShipper('check', 'check', client=stub)
+    max_queued = 0
+
+    def put(offset):
+        nonlocal max_queued
+        for line in lines[offset::sources]:
+            shipper.put(line)
+            max_queued = max(max_queued, shipper.lines.qsize())
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=put, args=(offset,)) for offset in range(sources)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shipper.close()
+    return time.perf_counter() - start_time, max_queued
+
+
+def check_delivered(lines, stub, sources=1):
+    """
+    Returns whether every source's lines arrived completely and in order.
+    """
+    for offset in range(sources):
+        expected = [line.rstrip('\n') for line in lines[offset::sources]]
+        expected_set = set(expected)
+        delivered = [message for message in stub.messages if message in expected_set]
+        if delivered != expected:
+            return False
+    return True
+
+
+def run_scenario(scenario, line_count, tmp_dir):
+    checks = {}
+    details = {}
+
+    if scenario in ('lines', 'throttled', 'backpressure'):
+        stub = LogsStub(throttle_every=2 if scenario == 'throttled' else 0, latency=0.05 if scenario == 'backpressure' else 0)
+        lines = [f'line {index} ' + 'x' * (index % 500) + '\n' for index in range(line_count)]
+        sources = 2 if scenario == 'lines' else 1
+        duration, max_queued = ship(lines, stub, sources)
+        checks['delivered'] = check_delivered(lines, stub, sources)
+        checks['queue_bounded'] = max_queued <= main.CLOUDWATCH_LOGS_MAX_QUEUED_LINES
+        details['max_queued_lines'] = max_queued
+
+    elif scenario == 'large-lines':
+        stub = LogsStub()
+        # 3-byte characters, which an event boundary mustn't split
+        lines = [f'{index} ' + '€' * (200 * 1024 + index * 1024) + '\n' for index in range(5)]
+        duration, _ = ship(lines, stub)
+        checks['delivered'] = ''.join(stub.messages) == ''.join(line.rstrip('\n') for line in lines)
+
+    elif scenario == 'flush-interval':
+        stub = LogsStub()
+        shipper = main.CloudWatchLogsShipper('check', 'check', client=stub)
+        start_time = time.perf_counter()
+        shipper.put('a single line\n')
+        while not stub.messages and time.perf_counter() - start_time < main.CLOUDWATCH_LOGS_FLUSH_INTERVAL * 3:
+            time.sleep(0.01)
+        duration = time.perf_counter() - start_time
+        checks['delivered'] = stub.messages == ['a single line']
+        checks['within_flush_interval'] = duration < main.CLOUDWATCH_LOGS_FLUSH_INTERVAL + 0.5
+        shipper.close()
+
+    elif scenario == 'terraform':
+        stub = LogsStub()
+        main.aws_clients['logs'] = stub
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        with open(main.TERRAFORM_BINARY, 'w') as stub_file:
+            stub_file.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        start_time = time.perf_counter()
+        main.run_terraform_command([main.TERRAFORM_BINARY, 'apply', str(line_count)], log_group='check', log_stream_name='check', working_dir=tmp_dir)
+        main.flush_cloudwatch_logs('check', 'check')
+        duration = time.perf_counter() - start_time
+        checks['delivered'] = sorted(stub.messages) == sorted(f'line {index}' for index in range(line_count))
+        checks['shipper_stopped'] = ('check', 'check') not in main.cloudwatch_logs_shippers
+
+    checks['within_limits'] = not stub.violations
+    return {
+        'scenario': scenario,
+        'duration_ms': round(duration * 1000, 2),
+        'calls': stub.calls,
+        'throttled_calls': stub.throttled,
+        'events': len(stub.messages),
+        'violations': sorted(set(stub.violations)),
+        'checks': checks,
+        **details,
+    }
+
+
+def run(scenarios, line_count):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-log-shipper-')
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            results = [run_scenario(scenario, line_count, tmp_dir) for scenario in scenarios]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'lines': line_count, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=50000, help='Number of lines shipped per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    args = parser.parse_args()
+
+    results = run(args.scenarios, args.lines)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(all(result['checks'].values()) for result in results['results']) else 1)
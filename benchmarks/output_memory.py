@@ -0,0 +1,131 @@
+"""
+Benchmark the peak memory of running Terraform commands with large outputs.
+
+A stub Terraform binary writes a synthetic output of the given size, mostly to stderr like TF_LOG
+does, and fails. Every runner is measured in a fresh Python process, whose peak RSS is reported
+along with the duration and the size of the error reason:
+
+- idle: only imports the Lambda function, for reference.
+- capture: 'subprocess.run(capture_output=True, text=True)' with the whole output in the error
+  reason, as Terraform commands used to be run.
+- streaming: run_terraform_command logging to the function log.
+- streaming-cloudwatch: run_terraform_command shipping to a CloudWatch Logs stand-in.
+
+Results are printed as JSON.
+
+Usage:
+    python benchmarks/output_memory.py [--size-mb 100] [--stderr-share 0.9]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+RUNNERS = ['idle', 'capture', 'streaming', 'streaming-cloudwatch']
+
+STUB_TERRAFORM = """#!{python}
+import os
+import sys
+
+size = int(os.environ['STUB_TERRAFORM_OUTPUT_SIZE'])
+stderr_share = float(os.environ['STUB_TERRAFORM_STDERR_SHARE'])
+line = 'x' * 99 + '\\n'
+for index in range(size // len(line)):
+    stream = sys.stderr if (index % 100) < stderr_share * 100 else sys.stdout
+    stream.write(f'{{index:012d}} [DEBUG] provider: {{line[34:]}}')
+print('Error: Synthetic failure after a verbose run', file=sys.stderr)
+sys.exit(1)
+"""
+
+
+class LogsStandIn:
+    """
+    Accepts log events without keeping them.
+    """
+
+    def create_log_stream(self, logGroupName, logStreamName):
+        return {}
+
+    def put_log_events(self, logGroupName, logStreamName, logEvents):
+        return {}
+
+
+def run_child(runner, terraform_binary, working_dir):
+    """
+    Runs a Terraform command with the given runner in this process and returns its measurements.
+    """
+    import main
+
+    start_time = time.perf_counter()
+    reason = ''
+    if runner == 'capture':
+        result = subprocess.run([terraform_binary, 'apply'], capture_output=True, text=True, cwd=working_dir)
+        reason = f"Terraform error: {result.stderr}\nSTDOUT: {result.stdout}"
+    elif runner.startswith('streaming'):
+        log_group = log_stream_name = None
+        if runner == 'streaming-cloudwatch':
+            main.aws_clients['logs'] = LogsStandIn()
+            log_group, log_stream_name = 'benchmark', 'benchmark'
+        try:
+            main.run_terraform_command([terraform_binary, 'apply'], log_group, log_stream_name, working_dir=working_dir)
+        except RuntimeError as e:
+            reason = str(e)
+        main.flush_cloudwatch_logs(log_group, log_stream_name)
+
+    spilled = sum(os.path.getsize(os.path.join(working_dir, name)) for name in os.listdir(working_dir) if name.startswith('terraform-output'))
+    return {
+        'runner': runner,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'duration_ms': round((time.perf_counter() - start_time) * 1000, 2),
+        'reason_bytes': len(reason.encode('utf-8')),
+        'response_reason_bytes': len(json.dumps(main.trim_response_reason(reason, main.CLOUDFORMATION_RESPONSE_MAX_SIZE - 512))) - 2,
+        'spilled_bytes': spilled,
+    }
+
+
+def run(size, stderr_share):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-output-memory-')
+    try:
+        terraform_binary = os.path.join(tmp_dir, 'terraform')
+        with open(terraform_binary, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(terraform_binary, 0o755)
+
+        environment = dict(os.environ, STUB_TERRAFORM_OUTPUT_SIZE=str(size), STUB_TERRAFORM_STDERR_SHARE=str(stderr_share))
+        results = []
+        for runner in RUNNERS:
+            working_dir = os.path.join(tmp_dir, runner)
+            os.makedirs(working_dir)
+            # Logged output goes to the child's stderr, which is discarded
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', runner, '--terraform', terraform_binary, '--working-dir', working_dir],
+                env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+            )
+            results.append(json.loads(child.stdout))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'output_bytes': size, 'stderr_share': stderr_share, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--stderr-share', type=float, default=0.9)
+    parser.add_argument('--child', choices=RUNNERS, help=argparse.SUPPRESS)
+    parser.add_argument('--terraform', help=argparse.SUPPRESS)
+    parser.add_argument('--working-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.terraform, args.working_dir)))
+    else:
+        print(json.dumps(run(args.size_mb * 1024 * 1024, args.stderr_share), indent=2))
@@ -0,0 +1,187 @@
+"""
+Benchmark overlapping the calls the handler makes before Terraform starts.
+
+The stack status check, the fetch of a configuration from S3 and the creation of the CloudWatch
+Logs stream go to in-process stand-ins which add a simulated round trip latency to every call.
+Terraform is the stub binary of the handler benchmark. Each mode runs a cold Create, a number of
+warm Updates and a Delete, and reports the median handler duration, the duration of the setup
+stage and the time saved by overlapping its calls (the SetupDuration and SetupTimeSaved metrics):
+
+- sequential: a single setup thread, which makes the calls one after another like before.
+- overlapped: the default number of setup threads.
+
+The rollback result measures a Delete during ROLLBACK_IN_PROGRESS, which is answered as soon as
+the stack status is known while the configuration fetch is still in flight. Results are printed as
+JSON.
+
+Usage:
+    python benchmarks/setup_stage.py [--iterations 10] [--stack-status-latency 0.1] [--s3-latency 0.08] [--logs-latency 0.05]
+"""
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import main
+from handler import STUB_TERRAFORM, CloudFormationStandIn, Context, DynamoDBStandIn, LogsStandIn, ResponseHandler, S3StandIn, build_event
+
+CONFIGURATION_KEY = 'configuration/terraform.tf'
+
+
+class DelayedStandIn:
+    """
+    Delays every call to a stand-in by the given latency, like a round trip to the AWS API.
+    """
+
+    def __init__(self, stand_in, latency):
+        self.stand_in = stand_in
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attribute = getattr(self.stand_in, name)
+        if not callable(attribute) or isinstance(attribute, type):
+            return attribute
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+class RollbackStandIn(CloudFormationStandIn):
+    """
+    Reports every stack as being rolled back.
+    """
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': 'ROLLBACK_IN_PROGRESS'}]}
+
+
+def invoke(event):
+    """
+    Runs the handler and returns its duration, its metrics and the response status.
+    """
+    ResponseHandler.responses.clear()
+    stdout = io.StringIO()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(stdout):
+        main.handler(event, Context())
+    duration = time.perf_counter() - start_time
+
+    metrics = {}
+    for line in stdout.getvalue().splitlines():
+        if line.startswith('{"_aws"'):
+            metrics = json.loads(line)
+    status = ResponseHandler.responses[-1]['Status'] if ResponseHandler.responses else 'NO RESPONSE'
+    return {'duration': duration, 'metrics': metrics, 'status': status}
+
+
+def summarize(samples):
+    return {
+        'handler_median_ms': round(statistics.median(sample['duration'] for sample in samples) * 1000, 2),
+        'setup_median_ms': round(statistics.median(sample['metrics'].get('SetupDuration', 0) for sample in samples), 2),
+        'setup_time_saved_median_ms': round(statistics.median(sample['metrics'].get('SetupTimeSaved', 0) for sample in samples), 2),
+        'statuses': sorted({sample['status'] for sample in samples}),
+    }
+
+
+def run_mode(workers, iterations, latencies, response_url):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-setup-stage-')
+    try:
+        main.SETUP_MAX_WORKERS = workers
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        main.TERRAFORM_PLUGIN_CACHE_DIR = os.path.join(tmp_dir, 'terraform-plugin-cache')
+        main.TERRAFORM_PLUGIN_CACHE_INDEX_PATH = os.path.join(tmp_dir, 'terraform-plugin-cache.index.json')
+        main.TERRAFORM_WORKSPACES_DIR = os.path.join(tmp_dir, 'workspaces')
+        main.CONFIGURATION_CACHE_DIR = os.path.join(tmp_dir, 'configuration-cache')
+        main.configuration_cache.clear()
+        main.terraform_versions.clear()
+
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        main.aws_clients.clear()
+        main.aws_clients.update({
+            's3': DelayedStandIn(S3StandIn({CONFIGURATION_KEY: b'resource "stub_resource" "example" {}\n'}), latencies['s3']),
+            'logs': DelayedStandIn(LogsStandIn(), latencies['logs']),
+            'cloudformation': DelayedStandIn(CloudFormationStandIn(), latencies['stack_status']),
+            'dynamodb': DynamoDBStandIn(),
+        })
+
+        def properties(revision):
+            return {
+                'ServiceToken': 'arn:aws:lambda:us-east-1:123456789012:function:benchmark',
+                'Configuration': f's3://benchmark/{CONFIGURATION_KEY}',
+                'ExecutionLogsTargetArn': 'arn:aws:logs:us-east-1:123456789012:log-group:benchmark:*',
+                'Variables': {'revision': str(revision)},
+            }
+
+        events = [build_event('Create', response_url, properties(0))]
+        events += [build_event('Update', response_url, properties(index), properties(index - 1)) for index in range(1, iterations + 1)]
+        events.append(build_event('Delete', response_url, properties(iterations)))
+        samples = [invoke(event) for event in events]
+
+        # A Delete of a rollback doesn't wait for the configuration fetch still in flight
+        main.aws_clients['cloudformation'] = DelayedStandIn(RollbackStandIn(), latencies['stack_status'])
+        rollback = invoke(build_event('Delete', response_url, properties(0)))
+
+        return {
+            'workers': workers,
+            'results': summarize(samples),
+            'rollback_delete': {'handler_ms': round(rollback['duration'] * 1000, 2), 'status': rollback['status']},
+        }
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def run(iterations, latencies):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ResponseHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    response_url = f'http://127.0.0.1:{server.server_address[1]}/response'
+    os.environ.update({
+        'OUTPUTS_OFFLOAD_S3_BUCKET': 'benchmark',
+        # Every invocation fetches the configuration, like when it changes between invocations
+        'CONFIGURATION_CACHE_TTL': '0',
+        'STUB_TERRAFORM_LATENCY': '0.05',
+        'STUB_TERRAFORM_STDOUT_LINES': '20',
+        'STUB_TERRAFORM_OUTPUTS': '5',
+        'STUB_TERRAFORM_OUTPUT_SIZE': '32',
+    })
+
+    default_workers = main.SETUP_MAX_WORKERS
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            results = {
+                'sequential': run_mode(1, iterations, latencies, response_url),
+                'overlapped': run_mode(default_workers, iterations, latencies, response_url),
+            }
+    finally:
+        main.SETUP_MAX_WORKERS = default_workers
+        server.shutdown()
+
+    return {'iterations': iterations, 'latencies_s': latencies, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10, help='Number of warm Updates per mode')
+    parser.add_argument('--stack-status-latency', type=float, default=0.1)
+    parser.add_argument('--s3-latency', type=float, default=0.08)
+    parser.add_argument('--logs-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.iterations, {'stack_status': args.stack_status_latency, 's3': args.s3_latency, 'logs': args.logs_latency}), indent=2))
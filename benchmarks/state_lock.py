@@ -0,0 +1,276 @@
+"""
+Benchmark waiting for the state lock of the Auto backend under contention.
+
+A stub Terraform binary locks the state in a DynamoDB stand-in shared through files, like the S3
+backend does, waiting for '-lock-timeout' and failing with the state lock error if it can't acquire
+the lock. Every scenario runs 'terraform apply' with run_terraform_locking_command and reports how
+long it took, how long it waited for the lock (the StateLockWaitDuration metric), how many DynamoDB
+calls it made and whether it succeeded:
+
+- uncontended: nobody holds the lock, DynamoDB isn't called at all.
+- contended: another invocation holds the lock for --hold seconds, then releases it.
+- abandoned: the apply outlasts the execution deadline and ignores SIGINT, so it is killed while
+  holding the lock, and the owner marker records the ID of the lock it left behind.
+- stale: the lock was left by an invocation which timed out, it is force-unlocked.
+- stale-reacquired: the owner marker of an invocation which timed out recorded another lock than the
+  one held now, which is not force-unlocked, the apply fails.
+- foreign: a lock without an owner, e.g. of a developer running Terraform, is held beyond the
+  lock wait budget, the apply fails.
+
+Results are printed as JSON, the exit status is 1 if any scenario doesn't end as expected.
+
+Usage:
+    python benchmarks/state_lock.py [--hold 3] [--lock-budget 6] [--repeat 3]
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError
+
+import main
+
+LOCK_ID = 'benchmark/terraform-state/benchmark/00000000-0000-0000-0000-000000000000/Benchmark'
+
+STUB_TERRAFORM = """#!{python}
+import datetime
+import hashlib
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+
+command = sys.argv[1]
+if os.environ.get('STUB_TERRAFORM_IGNORE_SIGINT'):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+items_dir = os.environ['STUB_DYNAMODB_DIR']
+lock_path = os.path.join(items_dir, hashlib.sha256(os.environ['STUB_LOCK_ID'].encode('utf-8')).hexdigest() + '.json')
+
+if command == 'force-unlock':
+    with open(lock_path) as lock_file:
+        if json.loads(json.load(lock_file)['Info']['S'])['ID'] == sys.argv[-1]:
+            os.remove(lock_path)
+    sys.exit(0)
+
+lock_timeout = float([argument for argument in sys.argv if argument.startswith('-lock-timeout=')][0][14:-1])
+info = {{'ID': str(uuid.uuid4()), 'Operation': 'OperationTypeApply', 'Who': 'stub@' + socket.gethostname(), 'Created': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')}}
+start_time = time.monotonic()
+while True:
+    try:
+        with open(lock_path, 'x') as lock_file:
+            json.dump({{'LockID': {{'S': os.environ['STUB_LOCK_ID']}}, 'Info': {{'S': json.dumps(info)}}}}, lock_file)
+        break
+    except FileExistsError:
+        if time.monotonic() - start_time >= lock_timeout:
+            print('Error: Error acquiring the state lock', file=sys.stderr)
+            sys.exit(1)
+        time.sleep(0.1)
+
+time.sleep(float(os.environ['STUB_TERRAFORM_LATENCY']))
+os.remove(lock_path)
+"""
+
+
+class DynamoDBStandIn:
+    """
+    Stores items as files, so that the stub Terraform binary can lock the state as well, evaluates
+    the condition expressions used for the owner marker of the state lock and counts the calls.
+    """
+
+    def __init__(self, items_dir):
+        self.items_dir = items_dir
+        self.calls = 0
+
+    def get_path(self, key):
+        return os.path.join(self.items_dir, hashlib.sha256(key['LockID']['S'].encode('utf-8')).hexdigest() + '.json')
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        self.calls += 1
+        try:
+            with open(self.get_path(Key)) as item_file:
+                return {'Item': json.load(item_file)}
+        except FileNotFoundError:
+            return {}
+
+    def check(self, item, ConditionExpression=None, ExpressionAttributeValues=None):
+        if not ConditionExpression:
+            return
+        values = ExpressionAttributeValues or {}
+        for clause in ConditionExpression.split(' OR '):
+            if clause == 'attribute_not_exists(LockID)' and item is None:
+                return
+            if clause == 'Expires < :now' and item and float(item['Expires']['N']) < float(values[':now']['N']):
+                return
+            if clause == 'RequestId = :request_id' and item and item.get('RequestId') == values[':request_id']:
+                return
+        raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+
+    def put_item(self, TableName, Item, **kwargs):
+        self.check(self.get_item(TableName, Item).get('Item'), **kwargs)
+        with open(self.get_path(Item), 'w') as item_file:
+            json.dump(Item, item_file)
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self.check(self.get_item(TableName, Key).get('Item'), **kwargs)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.get_path(Key))
+
+
+def lock_state(dynamodb, owner=None):
+    """
+    Writes the lock item the way Terraform does, and the owner marker of the invocation holding it,
+    if any, which recorded the ID of another lock if owner['reacquired'] is set.
+    """
+    created = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=owner['age'] if owner else 0)
+    info = {'ID': f'lock-{time.monotonic_ns()}', 'Operation': 'OperationTypeApply', 'Who': 'holder@benchmark', 'Created': created.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+    dynamodb.put_item(TableName='benchmark', Item={'LockID': {'S': LOCK_ID}, 'Info': {'S': json.dumps(info)}})
+    if owner:
+        dynamodb.put_item(TableName='benchmark', Item={
+            'LockID': {'S': LOCK_ID + main.TERRAFORM_STATE_LOCK_OWNER_SUFFIX},
+            'RequestId': {'S': 'timed-out-request'},
+            'Created': {'N': str(created.timestamp() - 1)},
+            'Expires': {'N': str(created.timestamp() + owner['timeout'])},
+            'LockId': {'S': 'lock-released-since' if owner.get('reacquired') else info['ID']},
+        })
+
+
+def unlock_state(dynamodb, delay):
+    time.sleep(delay)
+    dynamodb.delete_item(TableName='benchmark', Key={'LockID': {'S': LOCK_ID}})
+
+
+def run_apply(dynamodb, working_dir, lock_budget):
+    # A deadline which leaves exactly the given lock wait budget to the apply phase
+    deadline = main.ExecutionDeadline(
+        main.EXECUTION_RESPONSE_RESERVE + main.EXECUTION_PHASE_RESERVES['apply'] + main.TERRAFORM_INTERRUPT_GRACE_PERIOD + lock_budget / main.TERRAFORM_STATE_LOCK_TIMEOUT_SHARE
+    )
+    deadline.phase = 'apply'
+    state_lock = main.get_terraform_state_lock({'RequestId': f'benchmark-{time.monotonic_ns()}'}, tuple(LOCK_ID.split('/', 1)))
+
+    metrics = main.InvocationMetrics({})
+    main.current_invocation.metrics = metrics
+    dynamodb.calls = 0
+    start_time = time.perf_counter()
+    try:
+        main.run_terraform_locking_command([main.TERRAFORM_BINARY, 'apply', '-auto-approve', '-no-color'], environment=dict(os.environ), working_dir=working_dir, deadline=deadline, state_lock=state_lock)
+        status = 'SUCCESS'
+    except RuntimeError:
+        status = 'FAILED'
+    except main.ExecutionDeadlineExceeded:
+        status = 'INTERRUPTED'
+    finally:
+        main.current_invocation.metrics = None
+    duration = time.perf_counter() - start_time
+    calls = dynamodb.calls
+
+    # Whether the owner marker of the apply recorded the ID of the lock it left behind
+    lock, owner = main.read_terraform_state_lock(state_lock)
+
+    return {
+        'status': status,
+        'duration': duration,
+        'lock_wait': metrics.values.get('StateLockWaitDuration', 0) / 1000,
+        'force_unlocks': metrics.values.get('StateLockForceUnlocks', 0),
+        'dynamodb_calls': calls,
+        'lock_id_recorded': bool(lock and owner and owner['LockId'] == lock['ID'] and owner['RequestId'] == state_lock['request_id']),
+        'owner_left': bool(owner),
+    }
+
+
+def summarize(samples):
+    return {
+        'statuses': sorted({sample['status'] for sample in samples}),
+        'median_ms': round(statistics.median(sample['duration'] for sample in samples) * 1000, 2),
+        'lock_wait_median_ms': round(statistics.median(sample['lock_wait'] for sample in samples) * 1000, 2),
+        'force_unlocks': sum(sample['force_unlocks'] for sample in samples),
+        'dynamodb_calls_median': statistics.median(sample['dynamodb_calls'] for sample in samples),
+        'lock_ids_recorded': sum(sample['lock_id_recorded'] for sample in samples),
+        'owner_markers_left': sum(sample['owner_left'] for sample in samples),
+    }
+
+
+def run(hold, lock_budget, repeat):
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-state-lock-')
+    try:
+        items_dir = os.path.join(tmp_dir, 'dynamodb')
+        os.makedirs(items_dir)
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM.format(python=sys.executable))
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+        # The abandoned scenario waits for the grace period before the stub is killed
+        main.TERRAFORM_INTERRUPT_GRACE_PERIOD = 1
+
+        dynamodb = DynamoDBStandIn(items_dir)
+        main.aws_clients['dynamodb'] = dynamodb
+        os.environ.update({
+            'TERRAFORM_BACKEND_S3_DYNAMODB_TABLE': 'benchmark',
+            'STUB_DYNAMODB_DIR': items_dir,
+            'STUB_LOCK_ID': LOCK_ID,
+        })
+
+        def contended():
+            lock_state(dynamodb)
+            threading.Thread(target=unlock_state, args=(dynamodb, hold), daemon=True).start()
+
+        stale_owner = {'age': 900 + main.TERRAFORM_STATE_LOCK_STALE_GRACE_PERIOD + 10, 'timeout': 900}
+        # Preparation, apply duration (seconds), lock wait budget (seconds) and expected outcome of each scenario
+        scenarios = {
+            'uncontended': (lambda: None, 0.05, lock_budget, {'statuses': ['SUCCESS'], 'force_unlocks': 0, 'dynamodb_calls_median': 0, 'owner_markers_left': 0}),
+            'contended': (contended, 0.05, lock_budget, {'statuses': ['SUCCESS'], 'force_unlocks': 0, 'owner_markers_left': 0}),
+            # The apply phase runs out of time after twice the lock wait budget
+            'abandoned': (lambda: None, 60, 1, {'statuses': ['INTERRUPTED'], 'force_unlocks': 0, 'lock_ids_recorded': repeat, 'owner_markers_left': repeat}),
+            'stale': (lambda: lock_state(dynamodb, stale_owner), 0.05, lock_budget, {'statuses': ['SUCCESS'], 'force_unlocks': repeat, 'owner_markers_left': 0}),
+            'stale-reacquired': (lambda: lock_state(dynamodb, {**stale_owner, 'reacquired': True}), 0.05, lock_budget, {'statuses': ['FAILED'], 'force_unlocks': 0}),
+            'foreign': (lambda: lock_state(dynamodb), 0.05, lock_budget, {'statuses': ['FAILED'], 'force_unlocks': 0}),
+        }
+
+        results = {}
+        for name, (prepare, latency, scenario_lock_budget, expected) in scenarios.items():
+            os.environ['STUB_TERRAFORM_LATENCY'] = str(latency)
+            if name == 'abandoned':
+                os.environ['STUB_TERRAFORM_IGNORE_SIGINT'] = '1'
+            else:
+                os.environ.pop('STUB_TERRAFORM_IGNORE_SIGINT', None)
+            samples = []
+            for _ in range(repeat):
+                for file_name in os.listdir(items_dir):
+                    os.remove(os.path.join(items_dir, file_name))
+                prepare()
+                samples.append(run_apply(dynamodb, tmp_dir, scenario_lock_budget))
+            results[name] = summarize(samples)
+            results[name]['expected'] = all(results[name][key] == value for key, value in expected.items())
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'repeat': repeat, 'hold_s': hold, 'lock_budget_s': lock_budget, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hold', type=float, default=3, help='Seconds the lock is held by another invocation in the contended scenario')
+    parser.add_argument('--lock-budget', type=float, default=6, help='Seconds the apply may wait for the lock')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.hold, args.lock_budget, args.repeat)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result['expected'] for result in results['results'].values()) else 1)
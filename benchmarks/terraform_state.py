@@ -0,0 +1,116 @@
+"""
+Benchmark reading outputs and the presence of resources from multi-MB Terraform states.
+
+States with a number of outputs and enough resources to reach each size are read with
+read_terraform_state_summary, which stops at the beginning of the resources, and compared with
+decoding the whole document. If a Terraform binary is given, 'terraform output -json' and
+'terraform state list' on the same state file are measured as well. Results are printed as JSON.
+
+Usage:
+    python benchmarks/terraform_state.py [--sizes-mb 1 10 50] [--repeat 5] [--terraform /usr/local/bin/terraform]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import main
+
+OUTPUTS = 50
+OUTPUT_SIZE = 1024
+RESOURCE_SIZE = 4096
+
+
+def build_state(size):
+    """
+    Returns a state document of about the given size in bytes, in the layout Terraform writes.
+    """
+    resources = [
+        {
+            'mode': 'managed',
+            'type': 'aws_ssm_parameter',
+            'name': f'parameter_{index}',
+            'provider': 'provider["registry.terraform.io/hashicorp/aws"]',
+            'instances': [{'schema_version': 0, 'attributes': {'id': f'/benchmark/{index}', 'value': 'x' * RESOURCE_SIZE}, 'sensitive_attributes': []}],
+        }
+        for index in range(max(1, size // RESOURCE_SIZE))
+    ]
+    state = {
+        'version': 4,
+        'terraform_version': '1.9.8',
+        'serial': 1,
+        'lineage': '00000000-0000-0000-0000-000000000000',
+        'outputs': {f'output_{index}': {'value': 'x' * OUTPUT_SIZE, 'type': 'string'} for index in range(OUTPUTS)},
+        'resources': resources,
+        'check_results': None,
+    }
+    return json.dumps(state, indent=2).encode('utf-8')
+
+
+def measure(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'median_ms': round(statistics.median(durations) * 1000, 2), 'min_ms': round(min(durations) * 1000, 2), 'peak_memory_bytes': peak_memory}
+
+
+def read_full(document):
+    state = json.load(io.BytesIO(document))
+    return state['outputs'], bool(state['resources'])
+
+
+def run(sizes_mb, repeat, terraform_binary=None):
+    results = []
+    for size_mb in sizes_mb:
+        document = build_state(size_mb * 1024 * 1024)
+        result = {
+            'state_bytes': len(document),
+            'summary_bytes_read': main.read_terraform_state_summary(io.BytesIO(document))['bytes_read'],
+            'summary': measure(lambda: main.read_terraform_state_summary(io.BytesIO(document)), repeat),
+            'full_decode': measure(lambda: read_full(document), repeat),
+        }
+
+        if terraform_binary:
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                state_path = os.path.join(tmp_dir, 'terraform.tfstate')
+                with open(state_path, 'wb') as state_file:
+                    state_file.write(document)
+                for name, command in [('terraform_output', ['output', '-json']), ('terraform_state_list', ['state', 'list'])]:
+                    result[name] = measure(lambda: subprocess.run([terraform_binary, *command, f'-state={state_path}'], cwd=tmp_dir, capture_output=True, check=True), repeat)
+                    # Memory of the Terraform process isn't traced
+                    del result[name]['peak_memory_bytes']
+            finally:
+                shutil.rmtree(tmp_dir)
+
+        results.append(result)
+
+    return {'repeat': repeat, 'outputs': OUTPUTS, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--terraform', help='Terraform binary to compare with, skipped if not set')
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.sizes_mb, args.repeat, args.terraform), indent=2))
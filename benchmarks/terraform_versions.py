@@ -0,0 +1,142 @@
+"""
+Benchmark resolving Terraform binaries of the 'TerraformVersion' property.
+
+A release of a stub Terraform binary, padded to the size of a real one, is served with its
+SHA256SUMS file from a local HTTP server and from an in-process S3 stand-in, which both act as the
+releases mirror. The benchmark measures resolving the bundled default version, downloading,
+verifying and extracting the release from each mirror into an empty cache, and resolving it again
+from the cache, as a warm invocation does. Results are printed as JSON.
+
+Usage:
+    python benchmarks/terraform_versions.py [--binary-size-mb 80] [--repeat 3]
+"""
+import argparse
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import main
+
+BUNDLED_VERSION = '1.9.8'
+RELEASE_VERSION = '1.10.0'
+
+STUB_TERRAFORM = f"""#!{sys.executable}
+import json
+print(json.dumps({{'terraform_version': '{BUNDLED_VERSION}'}}))
+"""
+
+
+class S3StandIn:
+    """
+    Serves objects from memory.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def build_release(binary_size):
+    """
+    Returns the mirror files of a release: the archive with a binary of the given size and its SHA256SUMS.
+    """
+    archive_name = f'terraform_{RELEASE_VERSION}_{main.get_terraform_release_platform()}.zip'
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        # Random content doesn't compress, like a real binary mostly doesn't
+        zip_file.writestr('terraform', os.urandom(binary_size))
+    archive = archive.getvalue()
+    checksums = f'{hashlib.sha256(archive).hexdigest()}  {archive_name}\n'.encode('utf-8')
+
+    return {
+        f'{RELEASE_VERSION}/{archive_name}': archive,
+        f'{RELEASE_VERSION}/terraform_{RELEASE_VERSION}_SHA256SUMS': checksums,
+    }
+
+
+def serve(files):
+    class MirrorHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = files.get(self.path.lstrip('/'))
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Length', str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MirrorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(function, repeat, before=None):
+    durations = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return {'median_ms': round(statistics.median(durations) * 1000, 2), 'min_ms': round(min(durations) * 1000, 2)}
+
+
+def resolve(version):
+    with main.terraform_release(version) as terraform_binary:
+        assert os.path.isfile(terraform_binary)
+
+
+def run(binary_size, repeat):
+    files = build_release(binary_size)
+    server = serve(files)
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark-terraform-versions-')
+    try:
+        main.TERRAFORM_BINARY = os.path.join(tmp_dir, 'terraform')
+        main.TERRAFORM_BUNDLED_VERSIONS_DIR = os.path.join(tmp_dir, 'terraform-versions-bundled')
+        main.TERRAFORM_VERSIONS_CACHE_DIR = os.path.join(tmp_dir, 'terraform-versions')
+        main.TERRAFORM_VERSIONS_STAGING_DIR = os.path.join(tmp_dir, 'terraform-versions-staging')
+        main.terraform_versions.clear()
+        main.aws_clients['s3'] = S3StandIn(files)
+        os.environ['TERRAFORM_VERSIONS_STORAGE_SHARE'] = '1'
+
+        with open(main.TERRAFORM_BINARY, 'w') as stub:
+            stub.write(STUB_TERRAFORM)
+        os.chmod(main.TERRAFORM_BINARY, 0o755)
+
+        def clear_cache():
+            shutil.rmtree(main.TERRAFORM_VERSIONS_CACHE_DIR, ignore_errors=True)
+
+        results = {'bundled': measure(lambda: resolve(BUNDLED_VERSION), repeat)}
+        for mirror_name, mirror in [('http', f'http://127.0.0.1:{server.server_address[1]}'), ('s3', 's3://benchmark')]:
+            os.environ['TERRAFORM_RELEASES_MIRROR'] = mirror
+            results[f'{mirror_name}_download'] = measure(lambda: resolve(RELEASE_VERSION), repeat, before=clear_cache)
+            results[f'{mirror_name}_cached'] = measure(lambda: resolve(RELEASE_VERSION), repeat)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'repeat': repeat, 'binary_bytes': binary_size, 'archive_bytes': len(files[next(iter(files))]), 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--binary-size-mb', type=int, default=80)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.binary_size_mb * 1024 * 1024, args.repeat), indent=2))
@@ -0,0 +1,119 @@
+"""
+Benchmark rendering of the 'Variables' property into the working directory.
+
+Variable maps with flat, list and nested values are rendered with write_terraform_variables, both
+inline and from an S3 reference served by an in-process stand-in (a cache miss followed by a
+revalidation), and compared with the previous line-by-line terraform.tfvars renderer. Results are
+printed as JSON.
+
+Usage:
+    python benchmarks/variables_rendering.py [--entries 10000 50000] [--repeat 5]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError
+
+import main
+
+
+class S3StandIn:
+    """
+    Serves objects from memory, with ETags for conditional requests.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        etag = f'"{hash(self.objects[Key])}"'
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]), 'ETag': etag}
+
+
+def write_legacy_terraform_variables(terraform_variables, working_dir):
+    """
+    The terraform.tfvars renderer replaced by write_terraform_variables, kept for comparison.
+    """
+    with open(os.path.join(working_dir, 'terraform.tfvars'), 'w') as f:
+        for key, value in terraform_variables.items():
+            if isinstance(value, list):
+                f.write(f'{key} = {json.dumps(value)}\n')
+            elif isinstance(value, dict):
+                f.write(f'{key} = {{\n')
+                for subkey, subvalue in value.items():
+                    f.write(f'  {subkey} = "{subvalue}"\n')
+                f.write('}\n')
+            else:
+                f.write(f'{key} = "{value}"\n')
+
+
+def build_variables(entries):
+    variables = {}
+    for index in range(entries):
+        if index % 3 == 0:
+            variables[f'variable_{index}'] = f'value-{index}'
+        elif index % 3 == 1:
+            variables[f'variable_{index}'] = [f'item-{index}-{item}' for item in range(5)]
+        else:
+            variables[f'variable_{index}'] = {'name': f'name-{index}', 'tags': {'index': str(index), 'kind': 'benchmark'}}
+    return variables
+
+
+def measure(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        working_dir = tempfile.mkdtemp()
+        try:
+            start_time = time.perf_counter()
+            function(working_dir)
+            durations.append(time.perf_counter() - start_time)
+        finally:
+            shutil.rmtree(working_dir)
+    return {'median_ms': round(statistics.median(durations) * 1000, 2), 'min_ms': round(min(durations) * 1000, 2)}
+
+
+def run(entry_counts, repeat):
+    tmp_dir = tempfile.mkdtemp()
+    main.CONFIGURATION_CACHE_DIR = os.path.join(tmp_dir, 'configuration-cache')
+    results = []
+    try:
+        for entries in entry_counts:
+            variables = build_variables(entries)
+            document = json.dumps(variables).encode('utf-8')
+            url = f's3://benchmark/variables-{entries}.json'
+            main.aws_clients['s3'] = S3StandIn({f'variables-{entries}.json': document})
+            main.configuration_cache.clear()
+
+            results.append({
+                'entries': entries,
+                'document_bytes': len(document),
+                'legacy_tfvars': measure(lambda working_dir: write_legacy_terraform_variables(variables, working_dir), repeat),
+                'inline': measure(lambda working_dir: main.write_terraform_variables(variables, working_dir), repeat),
+                's3_miss': measure(lambda working_dir: (main.configuration_cache.clear(), shutil.rmtree(main.CONFIGURATION_CACHE_DIR, ignore_errors=True), main.write_terraform_variables(url, working_dir)), repeat),
+                's3_revalidated': measure(lambda working_dir: main.write_terraform_variables(url, working_dir), repeat),
+            })
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return {'repeat': repeat, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.entries, args.repeat), indent=2))
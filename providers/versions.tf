@@ -0,0 +1,15 @@
+# Providers bundled into the Lambda package as a filesystem mirror, so that `terraform init`
+# can install them without network access. Keep the list short, the unzipped Lambda package
+# is limited to 250 MB.
+#
+# The versions are pinned by the committed .terraform.lock.hcl in this directory, which the build
+# task mirrors as-is. After changing this file, update the lock file with `task providers-lock`
+# and commit it.
+terraform {
+  required_providers {
+    random = {
+      source  = "hashicorp/random"
+      version = "~> 3.6"
+    }
+  }
+}
@@ -5,22 +5,348 @@ import time
 import json
 import textwrap
 import shutil
+import hashlib
+import re
+import queue
+import random
+import signal
+import threading
+import contextlib
+import stat
+import collections
+import tarfile
+import platform
+import codecs
+import calendar
+import socket
+import zipfile
+import tempfile
+import concurrent.futures
 import cfnresponse
 import urllib3
-import boto3
 from botocore.exceptions import ClientError
 
 # define list of supported resource properties
-SUPPORTED_RESOURCE_PROPERTIES = ['ServiceToken', 'Backend', 'Environment', 'Variables', 'Configuration', 'ExecutionLogsTargetArn']
+SUPPORTED_RESOURCE_PROPERTIES = ['ServiceToken', 'Backend', 'Environment', 'Variables', 'Configuration', 'ExecutionLogsTargetArn', 'ProviderInstallation', 'ExecutionMode', 'ExecutionLogsFormat', 'OutputsOffload', 'SensitiveOutputs', 'UpdateBehavior', 'TerraformVersion', 'Configurations', 'Parallelism']
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize CloudWatch Logs client
-cloudwatch_logs = boto3.client('logs')
+# CloudWatch Logs PutLogEvents limits, see https://docs.aws.amazon.com/AmazonCloudWatchLogs/latest/APIReference/API_PutLogEvents.html
+CLOUDWATCH_LOGS_EVENT_OVERHEAD = 26
+CLOUDWATCH_LOGS_MAX_EVENT_SIZE = 256 * 1024 - CLOUDWATCH_LOGS_EVENT_OVERHEAD
+CLOUDWATCH_LOGS_MAX_BATCH_SIZE = 1024 * 1024
+CLOUDWATCH_LOGS_MAX_BATCH_EVENTS = 10000
+# Terraform output is shipped to CloudWatch Logs at least this often (seconds), or once this many bytes are buffered
+CLOUDWATCH_LOGS_FLUSH_INTERVAL = 1
+CLOUDWATCH_LOGS_FLUSH_SIZE = 256 * 1024
+# Retries of throttled PutLogEvents calls, with exponential backoff starting at CLOUDWATCH_LOGS_RETRY_BASE_DELAY (seconds)
+CLOUDWATCH_LOGS_MAX_RETRIES = 6
+CLOUDWATCH_LOGS_RETRY_BASE_DELAY = 0.2
+CLOUDWATCH_LOGS_RETRYABLE_ERRORS = ['ThrottlingException', 'ServiceUnavailableException']
+# Lines queued for shipping to CloudWatch Logs, reading Terraform output waits for the shipper beyond this
+CLOUDWATCH_LOGS_MAX_QUEUED_LINES = 10000
+
+# Characters of each Terraform output stream kept in memory for error reasons, see TerraformOutputTail
+TERRAFORM_OUTPUT_TAIL_SIZE = 16 * 1024
+# File in the workspace the logged Terraform output is spilled to, rotated once it exceeds TERRAFORM_OUTPUT_FILE_MAX_SIZE (bytes)
+TERRAFORM_OUTPUT_FILE_NAME = 'terraform-output.generated.log'
+TERRAFORM_OUTPUT_FILE_MAX_SIZE = 32 * 1024 * 1024
+# Terraform output which isn't shipped to CloudWatch Logs is logged to the function log in chunks of this size (characters)
+TERRAFORM_OUTPUT_LOG_CHUNK_SIZE = 256 * 1024
+
+# Terraform binary bundled into the Lambda package
+TERRAFORM_BINARY = '/var/task/terraform'
+# Terraform binaries of other versions bundled into the Lambda package, as <version>/terraform, see terraform_release
+TERRAFORM_BUNDLED_VERSIONS_DIR = '/var/task/terraform-versions'
+# Versions accepted by the 'TerraformVersion' property
+TERRAFORM_VERSION_PATTERN = r'\d+\.\d+\.\d+(-[0-9A-Za-z.]+)?'
+# Terraform binaries downloaded from the releases mirror, preserved in /tmp between warm invocations
+TERRAFORM_VERSIONS_CACHE_DIR = '/tmp/terraform-versions'
+# Downloads in progress, kept out of the cache so that eviction never sees them, on the same file system to be renamed into it
+TERRAFORM_VERSIONS_STAGING_DIR = '/tmp/terraform-versions-staging'
+# Share of the function ephemeral storage (/tmp) the downloaded Terraform binaries may occupy
+TERRAFORM_VERSIONS_STORAGE_SHARE_DEFAULT = 0.2
+# Releases mirror with the layout of the official one, an HTTP(S) or S3 URL, and the read timeout of its downloads (seconds)
+TERRAFORM_RELEASES_MIRROR_DEFAULT = 'https://releases.hashicorp.com/terraform'
+TERRAFORM_RELEASE_READ_TIMEOUT = 60
+
+# Terraform provider plugin cache, preserved in /tmp between warm invocations
+TERRAFORM_PLUGIN_CACHE_DIR = '/tmp/terraform-plugin-cache'
+TERRAFORM_PLUGIN_CACHE_INDEX_PATH = '/tmp/terraform-plugin-cache.index.json'
+# Share of the function ephemeral storage (/tmp) the plugin cache may occupy
+TERRAFORM_PLUGIN_CACHE_STORAGE_SHARE_DEFAULT = 0.5
+
+# Terraform provider filesystem mirror bundled into the Lambda package at build time
+TERRAFORM_PROVIDERS_MIRROR_DIR = '/var/task/terraform-providers'
+TERRAFORM_CLI_CONFIG_FILE_NAME = 'terraform.generated.tfrc'
+# 'Auto' installs mirrored providers locally and the rest from their registries, 'Offline' forbids network access
+SUPPORTED_PROVIDER_INSTALLATION_MODES = ['Auto', 'Offline']
+# Errors of 'terraform init' which are worth retrying without the provider mirror
+TERRAFORM_PROVIDER_INSTALLATION_ERRORS = ['Failed to query available provider packages', 'Failed to install provider', 'Inconsistent dependency lock file']
+
+# 'Apply' runs 'terraform apply' and 'terraform output', 'PlanAndApply' applies a saved plan and reads outputs from the apply
+SUPPORTED_EXECUTION_MODES = ['Apply', 'PlanAndApply']
+TERRAFORM_PLAN_FILE_NAME = 'terraform.generated.tfplan'
+
+# 'Text' logs human-readable Terraform output, 'Json' runs plan, apply and destroy with '-json' to log the machine-readable UI
+SUPPORTED_EXECUTION_LOGS_FORMATS = ['Text', 'Json']
+# Number of the slowest resources reported after applying changes, see TerraformUIStream
+TERRAFORM_SLOWEST_RESOURCES_COUNT = 10
+
+# Concurrent operations of plan, apply and destroy if the 'Parallelism' property isn't set, the same as Terraform's own default
+TERRAFORM_PARALLELISM_DEFAULT = 10
+# Largest value of the 'Parallelism' property
+TERRAFORM_PARALLELISM_MAX = 256
+# Bounds of the parallelism picked by the 'Auto' mode, see get_auto_terraform_parallelism
+TERRAFORM_PARALLELISM_AUTO_MIN = 2
+TERRAFORM_PARALLELISM_AUTO_MAX = 64
+# Concurrent operations per vCPU in the 'Auto' mode, operations mostly wait for cloud APIs
+TERRAFORM_PARALLELISM_PER_VCPU = 16
+# Memory (MB) kept for Terraform and provider processes in the 'Auto' mode, and needed by every concurrent operation on top of it
+TERRAFORM_PARALLELISM_MEMORY_RESERVE = 512
+TERRAFORM_PARALLELISM_MEMORY_PER_OPERATION = 32
+# Lambda allocates CPU in proportion to memory, a whole vCPU at this memory size (MB)
+LAMBDA_MEMORY_PER_VCPU = 1769
+# Errors of cloud APIs throttling Terraform, after which the operation is retried with half the parallelism
+TERRAFORM_THROTTLING_PATTERN = r'ThrottlingException|Throttling: |TooManyRequestsException|RequestLimitExceeded|Rate exceeded|SlowDown|429 Too Many Requests'
+TERRAFORM_THROTTLING_MAX_ATTEMPTS = 3
+
+# CloudFormation rejects custom resource responses larger than this (bytes), see https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/crpg-ref-responses.html
+CLOUDFORMATION_RESPONSE_MAX_SIZE = 4096
+# Outputs which don't fit into the response are offloaded to an S3 object ('S3') or to SSM parameters ('SSM'), see encode_terraform_outputs
+SUPPORTED_OUTPUTS_OFFLOAD_TARGETS = ['S3', 'SSM']
+# 'Exclude' leaves sensitive outputs out of the response, 'Include' returns them with NoEcho
+SUPPORTED_SENSITIVE_OUTPUTS_MODES = ['Exclude', 'Include']
+# Largest value of an SSM parameter (bytes), in the advanced tier
+SSM_PARAMETER_MAX_SIZE = 8192
+
+# 'SkipUnchanged' returns the recorded outputs of Updates which change nothing since the last successful apply, 'AlwaysApply' always runs Terraform
+SUPPORTED_UPDATE_BEHAVIORS = ['SkipUnchanged', 'AlwaysApply']
+# Resource properties which don't affect what Terraform applies, see get_terraform_inputs_hash
+TERRAFORM_INPUT_IGNORED_PROPERTIES = ['ServiceToken', 'ExecutionLogsTargetArn', 'ExecutionLogsFormat', 'ExecutionMode', 'OutputsOffload', 'SensitiveOutputs', 'UpdateBehavior', 'Parallelism']
+
+# Seconds of the invocation kept for flushing logs and responding to CloudFormation, see ExecutionDeadline
+EXECUTION_RESPONSE_RESERVE = 5
+# Seconds kept for the phases which follow a phase, so each of them gets at least some time
+EXECUTION_PHASE_RESERVES = {'fetch': 60, 'init': 40, 'apply': 10, 'output': 0, 'destroy': 0}
+# Seconds Terraform gets to stop gracefully and release the state lock after SIGINT, before it is killed
+TERRAFORM_INTERRUPT_GRACE_PERIOD = 20
+# Phases which run Terraform, they only start with more time left than the grace period
+TERRAFORM_EXECUTION_PHASES = ['init', 'apply', 'output', 'destroy']
+
+# Terraform error when a command can't acquire the state lock
+TERRAFORM_STATE_LOCK_ERROR = 'Error acquiring the state lock'
+# Share of the time budget of a phase Terraform commands may wait for the state lock, at most TERRAFORM_STATE_LOCK_TIMEOUT_MAX seconds
+TERRAFORM_STATE_LOCK_TIMEOUT_SHARE = 0.5
+TERRAFORM_STATE_LOCK_TIMEOUT_MAX = 300
+# Attempts of Terraform commands which fail to acquire the state lock, and polling of the lock, with jittered exponential backoff (seconds)
+TERRAFORM_STATE_LOCK_MAX_ATTEMPTS = 3
+TERRAFORM_STATE_LOCK_RETRY_BASE_DELAY = 0.5
+TERRAFORM_STATE_LOCK_RETRY_MAX_DELAY = 1
+# Suffix of the DynamoDB item recording the invocation which abandoned the state lock of the Auto backend, see record_abandoned_terraform_state_lock
+TERRAFORM_STATE_LOCK_OWNER_SUFFIX = '.lock-owner'
+# Seconds after the invocation owning a state lock abandoned it before the lock is stale, for clock differences between hosts
+TERRAFORM_STATE_LOCK_STALE_GRACE_PERIOD = 60
+
+# Terraform states of the auto-configured S3 backend are read in chunks of this size (bytes), see read_terraform_state_summary
+TERRAFORM_STATE_READ_CHUNK_SIZE = 256 * 1024
+
+# Fingerprint of 'terraform init' inputs, stored in the preserved .terraform directory
+TERRAFORM_INIT_FINGERPRINT_FILE_NAME = 'init-fingerprint.json'
+# Dependency lock file, generated by 'terraform init' unless it comes with the configuration
+TERRAFORM_LOCK_FILE_NAME = '.terraform.lock.hcl'
+# The lock file of the previous 'terraform init', set aside in the .terraform directory while the configuration is fetched
+TERRAFORM_PREVIOUS_LOCK_FILE_NAME = 'previous.terraform.lock.hcl'
+
+# Terraform working directories, one per custom resource, reused between warm invocations
+TERRAFORM_WORKSPACES_DIR = '/tmp/workspaces'
+# Share of the function ephemeral storage (/tmp) the workspaces may occupy
+TERRAFORM_WORKSPACES_STORAGE_SHARE_DEFAULT = 0.25
+# Files and directories which are preserved in a workspace between invocations, everything else is generated per request
+TERRAFORM_WORKSPACE_PRESERVED_FILES = ['.terraform', 'terraform.tfstate', 'terraform.tfstate.backup']
+
+# Remote Terraform configurations, cached in memory and in /tmp between warm invocations
+CONFIGURATION_CACHE_DIR = '/tmp/configuration-cache'
+# Cached configurations younger than this (seconds) are used without revalidation, 0 always revalidates
+CONFIGURATION_CACHE_TTL_DEFAULT = 0
+# Share of the function ephemeral storage (/tmp) the cached configurations may occupy
+CONFIGURATION_CACHE_STORAGE_SHARE_DEFAULT = 0.05
+# Total size of the configurations cached in memory (bytes)
+CONFIGURATION_CACHE_MEMORY_MAX_SIZE = 64 * 1024 * 1024
+
+# Multi-file configurations, fetched from archives or S3 prefixes
+CONFIGURATION_ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.tgz')
+CONFIGURATION_MAX_FILES = 1000
+CONFIGURATION_MAX_SIZE = 100 * 1024 * 1024
+# Variables are written in JSON, which preserves nesting and types of the values, and loaded by Terraform automatically
+TERRAFORM_VARIABLES_FILE_NAME = 'terraform.auto.tfvars.json'
+# Variables file with the outputs of the configurations a configuration of the 'Configurations' property depends on
+TERRAFORM_DEPENDENCY_VARIABLES_FILE_NAME = 'terraform.dependencies.auto.tfvars.json'
+# Files of the working directory which don't affect 'terraform init', see get_terraform_init_fingerprint
+TERRAFORM_INIT_FINGERPRINT_IGNORED_FILES = [TERRAFORM_VARIABLES_FILE_NAME, TERRAFORM_DEPENDENCY_VARIABLES_FILE_NAME, TERRAFORM_LOCK_FILE_NAME]
+
+# Properties of the items of the 'Configurations' property
+SUPPORTED_CONFIGURATIONS_ITEM_PROPERTIES = ['Name', 'Configuration', 'Variables', 'DependsOn']
+# Names of the configurations, used as variable names and in backend keys and output names
+CONFIGURATION_NAME_PATTERN = r'^[A-Za-z_][A-Za-z0-9_-]*$'
+# Maximum number of configurations of the 'Configurations' property running at the same time
+CONFIGURATIONS_MAX_WORKERS = 4
+# Objects under an S3 prefix are downloaded by this many threads
+CONFIGURATION_DOWNLOAD_WORKERS = 16
+# Calls made before Terraform starts (stack status, configuration fetch, log stream, Terraform binary, outputs offload record) run by this many threads, see SetupStage
+SETUP_MAX_WORKERS = 5
+# Seconds each call made before Terraform starts may take, unless the execution deadline leaves less
+SETUP_TASK_TIMEOUT = 60
+
+# Namespace and dimension sets (per custom resource and per request type) of the invocation metrics, see InvocationMetrics
+METRICS_NAMESPACE = 'CloudFormationCustomResourceTerraform'
+METRICS_DIMENSIONS = [['RequestType', 'StackName', 'LogicalResourceId'], ['RequestType']]
+
+# Connection pool for fetching remote configurations over HTTP(S)
+http = urllib3.PoolManager(retries=urllib3.Retry(total=10, backoff_factor=0.1), timeout=urllib3.Timeout(total=5))
+
+# AWS clients created on first use and shared by all invocations, see get_aws_client
+aws_clients = {}
+aws_clients_lock = threading.Lock()
+# Connections kept open per AWS client, enough for the parallel S3 prefix download
+AWS_CLIENT_MAX_POOL_CONNECTIONS = CONFIGURATION_DOWNLOAD_WORKERS
+
+def get_aws_client(service_name):
+    """
+    Returns the shared client of an AWS service, creating it on first use.
+
+    boto3 is imported only when the first client is needed, and every client is created once per
+    execution environment, so an invocation pays credential and endpoint resolution only for the
+    services it uses, and warm invocations reuse open connections. Clients are thread safe, but
+    creating them is not.
+
+    Args:
+        service_name (str): The name of the AWS service, e.g. 's3'.
+
+    Returns:
+        The boto3 client of the service.
+    """
+    client = aws_clients.get(service_name)
+    if client is None:
+        with aws_clients_lock:
+            client = aws_clients.get(service_name)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+
+                client = boto3.client(service_name, config=Config(max_pool_connections=AWS_CLIENT_MAX_POOL_CONNECTIONS))
+                aws_clients[service_name] = client
+
+    return client
+
+# Whether the execution environment hasn't served any invocation yet
+cold_start = True
+# Metrics of the invocation running in the current thread, see invocation_metrics
+current_invocation = threading.local()
+
+class InvocationMetrics:
+    """
+    Collects metrics of an invocation and formats them as a CloudWatch Embedded Metric Format (EMF)
+    log line, which CloudWatch Logs extracts metrics from without any API calls from the function.
+
+    Args:
+        dimensions (dict): Dimension values of the metrics, see METRICS_DIMENSIONS.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.values = {}
+        self.units = {}
+        # Configurations of the 'Configurations' property record metrics from several threads
+        self.lock = threading.Lock()
+
+    def add(self, name, value, unit='Count'):
+        """
+        Adds a value to a metric, metrics recorded more than once in an invocation are summed up.
+        """
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def to_emf(self):
+        """
+        Returns the metrics as an EMF log line, see https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+        """
+        return json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': METRICS_DIMENSIONS,
+                    'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in self.values],
+                }],
+            },
+            **self.dimensions,
+            **{name: round(value, 3) for name, value in self.values.items()},
+        })
+
+def record_metric(name, value, unit='Count'):
+    """
+    Records a metric of the invocation running in the current thread, if any.
+
+    Args:
+        name (str): The metric name.
+        value (float): The value added to the metric.
+        unit (str): The CloudWatch unit of the metric.
+    """
+    metrics = getattr(current_invocation, 'metrics', None)
+    if metrics:
+        metrics.add(name, value, unit)
+
+@contextlib.contextmanager
+def measure_phase(phase):
+    """
+    Records the duration of a phase of the invocation as the '<phase>Duration' metric.
+
+    Args:
+        phase (str): The phase name, e.g. 'Init'.
+    """
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        record_metric(f"{phase}Duration", (time.monotonic() - start_time) * 1000, 'Milliseconds')
+
+@contextlib.contextmanager
+def invocation_metrics(event):
+    """
+    Collects metrics of an invocation in the current thread and prints them as an EMF log line when
+    the invocation completes, whether it succeeds or not.
+
+    Args:
+        event (dict): The Lambda event of the invocation.
 
-def send_response(event, context, response_status, response_reason=None, response_data={}):
+    Yields:
+        InvocationMetrics: The metrics of the invocation.
+    """
+    global cold_start
+
+    stack_id = event.get('StackId', '')
+    metrics = InvocationMetrics({
+        'RequestType': event.get('RequestType'),
+        'StackName': stack_id.split('/')[-2] if stack_id.count('/') >= 2 else stack_id,
+        'LogicalResourceId': event.get('LogicalResourceId'),
+    })
+    metrics.add('ColdStart', 1 if cold_start else 0)
+    cold_start = False
+
+    current_invocation.metrics = metrics
+    try:
+        with measure_phase('Handler'):
+            yield metrics
+    finally:
+        current_invocation.metrics = None
+        # EMF log lines must be printed as they are, without the prefix of the Lambda log records
+        print(metrics.to_emf(), flush=True)
+
+def send_response(event, context, response_status, response_reason=None, response_data={}, no_echo=False):
     """
     Send a response to CloudFormation about the result of a custom resource
     invocation.
@@ -34,17 +360,306 @@ def send_response(event, context, response_status, response_reason=None, respons
         the response status.
     :param response_data: An optional dictionary of key-value pairs that will
         be stored in the custom resource's attributes.
+    :param no_echo: Whether the attributes are masked when retrieved with Fn::GetAtt.
     """
     response_url = event['ResponseURL']
 
+    # CloudFormation rejects responses over its size limit, and then waits for the custom resource until it times out
+    if response_reason:
+        response_reason = trim_response_reason(response_reason, CLOUDFORMATION_RESPONSE_MAX_SIZE - get_response_body_size(event, context, response_data, no_echo, reason=''))
+
     physical_resource_id = event['LogicalResourceId'] # assume that replacement will be managed by terraform, see https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/crpg-ref-responses.html#crpg-ref-responses-physicalresourceid.title
 
     try:
-        cfnresponse.send(event, context, responseStatus=response_status, responseData=response_data, physicalResourceId=physical_resource_id, reason=response_reason)
+        cfnresponse.send(event, context, responseStatus=response_status, responseData=response_data, physicalResourceId=physical_resource_id, noEcho=no_echo, reason=response_reason)
     except Exception as e:
         logger.error(f"Failed to send response: {e}")
 
-def get_terraform_configuration_content(terraform_configuration):
+class TransientConfigurationFetchError(Exception):
+
+    """
+    Raised when a remote Terraform configuration can't be fetched because of a transient error,
+    such as a timeout or a 5xx response, for which a stale cached copy may be used.
+    """
+
+# Remote configurations by URL in least recently used order, see fetch_cached_configuration
+configuration_cache = collections.OrderedDict()
+configuration_cache_lock = threading.Lock()
+configuration_cache_stats = {'hit': 0, 'revalidated': 0, 'miss': 0, 'stale': 0}
+
+def get_configuration_cache_paths(url):
+
+    """
+    Get the paths of the disk cache files for a remote configuration.
+
+    Args:
+        url (str): The URL of the configuration.
+
+    Returns:
+        tuple: The paths of the content file and the metadata file.
+    """
+    digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    return os.path.join(CONFIGURATION_CACHE_DIR, digest), os.path.join(CONFIGURATION_CACHE_DIR, f"{digest}.json")
+
+def remember_cached_configuration(url, entry):
+
+    """
+    Keep a remote configuration in the memory cache as the most recently used one, evicting least
+    recently used configurations beyond CONFIGURATION_CACHE_MEMORY_MAX_SIZE.
+
+    Args:
+        url (str): The URL of the configuration.
+        entry (dict): The cache entry, see load_cached_configuration.
+    """
+    with configuration_cache_lock:
+        configuration_cache[url] = entry
+        configuration_cache.move_to_end(url)
+
+        total_size = sum(len(cached_entry['content']) for cached_entry in configuration_cache.values())
+        while total_size > CONFIGURATION_CACHE_MEMORY_MAX_SIZE and len(configuration_cache) > 1:
+            _, evicted_entry = configuration_cache.popitem(last=False)
+            total_size -= len(evicted_entry['content'])
+
+def evict_cached_configurations(max_size):
+
+    """
+    Remove least recently used configurations from the disk cache until it fits into the given size.
+
+    Configurations are ordered by the modification time of their metadata file, which is updated
+    every time a configuration is used.
+
+    Args:
+        max_size (int): The maximum total size of the disk cache in bytes.
+    """
+    entries = {}
+    for file_name in os.listdir(CONFIGURATION_CACHE_DIR):
+        # Files being written by other invocations
+        if file_name.endswith('.tmp'):
+            continue
+        try:
+            file_stat = os.stat(os.path.join(CONFIGURATION_CACHE_DIR, file_name))
+        except FileNotFoundError:
+            continue
+        digest = file_name.split('.', 1)[0]
+        last_used, size = entries.get(digest, (0, 0))
+        last_used = max(last_used, file_stat.st_mtime) if file_name.endswith('.json') else last_used
+        entries[digest] = (last_used, size + file_stat.st_size)
+
+    total_size = sum(size for _, size in entries.values())
+    for digest, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if total_size <= max_size:
+            break
+        logger.info(f"Evicting cached Terraform configuration {digest}")
+        for file_name in (digest, f"{digest}.json"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(CONFIGURATION_CACHE_DIR, file_name))
+        total_size -= size
+
+def load_cached_configuration(url, persist=True):
+
+    """
+    Load a cached remote configuration from memory, or from the disk cache.
+
+    Args:
+        url (str): The URL of the configuration.
+        persist (bool): Whether the configuration may be cached on disk, see store_cached_configuration.
+
+    Returns:
+        dict: The cache entry with 'content', 'etag', 'last_modified' and 'fetched_at' keys, or None.
+    """
+    with configuration_cache_lock:
+        entry = configuration_cache.get(url)
+    if entry:
+        remember_cached_configuration(url, entry)
+        if persist:
+            # Mark the configuration as recently used for eviction from the disk cache
+            with contextlib.suppress(OSError):
+                os.utime(get_configuration_cache_paths(url)[1])
+        return entry
+    if not persist:
+        return None
+
+    content_path, metadata_path = get_configuration_cache_paths(url)
+    try:
+        with open(metadata_path) as f:
+            entry = json.load(f)
+        with open(content_path, encoding='utf-8') as f:
+            entry['content'] = f.read()
+        # Mark the configuration as recently used for eviction
+        os.utime(metadata_path)
+    except (OSError, ValueError):
+        return None
+
+    remember_cached_configuration(url, entry)
+
+    return entry
+
+def store_cached_configuration(url, entry, persist=True):
+
+    """
+    Store a remote configuration in memory and in the disk cache.
+
+    The disk cache is kept within a share of the ephemeral storage, configured with the
+    CONFIGURATION_CACHE_STORAGE_SHARE environment variable, and readable by the function only.
+
+    Args:
+        url (str): The URL of the configuration.
+        entry (dict): The cache entry, see load_cached_configuration.
+        persist (bool): Whether to cache the configuration on disk, False for documents which may
+            contain secrets, such as Variables documents.
+    """
+    remember_cached_configuration(url, entry)
+    if not persist:
+        return
+
+    content_path, metadata_path = get_configuration_cache_paths(url)
+    try:
+        os.makedirs(CONFIGURATION_CACHE_DIR, mode=0o700, exist_ok=True)
+        with open(os.open(f"{content_path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+            f.write(entry['content'])
+        os.replace(f"{content_path}.tmp", content_path)
+        with open(os.open(f"{metadata_path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({key: value for key, value in entry.items() if key != 'content'}, f)
+        os.replace(f"{metadata_path}.tmp", metadata_path)
+        with configuration_cache_lock:
+            evict_cached_configurations(get_ephemeral_storage_share('CONFIGURATION_CACHE_STORAGE_SHARE', CONFIGURATION_CACHE_STORAGE_SHARE_DEFAULT))
+    except OSError as e:
+        logger.warning(f"Failed to cache Terraform configuration from {url} on disk - {e}")
+
+def fetch_http_configuration(url, cached_entry=None):
+
+    """
+    Fetch a Terraform configuration over HTTP(S), conditionally if a cached copy exists.
+
+    Args:
+        url (str): The URL of the configuration.
+        cached_entry (dict): The cached copy of the configuration (optional).
+
+    Returns:
+        dict: A new cache entry, or None if the cached copy is not modified.
+    """
+    headers = {}
+    if cached_entry and cached_entry.get('etag'):
+        headers['If-None-Match'] = cached_entry['etag']
+    if cached_entry and cached_entry.get('last_modified'):
+        headers['If-Modified-Since'] = cached_entry['last_modified']
+
+    try:
+        response = http.request('GET', url, headers=headers, redirect=True)
+    except Exception as e:
+        logger.warning(f"Failed to get Terraform configuration from URL {url} - {e}")
+        raise TransientConfigurationFetchError(f"Failed to get Terraform configuration from URL {url} - make sure it is reachable by the Custom Resource service.")
+    if response.status == 304 and cached_entry:
+        return None
+    if response.status >= 500:
+        raise TransientConfigurationFetchError(f"Failed to get Terraform configuration from URL {url} - received non-2xx status {response.status}")
+    if not 200 <= response.status < 300:
+        raise Exception(f"Failed to get Terraform configuration from URL {url} - received non-2xx status {response.status}")
+
+    return {
+        'content': response.data.decode('utf-8'),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+def fetch_s3_configuration(url, cached_entry=None):
+
+    """
+    Fetch a Terraform configuration from S3, conditionally if a cached copy exists.
+
+    Args:
+        url (str): The s3:// URL of the configuration.
+        cached_entry (dict): The cached copy of the configuration (optional).
+
+    Returns:
+        dict: A new cache entry, or None if the cached copy is not modified.
+    """
+    parsed_url = urllib3.util.parse_url(url)
+    get_object_args = {'Bucket': parsed_url.host, 'Key': parsed_url.path.lstrip('/')}
+    if cached_entry and cached_entry.get('etag'):
+        get_object_args['IfNoneMatch'] = cached_entry['etag']
+
+    try:
+        response = get_aws_client('s3').get_object(**get_object_args)
+        content = response['Body'].read().decode('utf-8')
+    except ClientError as e:
+        if cached_entry and e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+            return None
+        logger.warning(f"Failed to get Terraform configuration from S3 {url} - {e}")
+        error_class = TransientConfigurationFetchError if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 500) >= 500 else Exception
+        raise error_class(f"Failed to get Terraform configuration from S3 {url} - make sure it is reachable by the Custom Resource service.")
+    except Exception as e:
+        logger.warning(f"Failed to get Terraform configuration from S3 {url} - {e}")
+        raise TransientConfigurationFetchError(f"Failed to get Terraform configuration from S3 {url} - make sure it is reachable by the Custom Resource service.")
+
+    return {
+        'content': content,
+        'etag': response.get('ETag'),
+        'last_modified': None,
+    }
+
+def fetch_cached_configuration(url, fetch, request_type=None, persist=True):
+
+    """
+    Fetch a remote Terraform configuration through the configuration cache.
+
+    A cached copy younger than the TTL, configured with the CONFIGURATION_CACHE_TTL environment
+    variable, is used as is. An older copy is revalidated with a conditional request. On Delete,
+    a stale copy is used if the configuration can't be fetched because of a transient error, so
+    that a temporarily unreachable location doesn't block the deletion.
+
+    Args:
+        url (str): The URL of the configuration.
+        fetch (callable): The fetch function for the URL scheme, see fetch_http_configuration.
+        request_type (str): The CloudFormation request type (optional).
+        persist (bool): Whether the configuration may be cached on disk, see store_cached_configuration.
+
+    Returns:
+        str: The content of the Terraform configuration.
+    """
+    ttl = float(os.environ.get('CONFIGURATION_CACHE_TTL') or CONFIGURATION_CACHE_TTL_DEFAULT)
+    start_time = time.monotonic()
+    cached_entry = load_cached_configuration(url, persist)
+
+    if cached_entry and time.time() - cached_entry['fetched_at'] < ttl:
+        outcome = 'hit'
+        entry = cached_entry
+    else:
+        try:
+            entry = fetch(url, cached_entry)
+        except TransientConfigurationFetchError:
+            if not (cached_entry and request_type == 'Delete'):
+                raise
+            logger.warning(f"Using stale cached Terraform configuration from {url}")
+            outcome = 'stale'
+            entry = cached_entry
+        else:
+            if entry is None:
+                outcome = 'revalidated'
+                entry = {**cached_entry, 'fetched_at': time.time()}
+            else:
+                outcome = 'miss'
+                entry['fetched_at'] = time.time()
+            store_cached_configuration(url, entry, persist)
+
+    record_metric('ConfigurationCacheHit', 0 if outcome == 'miss' else 1)
+    if outcome == 'miss':
+        record_metric('ConfigurationBytesFetched', len(entry['content'].encode('utf-8')), 'Bytes')
+
+    with configuration_cache_lock:
+        configuration_cache_stats[outcome] += 1
+        stats = dict(configuration_cache_stats)
+
+    served_from_cache = stats['hit'] + stats['revalidated'] + stats['stale']
+    logger.info(
+        f"Fetched Terraform configuration from {url} in {(time.monotonic() - start_time) * 1000:.0f} ms ({outcome}), "
+        f"served {served_from_cache} of {served_from_cache + stats['miss']} fetches from cache"
+    )
+
+    return entry['content']
+
+def get_terraform_configuration_content(terraform_configuration, request_type=None):
 
     """
     Fetch the Terraform configuration content from the given URL.
@@ -53,43 +668,287 @@ def get_terraform_configuration_content(terraform_configuration):
     If the URL is an S3 endpoint, fetch the content from the S3 bucket.
     If the URL is not a valid HTTP(S) or S3 endpoint, assume it is the inline text of the Terraform configuration.
 
+    Remote configurations are fetched through the configuration cache, see fetch_cached_configuration.
+
+    Args:
+        terraform_configuration (str): The inline Terraform configuration or its URL.
+        request_type (str): The CloudFormation request type (optional).
+
     Returns:
         str: The content of the Terraform configuration.
     """
+    fetch = get_remote_fetch_function(terraform_configuration)
+    if fetch:
+        # Get contents from the HTTP(S) or S3 endpoint
+        return fetch_cached_configuration(terraform_configuration, fetch, request_type)
+
+    # Otherwise treat it as inline text
+    return terraform_configuration
+
+def get_remote_fetch_function(value):
+
+    """
+    Return the fetch function for a remote document URL, see fetch_cached_configuration.
+
+    Args:
+        value (str): A property value, which may be an HTTP(S) or S3 URL.
+
+    Returns:
+        callable: fetch_http_configuration or fetch_s3_configuration, or None if the value is not
+            an HTTP(S) or S3 URL.
+    """
+    try:
+        parsed_url = urllib3.util.parse_url(value)
+    except urllib3.exceptions.LocationValueError:
+        # assume it's a non-parseable URL
+        return None
+
+    if parsed_url.scheme in ('http', 'https'):
+        return fetch_http_configuration
+    if parsed_url.scheme == 's3':
+        return fetch_s3_configuration
+
+    return None
+
+
+def is_multi_file_configuration(terraform_configuration):
+
+    """
+    Check whether the Terraform configuration refers to multiple files.
+
+    Multi-file configurations are S3 prefixes (s3:// URLs ending with '/') and HTTP(S) or S3 URLs
+    of .zip, .tar.gz or .tgz archives.
+
+    Args:
+        terraform_configuration (str): The inline Terraform configuration or its URL.
+
+    Returns:
+        bool: True if the configuration refers to multiple files.
+    """
     try:
         parsed_url = urllib3.util.parse_url(terraform_configuration)
+    except urllib3.exceptions.LocationValueError:
+        return False
 
-        if parsed_url.scheme in ('http', 'https'):
-            # Get contents from http endpoint
-            try:
-                response = urllib3.request('GET', terraform_configuration, redirect=True, retries=10, timeout=5)
-            except Exception as e:
-                logger.warning(f"Failed to get Terraform configuration from URL {terraform_configuration} - {e}")
-                raise Exception(f"Failed to get Terraform configuration from URL {terraform_configuration} - make sure it is reachable by the Custom Resource service.")
-            if not 200 <= response.status < 300:
-                raise Exception(f"Failed to get Terraform configuration from URL {terraform_configuration} - received non-2xx status {response.status}")
-            terraform_configuration_content = response.data.decode('utf-8')
-
-        elif parsed_url.scheme == 's3':
-            # Get contents from S3 endpoint
-            try:
-                s3 = boto3.client('s3')
-                response = s3.get_object(Bucket=parsed_url.host, Key=parsed_url.path.lstrip('/'))
-                terraform_configuration_content = response['Body'].read().decode('utf-8')
-            except Exception as e:
-                logger.warning(f"Failed to get Terraform configuration from S3 {terraform_configuration} - {e}")
-                raise Exception(f"Failed to get Terraform configuration from S3 {terraform_configuration} - make sure it is reachable by the Custom Resource service.")
+    if parsed_url.scheme == 's3' and (parsed_url.path or '/').endswith('/'):
+        return True
 
-        else:
-            # Treat it as inline text
-            terraform_configuration_content = terraform_configuration
+    return parsed_url.scheme in ('http', 'https', 's3') and (parsed_url.path or '').lower().endswith(CONFIGURATION_ARCHIVE_EXTENSIONS)
+
+def get_configuration_file_path(working_dir, relative_path):
+
+    """
+    Resolve the path of a configuration file within the working directory.
+
+    Args:
+        working_dir (str): The Terraform working directory of the custom resource.
+        relative_path (str): The path of the file within the configuration.
+
+    Returns:
+        str: The absolute path of the file.
+
+    Raises:
+        Exception: If the path points outside of the working directory.
+    """
+    file_path = os.path.realpath(os.path.join(working_dir, relative_path))
+    if os.path.isabs(relative_path) or os.path.commonpath([file_path, os.path.realpath(working_dir)]) != os.path.realpath(working_dir):
+        raise Exception(f"Terraform configuration file {relative_path} points outside of the configuration.")
+
+    return file_path
+
+def check_configuration_limits(file_count, total_size):
+
+    """
+    Check that a multi-file configuration is within CONFIGURATION_MAX_FILES and CONFIGURATION_MAX_SIZE.
+
+    Args:
+        file_count (int): The number of files in the configuration.
+        total_size (int): The total (uncompressed) size of the files in bytes.
+    """
+    if file_count > CONFIGURATION_MAX_FILES:
+        raise Exception(f"Terraform configuration has more than {CONFIGURATION_MAX_FILES} files.")
+    if total_size > CONFIGURATION_MAX_SIZE:
+        raise Exception(f"Terraform configuration is larger than {CONFIGURATION_MAX_SIZE // 2**20} MB.")
+
+def write_configuration_file(stream, file_path):
+
+    """
+    Write a configuration file from a stream, creating its parent directories.
+
+    Args:
+        stream (file): The stream with the file content.
+        file_path (str): The path to write the file to.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+
+def download_s3_configuration_prefix(url, working_dir, max_workers=CONFIGURATION_DOWNLOAD_WORKERS, s3=None):
+
+    """
+    Download all objects under an S3 prefix into the working directory, in parallel.
+
+    Object keys relative to the prefix become file paths relative to the working directory.
+
+    Args:
+        url (str): The s3:// URL of the prefix, ending with '/'.
+        working_dir (str): The Terraform working directory of the custom resource.
+        max_workers (int): The number of download threads.
+        s3: The S3 client, created if not provided.
+
+    Returns:
+        int: The number of downloaded files.
+    """
+    parsed_url = urllib3.util.parse_url(url)
+    bucket = parsed_url.host
+    prefix = (parsed_url.path or '/').lstrip('/')
+    s3 = s3 or get_aws_client('s3')
 
-    except urllib3.exceptions.LocationValueError as e:
-        # assume it's a non-parseable URL, treat it as inline text
-        terraform_configuration_content = terraform_configuration
+    try:
+        objects = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            objects.extend(item for item in page.get('Contents', []) if not item['Key'].endswith('/'))
+            check_configuration_limits(len(objects), sum(item['Size'] for item in objects))
+    except ClientError as e:
+        logger.warning(f"Failed to list Terraform configuration in S3 {url} - {e}")
+        raise Exception(f"Failed to get Terraform configuration from S3 {url} - make sure it is reachable by the Custom Resource service.")
+
+    if not objects:
+        raise Exception(f"Failed to get Terraform configuration from S3 {url} - no objects found under the prefix.")
+
+    def download_object(item):
+        file_path = get_configuration_file_path(working_dir, item['Key'][len(prefix):])
+        response = s3.get_object(Bucket=bucket, Key=item['Key'])
+        write_configuration_file(response['Body'], file_path)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(download_object, objects))
+    except ClientError as e:
+        logger.warning(f"Failed to get Terraform configuration from S3 {url} - {e}")
+        raise Exception(f"Failed to get Terraform configuration from S3 {url} - make sure it is reachable by the Custom Resource service.")
+
+    record_metric('ConfigurationBytesFetched', sum(item['Size'] for item in objects), 'Bytes')
+
+    return len(objects)
+
+def extract_tar_configuration(stream, working_dir):
+
+    """
+    Extract a .tar.gz configuration archive into the working directory while it is being downloaded.
+
+    Only regular files and directories are extracted, links and special files are rejected.
+
+    Args:
+        stream (file): The archive stream, read sequentially.
+        working_dir (str): The Terraform working directory of the custom resource.
+
+    Returns:
+        int: The number of extracted files.
+    """
+    file_count = 0
+    total_size = 0
+
+    with tarfile.open(fileobj=stream, mode='r|gz') as archive:
+        for member in archive:
+            if member.isdir():
+                os.makedirs(get_configuration_file_path(working_dir, member.name), exist_ok=True)
+                continue
+            if not member.isfile():
+                raise Exception(f"Terraform configuration archive contains unsupported entry {member.name}, only regular files are supported.")
+            file_count += 1
+            total_size += member.size
+            check_configuration_limits(file_count, total_size)
+            write_configuration_file(archive.extractfile(member), get_configuration_file_path(working_dir, member.name))
+
+    return file_count
+
+def extract_zip_configuration(stream, working_dir):
+
+    """
+    Extract a .zip configuration archive into the working directory.
+
+    The zip central directory is at the end of the archive, so the archive is spooled to a
+    temporary file in the working directory rather than buffered in memory.
+
+    Args:
+        stream (file): The archive stream.
+        working_dir (str): The Terraform working directory of the custom resource.
+
+    Returns:
+        int: The number of extracted files.
+    """
+    with tempfile.TemporaryFile(dir=working_dir) as archive_file:
+        for chunk in iter(lambda: stream.read(2**20), b''):
+            archive_file.write(chunk)
+            check_configuration_limits(0, archive_file.tell())
+        archive_file.seek(0)
+
+        with zipfile.ZipFile(archive_file) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            check_configuration_limits(len(members), sum(member.file_size for member in members))
+            for member in members:
+                with archive.open(member) as member_stream:
+                    write_configuration_file(member_stream, get_configuration_file_path(working_dir, member.filename))
+
+    return len(members)
+
+def download_configuration_archive(url, working_dir):
+
+    """
+    Download a configuration archive from an HTTP(S) or S3 URL and extract it into the working directory.
+
+    Args:
+        url (str): The URL of the .zip, .tar.gz or .tgz archive.
+        working_dir (str): The Terraform working directory of the custom resource.
 
-    return terraform_configuration_content
+    Returns:
+        int: The number of extracted files.
+    """
+    parsed_url = urllib3.util.parse_url(url)
+    extract = extract_zip_configuration if parsed_url.path.lower().endswith('.zip') else extract_tar_configuration
+
+    if parsed_url.scheme == 's3':
+        try:
+            response = get_aws_client('s3').get_object(Bucket=parsed_url.host, Key=parsed_url.path.lstrip('/'))
+        except Exception as e:
+            logger.warning(f"Failed to get Terraform configuration from S3 {url} - {e}")
+            raise Exception(f"Failed to get Terraform configuration from S3 {url} - make sure it is reachable by the Custom Resource service.")
+        record_metric('ConfigurationBytesFetched', response.get('ContentLength', 0), 'Bytes')
+        with contextlib.closing(response['Body']) as stream:
+            return extract(stream, working_dir)
+
+    try:
+        response = http.request('GET', url, redirect=True, preload_content=False)
+    except Exception as e:
+        logger.warning(f"Failed to get Terraform configuration from URL {url} - {e}")
+        raise Exception(f"Failed to get Terraform configuration from URL {url} - make sure it is reachable by the Custom Resource service.")
+    try:
+        if not 200 <= response.status < 300:
+            raise Exception(f"Failed to get Terraform configuration from URL {url} - received non-2xx status {response.status}")
+        file_count = extract(response, working_dir)
+        record_metric('ConfigurationBytesFetched', response.tell(), 'Bytes')
+        return file_count
+    finally:
+        response.release_conn()
+
+def fetch_terraform_configuration_files(terraform_configuration, working_dir):
+
+    """
+    Fetch a multi-file Terraform configuration into the working directory.
+
+    Args:
+        terraform_configuration (str): The URL of an S3 prefix or of a configuration archive.
+        working_dir (str): The Terraform working directory of the custom resource.
+    """
+    start_time = time.monotonic()
+
+    if (urllib3.util.parse_url(terraform_configuration).path or '').lower().endswith(CONFIGURATION_ARCHIVE_EXTENSIONS):
+        file_count = download_configuration_archive(terraform_configuration, working_dir)
+    else:
+        file_count = download_s3_configuration_prefix(terraform_configuration, working_dir)
 
+    logger.info(f"Fetched {file_count} Terraform configuration file(s) from {terraform_configuration} in {time.monotonic() - start_time:.2f}s")
 
 def setup_environment_variables(resource_properties):
 
@@ -102,7 +961,8 @@ def setup_environment_variables(resource_properties):
 
     The properties are validated to ensure that they are a dictionary of
     scalars. The 'TF_IN_AUTOMATION' and 'TF_INPUT' variables are always set to
-    'true' and 'false' respectively.
+    'true' and 'false' respectively, and 'TF_PLUGIN_CACHE_DIR' always points to
+    the plugin cache preserved between warm invocations.
 
     :param resource_properties: A dictionary of custom resource properties.
     :return: A dictionary of environment variables.
@@ -126,11 +986,15 @@ def setup_environment_variables(resource_properties):
         raise Exception("Setting environment variable 'TF_INPUT' is not supported, it is always set to 'false'")
     environment['TF_INPUT'] = 'false'
 
+    if 'TF_PLUGIN_CACHE_DIR' in environment:
+        raise Exception(f"Setting environment variable 'TF_PLUGIN_CACHE_DIR' is not supported, it is always set to '{TERRAFORM_PLUGIN_CACHE_DIR}'")
+    environment['TF_PLUGIN_CACHE_DIR'] = TERRAFORM_PLUGIN_CACHE_DIR
+
     # Merge with the existing environment variables
     return {**os.environ, **environment}
 
 
-def prepare_terraform_configuration(resource_properties):
+def prepare_terraform_configuration(resource_properties, working_dir, request_type=None, configuration_content=None):
     """
     Prepare and validate the Terraform configuration.
 
@@ -139,331 +1003,2951 @@ def prepare_terraform_configuration(resource_properties):
 
     The properties are validated to ensure that they contain the 'Configuration'
     property, which must be a string or a URL. If the property is a URL, the
-    content of the URL is fetched and written to the temporary file.
+    content of the URL is fetched and written to the temporary file. If the URL
+    refers to an archive or an S3 prefix, all of its files are fetched into the
+    working directory.
 
-    If the properties contain the 'Variables' property, it must be a dictionary.
-    The dictionary is written to a temporary file at /tmp/terraform.tfvars.
+    If the properties contain the 'Variables' property, it must be a dictionary or
+    the URL of a JSON document, see write_terraform_variables.
 
     :param resource_properties: A dictionary of custom resource properties.
-    :return: The path to a temporary file containing the Terraform configuration.
+    :param working_dir: The Terraform working directory of the custom resource.
+    :param request_type: The CloudFormation request type, see fetch_cached_configuration.
+    :param configuration_content: The content of a single-file configuration fetched ahead, see SetupStage.
+    :return: The path to a temporary file containing the Terraform configuration,
+        or the working directory for multi-file configurations.
     """
     terraform_configuration = resource_properties.get('Configuration')
     if not terraform_configuration:
         raise Exception("Terraform configuration not provided")
 
-    terraform_configuration_content = get_terraform_configuration_content(terraform_configuration)
+    if is_multi_file_configuration(terraform_configuration):
+        # Fetch all configuration files to the working directory
+        fetch_terraform_configuration_files(terraform_configuration, working_dir)
+        config_path = working_dir
+    else:
+        terraform_configuration_content = configuration_content
+        if terraform_configuration_content is None:
+            terraform_configuration_content = get_terraform_configuration_content(terraform_configuration, request_type)
 
-    # Write configuration to /tmp
-    config_path = '/tmp/terraform.tf'
-    with open(config_path, 'w') as f:
-        f.write(terraform_configuration_content)
+        # Write configuration to the working directory
+        config_path = os.path.join(working_dir, 'terraform.tf')
+        with open(config_path, 'w') as f:
+            f.write(terraform_configuration_content)
 
     # Handle variables, if any
-    terraform_variables = resource_properties.get('Variables', {})
+    write_terraform_variables(resource_properties.get('Variables', {}), working_dir, request_type)
+
+    return config_path
+
+def write_terraform_variables(terraform_variables, working_dir, request_type=None):
+    """
+    Write the 'Variables' property to terraform.auto.tfvars.json in the working directory.
+
+    The property is either a map of variables, or the HTTP(S) or S3 URL of a JSON document with the
+    map, which is fetched through the configuration cache and written as is. The document may
+    contain secrets, so it is cached in memory only. JSON preserves nesting and types of the values,
+    which Terraform converts to the types of the declared variables.
+
+    :param terraform_variables: The 'Variables' property.
+    :param working_dir: The Terraform working directory of the custom resource.
+    :param request_type: The CloudFormation request type, see fetch_cached_configuration.
+    """
+    vars_path = os.path.join(working_dir, TERRAFORM_VARIABLES_FILE_NAME)
+
+    fetch = get_remote_fetch_function(terraform_variables) if isinstance(terraform_variables, str) else None
+    if fetch:
+        content = fetch_cached_configuration(terraform_variables, fetch, request_type, persist=False)
+        try:
+            document = json.loads(content)
+        except ValueError as e:
+            raise Exception(f"Variables document {terraform_variables} is not valid JSON - {e}")
+        if not isinstance(document, dict):
+            raise Exception(f"Variables document {terraform_variables} must be a JSON object.")
+
+        with open(vars_path, 'w') as f:
+            f.write(content)
+        return
 
     # check that variables is a dictionary
     if not isinstance(terraform_variables, dict):
-        raise Exception("Variables property, if set, must be a map.")
+        raise Exception("Variables property, if set, must be a map. It may also be the HTTP(S) or S3 URL of a JSON document with the map.")
 
     if terraform_variables:
-        vars_path = '/tmp/terraform.tfvars'
+        # json.dumps uses the C encoder, which json.dump doesn't
         with open(vars_path, 'w') as f:
-            for key, value in terraform_variables.items():
-                if isinstance(value, list):
-                    f.write(f'{key} = {json.dumps(value)}\n')
-                elif isinstance(value, dict):
-                    f.write(f'{key} = {{\n')
-                    for subkey, subvalue in value.items():
-                        f.write(f'  {subkey} = "{subvalue}"\n')
-                    f.write('}\n')
-                else:
-                    f.write(f'{key} = "{value}"\n')
+            f.write(json.dumps(terraform_variables))
 
-    return config_path
 
+# Locks and user counts of the workspaces used by running invocations, by workspace path
+terraform_workspace_locks = {}
+terraform_workspaces_lock = threading.Lock()
 
-def clean_terraform_cache():
+def get_terraform_workspace_path(event):
 
     """
-    Clean up the Terraform cache directory.
+    Get the path of the Terraform working directory of a custom resource.
 
-    This function is called when the Lambda function is finished executing. It removes
-    the cached .terraform directory from /tmp, which is created by Terraform when it
-    is run.
-    """
+    The directory is derived from the stack ID and the logical resource ID, so that
+    invocations for the same custom resource reuse the directory between warm invocations.
+    Configurations of the 'Configurations' property have logical resource IDs of the form
+    '<logical resource ID>/<name>', see run_terraform_configurations.
 
-    terraform_dir = '/tmp/.terraform'
-    if os.path.exists(terraform_dir):
-        logger.info("Removing cached .terraform directory")
-        shutil.rmtree(terraform_dir)
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+
+    Returns:
+        str: The path of the workspace.
+    """
+    logical_resource_id = event['LogicalResourceId']
+    digest = hashlib.sha256(f"{event['StackId']}/{logical_resource_id}".encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(TERRAFORM_WORKSPACES_DIR, f"{logical_resource_id.replace('/', '-')}-{digest}")
 
-def log_output(stdout_message, stderr_message, log_group=None, log_stream_name=None):
+def evict_terraform_workspaces(max_size):
 
     """
-    Logs Terraform command output (stdout and stderr) to CloudWatch if log group and stream are provided,
-    otherwise logs to the console.
+    Remove least recently used workspaces until all workspaces fit into the given size.
+
+    Workspaces are ordered by the modification time of their directory, which is updated every
+    time a workspace is acquired. Workspaces used by running invocations are never evicted. The
+    caller must hold terraform_workspaces_lock.
 
     Args:
-        stdout_message (str): Standard output from the command.
-        stderr_message (str): Standard error from the command.
-        log_group (str): CloudWatch log group name for logging Terraform output (optional).
-        log_stream_name (str): CloudWatch log stream name for logging Terraform output (optional).
+        max_size (int): The maximum total size of the workspaces in bytes.
     """
+    workspaces = []
+    for workspace_name in os.listdir(TERRAFORM_WORKSPACES_DIR):
+        workspace_path = os.path.join(TERRAFORM_WORKSPACES_DIR, workspace_name)
+        workspaces.append((os.path.getmtime(workspace_path), workspace_path, get_directory_size(workspace_path)))
+
+    total_size = sum(size for _, _, size in workspaces)
+    for _, workspace_path, size in sorted(workspaces):
+        if total_size <= max_size:
+            break
+        if workspace_path in terraform_workspace_locks:
+            continue
+        logger.info(f"Evicting workspace {workspace_path}")
+        shutil.rmtree(workspace_path, ignore_errors=True)
+        total_size -= size
+
+@contextlib.contextmanager
+def terraform_workspace(event):
 
-    if log_group and log_stream_name:
-        # Log only Terraform command outputs to CloudWatch
-        log_to_cloudwatch(stdout_message, stderr_message, log_group, log_stream_name)
-    else:
-        # Log both stdout and stderr to the console
-        if stdout_message:
-            logger.info(stdout_message)
-        if stderr_message:
-            logger.error(stderr_message)
+    """
+    Acquire the Terraform working directory of a custom resource for the duration of a block.
+
+    Each custom resource gets its own directory under TERRAFORM_WORKSPACES_DIR, so that several
+    custom resources can be handled concurrently and no files leak from one custom resource to
+    another. Invocations for the same custom resource are serialized. Least recently used
+    workspaces are evicted to keep them within a share of the ephemeral storage, configured with
+    the TERRAFORM_WORKSPACES_STORAGE_SHARE environment variable.
+
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+
+    Yields:
+        str: The path of the workspace.
+    """
+    workspace_path = get_terraform_workspace_path(event)
+
+    with terraform_workspaces_lock:
+        os.makedirs(TERRAFORM_WORKSPACES_DIR, exist_ok=True)
+        workspace = terraform_workspace_locks.setdefault(workspace_path, {'lock': threading.Lock(), 'users': 0})
+        # Register the workspace as used before eviction, so that it is not evicted
+        workspace['users'] += 1
+        evict_terraform_workspaces(get_ephemeral_storage_share('TERRAFORM_WORKSPACES_STORAGE_SHARE', TERRAFORM_WORKSPACES_STORAGE_SHARE_DEFAULT))
+
+    try:
+        with workspace['lock']:
+            os.makedirs(workspace_path, exist_ok=True)
+            os.utime(workspace_path)
+            logger.info(f"Using workspace {workspace_path}")
+            yield workspace_path
+    finally:
+        with terraform_workspaces_lock:
+            workspace['users'] -= 1
+            if not workspace['users']:
+                del terraform_workspace_locks[workspace_path]
+
+def clean_terraform_cache(working_dir):
+
+    """
+    Clean up the Terraform working state left by a previous invocation.
+
+    This function is called before the Lambda function starts executing Terraform. It removes
+    the configuration, variables, backend and CLI configuration files generated by the previous
+    invocation from the working directory, so that none of them is picked up by accident. The
+    .terraform directory is preserved, and the dependency lock file is set aside in it, so that a
+    lock file which comes with the configuration can be told from the one of the previous init.
+    Both are reused or cleaned up depending on the 'terraform init' fingerprint (see
+    prepare_terraform_init_cmd). The local backend state and the provider plugin cache are
+    preserved between invocations as well.
+
+    Args:
+        working_dir (str): The Terraform working directory of the custom resource.
+    """
+    lock_file_path = os.path.join(working_dir, TERRAFORM_LOCK_FILE_NAME)
+    terraform_dir = os.path.join(working_dir, '.terraform')
+    if os.path.exists(lock_file_path) and os.path.isdir(terraform_dir):
+        os.replace(lock_file_path, os.path.join(terraform_dir, TERRAFORM_PREVIOUS_LOCK_FILE_NAME))
+
+    for file_name in os.listdir(working_dir):
+        if file_name in TERRAFORM_WORKSPACE_PRESERVED_FILES:
+            continue
+        logger.info(f"Removing {file_name} left by a previous invocation")
+        file_path = os.path.join(working_dir, file_name)
+        if os.path.isdir(file_path) and not os.path.islink(file_path):
+            shutil.rmtree(file_path)
+        else:
+            os.remove(file_path)
+
+def get_ephemeral_storage_share(environment_variable, default):
+
+    """
+    Calculate a share of the function ephemeral storage mounted at /tmp.
+
+    Args:
+        environment_variable (str): The environment variable with the share, a number within (0, 1].
+        default (float): The share to use if the environment variable isn't set.
+
+    Returns:
+        int: The share of the ephemeral storage in bytes.
+    """
+    storage_share = os.environ.get(environment_variable) or default
+    try:
+        storage_share = float(storage_share)
+    except ValueError:
+        raise Exception(f"Environment variable {environment_variable} must be a number, got '{storage_share}'.")
+    if not 0 < storage_share <= 1:
+        raise Exception(f"Environment variable {environment_variable} must be within (0, 1], got '{storage_share}'.")
+
+    return int(shutil.disk_usage('/tmp').total * storage_share)
+
+def get_terraform_plugin_cache_max_size():
+
+    """
+    Calculate the maximum size of the Terraform provider plugin cache.
+
+    The size is a share of the function ephemeral storage mounted at /tmp. The share is taken
+    from the TERRAFORM_PLUGIN_CACHE_STORAGE_SHARE environment variable and defaults to
+    TERRAFORM_PLUGIN_CACHE_STORAGE_SHARE_DEFAULT.
+
+    Returns:
+        int: The maximum size of the plugin cache in bytes.
+    """
+    return get_ephemeral_storage_share('TERRAFORM_PLUGIN_CACHE_STORAGE_SHARE', TERRAFORM_PLUGIN_CACHE_STORAGE_SHARE_DEFAULT)
+
+def get_directory_size(path):
+
+    """
+    Calculate the total size of regular files within a directory tree.
+
+    Symbolic links are not followed, so providers linked from the plugin cache are not counted twice.
+    Files removed while the tree is walked, e.g. by an invocation using another workspace, are skipped.
+
+    Args:
+        path (str): The directory to measure.
+
+    Returns:
+        int: The total size in bytes.
+    """
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                file_stat = os.lstat(os.path.join(root, file_name))
+            except FileNotFoundError:
+                continue
+            if not stat.S_ISLNK(file_stat.st_mode):
+                total_size += file_stat.st_size
+
+    return total_size
+
+def list_terraform_provider_packages(providers_dir):
+
+    """
+    List provider packages in a Terraform provider directory.
+
+    Both the plugin cache and the .terraform/providers directory use the unpacked layout
+    <hostname>/<namespace>/<type>/<version>/<os>_<arch>, so the relative path of each
+    package uniquely identifies the provider, its version and its platform.
+
+    Args:
+        providers_dir (str): The root of the provider directory.
+
+    Returns:
+        list: Keys in form '<hostname>/<namespace>/<type>/<version>/<os>_<arch>'.
+    """
+    if not os.path.isdir(providers_dir):
+        return []
+
+    keys = []
+    for root, dirs, _ in os.walk(providers_dir):
+        relative_path = os.path.relpath(root, providers_dir)
+        depth = 0 if relative_path == '.' else relative_path.count(os.sep) + 1
+        if depth == 4:
+            # Platform directories may be symbolic links into the plugin cache, which os.walk doesn't follow
+            keys.extend(f"{relative_path.replace(os.sep, '/')}/{platform}" for platform in dirs)
+            dirs.clear()
+
+    return sorted(keys)
+
+def load_terraform_plugin_cache_index():
+
+    """
+    Load the plugin cache index and reconcile it with the plugin cache directory.
+
+    The index maps provider package keys (see list_terraform_provider_packages) to their size
+    and the time they were last used. Packages that are present in the cache but missing from
+    the index are added, entries without a package on disk are dropped.
+
+    Returns:
+        dict: The plugin cache index.
+    """
+    index = {}
+    if os.path.exists(TERRAFORM_PLUGIN_CACHE_INDEX_PATH):
+        try:
+            with open(TERRAFORM_PLUGIN_CACHE_INDEX_PATH) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load plugin cache index, rebuilding it - {e}")
+
+    reconciled_index = {}
+    for key in list_terraform_provider_packages(TERRAFORM_PLUGIN_CACHE_DIR):
+        entry = index.get(key)
+        if entry is None:
+            entry = {
+                'size': get_directory_size(os.path.join(TERRAFORM_PLUGIN_CACHE_DIR, key)),
+                'last_used': 0,
+            }
+        reconciled_index[key] = entry
+
+    return reconciled_index
+
+def save_terraform_plugin_cache_index(index):
+
+    """
+    Persist the plugin cache index next to the plugin cache.
+
+    Args:
+        index (dict): The plugin cache index.
+    """
+    temporary_path = f"{TERRAFORM_PLUGIN_CACHE_INDEX_PATH}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary_path, TERRAFORM_PLUGIN_CACHE_INDEX_PATH)
+
+def remove_terraform_plugin_cache_package(key):
+
+    """
+    Remove a provider package from the plugin cache, pruning directories left empty.
+
+    Args:
+        key (str): The provider package key.
+    """
+    package_dir = os.path.join(TERRAFORM_PLUGIN_CACHE_DIR, key)
+    shutil.rmtree(package_dir, ignore_errors=True)
+
+    parent_dir = os.path.dirname(package_dir)
+    while parent_dir != TERRAFORM_PLUGIN_CACHE_DIR and os.path.isdir(parent_dir) and not os.listdir(parent_dir):
+        os.rmdir(parent_dir)
+        parent_dir = os.path.dirname(parent_dir)
+
+# Serializes 'terraform init' runs sharing the plugin cache, and updates of its index
+terraform_plugin_cache_lock = threading.Lock()
+
+def update_terraform_plugin_cache(working_dir):
+
+    """
+    Record plugin cache usage after 'terraform init' and evict least recently used providers.
+
+    Providers installed in the working directory are counted as cache hits if they were already
+    indexed before init, and as misses otherwise. Least recently used packages are then evicted
+    until the cache fits into get_terraform_plugin_cache_max_size(). Packages used by any
+    workspace are never evicted, as Terraform may be running in another workspace concurrently.
+
+    Args:
+        working_dir (str): The directory Terraform was initialized in.
+
+    Returns:
+        dict: Counts of cache 'hits' and 'misses' for the current invocation.
+    """
+    index = load_terraform_plugin_cache_index()
+    used_keys = list_terraform_provider_packages(os.path.join(working_dir, '.terraform', 'providers'))
+    cached_keys = set(list_terraform_provider_packages(TERRAFORM_PLUGIN_CACHE_DIR))
+
+    hits = 0
+    misses = 0
+    now = time.time()
+    for key in used_keys:
+        if key not in cached_keys:
+            # Not installed through the cache, e.g. provided by a mirror
+            continue
+        if index[key]['last_used']:
+            hits += 1
+        else:
+            misses += 1
+        index[key]['last_used'] = now
+
+    max_size = get_terraform_plugin_cache_max_size()
+    total_size = sum(entry['size'] for entry in index.values())
+    workspace_keys = None
+    for key in sorted(index, key=lambda key: index[key]['last_used']):
+        if total_size <= max_size:
+            break
+        if workspace_keys is None:
+            workspace_keys = set(used_keys)
+            for workspace_name in os.listdir(TERRAFORM_WORKSPACES_DIR) if os.path.isdir(TERRAFORM_WORKSPACES_DIR) else []:
+                workspace_keys.update(list_terraform_provider_packages(os.path.join(TERRAFORM_WORKSPACES_DIR, workspace_name, '.terraform', 'providers')))
+        if key in workspace_keys:
+            continue
+        logger.info(f"Evicting provider {key} from plugin cache")
+        remove_terraform_plugin_cache_package(key)
+        total_size -= index.pop(key)['size']
+
+    save_terraform_plugin_cache_index(index)
+
+    logger.info(
+        f"Terraform plugin cache: {hits} hit(s), {misses} miss(es), "
+        f"{len(index)} provider(s) using {total_size // 2**20} MB of {max_size // 2**20} MB"
+    )
+
+    return {'hits': hits, 'misses': misses}
+
+def split_log_message(message, max_size=CLOUDWATCH_LOGS_MAX_EVENT_SIZE):
+
+    """
+    Split a message into chunks which fit into a single CloudWatch Logs event.
+
+    Chunks are split on UTF-8 character boundaries.
+
+    Args:
+        message (str): The message to split.
+        max_size (int): The maximum size of a chunk in bytes.
+
+    Returns:
+        list: The message chunks.
+    """
+    data = message.encode('utf-8')
+    if len(data) <= max_size:
+        return [message]
 
-def log_to_cloudwatch(stdout_message, stderr_message, log_group, log_stream_name):
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = min(start + max_size, len(data))
+        # Don't split multibyte characters, continuation bytes start with 0b10
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        chunks.append(data[start:end].decode('utf-8'))
+        start = end
+
+    return chunks
+
+class CloudWatchLogsShipper:
 
     """
-    Sends Terraform command output (stdout and stderr) to CloudWatch Logs.
+    Ships lines of Terraform output to a CloudWatch Logs stream from a background thread.
 
-    This function logs command outputs to a specified CloudWatch log group and stream.
-    It creates log events with timestamps and messages for both stdout and stderr,
-    and attempts to push them to CloudWatch Logs.
+    Lines are buffered and sent with PutLogEvents once CLOUDWATCH_LOGS_FLUSH_INTERVAL elapses
+    or CLOUDWATCH_LOGS_FLUSH_SIZE bytes are buffered, in batches within the PutLogEvents limits.
+    Throttled calls are retried with exponential backoff. At most CLOUDWATCH_LOGS_MAX_QUEUED_LINES
+    lines are queued, put() waits for the thread beyond that. Call close() to ship the remaining
+    lines and stop the thread.
 
     Args:
-        stdout_message (str): Standard output from the command.
-        stderr_message (str): Standard error from the command.
         log_group (str): The name of the CloudWatch log group.
         log_stream_name (str): The name of the CloudWatch log stream.
+        client: The CloudWatch Logs client, defaults to the shared client.
+    """
+
+    def __init__(self, log_group, log_stream_name, client=None):
+        self.log_group = log_group
+        self.log_stream_name = log_stream_name
+        self.client = client or get_aws_client('logs')
+        self.lines = queue.Queue(maxsize=CLOUDWATCH_LOGS_MAX_QUEUED_LINES)
+        self.thread = threading.Thread(target=self.run, name=f"cloudwatch-logs-shipper-{log_stream_name}", daemon=True)
+        self.thread.start()
+
+    def put(self, line):
+        """
+        Queue a line of output for shipping, timestamped with the current time.
+        """
+        self.lines.put((int(time.time() * 1000), line))
+
+    def close(self):
+        """
+        Ship all queued lines and stop the background thread.
+        """
+        self.lines.put(None)
+        self.thread.join()
+
+    def run(self):
+        batch = []
+        batch_size = 0
+        flush_deadline = None
+
+        while True:
+            timeout = None if flush_deadline is None else max(0, flush_deadline - time.monotonic())
+            try:
+                item = self.lines.get(timeout=timeout)
+            except queue.Empty:
+                # Flush interval elapsed
+                item = False
+
+            if item:
+                timestamp, line = item
+                # CloudWatch Logs doesn't accept empty messages
+                for message in split_log_message(line.rstrip('\n')) if line.strip() else []:
+                    event_size = len(message.encode('utf-8')) + CLOUDWATCH_LOGS_EVENT_OVERHEAD
+                    if batch_size + event_size > CLOUDWATCH_LOGS_MAX_BATCH_SIZE or len(batch) >= CLOUDWATCH_LOGS_MAX_BATCH_EVENTS:
+                        self.put_log_events(batch)
+                        batch = []
+                        batch_size = 0
+                    batch.append({'timestamp': timestamp, 'message': message})
+                    batch_size += event_size
+                if batch and flush_deadline is None:
+                    flush_deadline = time.monotonic() + CLOUDWATCH_LOGS_FLUSH_INTERVAL
+
+            if not item or batch_size >= CLOUDWATCH_LOGS_FLUSH_SIZE:
+                self.put_log_events(batch)
+                batch = []
+                batch_size = 0
+                flush_deadline = None
+
+            if item is None:
+                return
+
+    def put_log_events(self, batch):
+        """
+        Send a batch of log events, retrying throttled calls. Failures are logged, not raised.
+        """
+        if not batch:
+            return
+
+        # stdout and stderr are read by separate threads, events must be in chronological order
+        batch = sorted(batch, key=lambda event: event['timestamp'])
+
+        for attempt in range(CLOUDWATCH_LOGS_MAX_RETRIES + 1):
+            try:
+                self.client.put_log_events(
+                    logGroupName=self.log_group,
+                    logStreamName=self.log_stream_name,
+                    logEvents=batch
+                )
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] not in CLOUDWATCH_LOGS_RETRYABLE_ERRORS or attempt == CLOUDWATCH_LOGS_MAX_RETRIES:
+                    logger.error(f"Failed to send {len(batch)} log event(s) to CloudWatch Logs: {e}")
+                    return
+                delay = CLOUDWATCH_LOGS_RETRY_BASE_DELAY * 2 ** attempt
+                time.sleep(random.uniform(delay / 2, delay))
+
+# Log shippers by (log group, log stream name), shared by the Terraform commands of an invocation
+cloudwatch_logs_shippers = {}
+cloudwatch_logs_shippers_lock = threading.Lock()
+
+def get_cloudwatch_logs_shipper(log_group, log_stream_name):
 
-    Raises:
-        ClientError: If there's an error while sending logs to CloudWatch.
     """
-    log_events = []
-    timestamp = int(time.time() * 1000)
+    Get the log shipper for a CloudWatch log stream, starting it if necessary.
 
-    if stdout_message:
-        log_events.append({
-            'timestamp': timestamp,
-            'message': stdout_message
-        })
+    Args:
+        log_group (str): The name of the CloudWatch log group.
+        log_stream_name (str): The name of the CloudWatch log stream.
 
-    if stderr_message:
-        log_events.append({
-            'timestamp': timestamp,
-            'message': stderr_message
-        })
+    Returns:
+        CloudWatchLogsShipper: The log shipper.
+    """
+    with cloudwatch_logs_shippers_lock:
+        shipper = cloudwatch_logs_shippers.get((log_group, log_stream_name))
+        if shipper is None:
+            shipper = CloudWatchLogsShipper(log_group, log_stream_name)
+            cloudwatch_logs_shippers[(log_group, log_stream_name)] = shipper
+
+    return shipper
+
+def flush_cloudwatch_logs(log_group, log_stream_name):
+
+    """
+    Ship all pending Terraform output to a CloudWatch log stream and stop its log shipper.
+
+    This function must be called before responding to CloudFormation, as the Lambda execution
+    environment may be frozen right after the response is sent.
+
+    Args:
+        log_group (str): The name of the CloudWatch log group.
+        log_stream_name (str): The name of the CloudWatch log stream.
+    """
+    with cloudwatch_logs_shippers_lock:
+        shipper = cloudwatch_logs_shippers.pop((log_group, log_stream_name), None)
+
+    if shipper:
+        shipper.close()
+
+class TerraformOutputTail:
+    """
+    Keeps the last lines of a Terraform output stream, up to TERRAFORM_OUTPUT_TAIL_SIZE characters,
+    so that the memory used for error reasons doesn't grow with the output of the command.
+
+    Args:
+        max_size (int): The maximum number of characters kept.
+    """
+
+    def __init__(self, max_size=TERRAFORM_OUTPUT_TAIL_SIZE):
+        self.max_size = max_size
+        self.lines = collections.deque()
+        self.size = 0
+        self.truncated = False
+        self.total_bytes = 0
+
+    def append(self, line):
+        """
+        Adds a line, dropping the oldest ones which don't fit anymore.
+        """
+        self.total_bytes += len(line.encode('utf-8'))
+        if len(line) > self.max_size:
+            line = line[-self.max_size:]
+            self.truncated = True
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_size:
+            self.size -= len(self.lines.popleft())
+            self.truncated = True
+
+    def getvalue(self):
+        """
+        Returns the kept lines, starting with '[...]' if older output has been dropped.
+        """
+        return ('[...]\n' if self.truncated else '') + ''.join(self.lines)
+
+class TerraformOutputFile:
+    """
+    Spills the full output of Terraform commands to a file, so that it can be inspected without
+    keeping it in memory. Once the file exceeds TERRAFORM_OUTPUT_FILE_MAX_SIZE, it is rotated to
+    '<path>.1', replacing the previous one. Lines may be written from several threads.
+
+    Args:
+        path (str): The path of the file, appended to if it exists.
+        max_size (int): The size in bytes the file is rotated at.
+    """
+
+    def __init__(self, path, max_size=TERRAFORM_OUTPUT_FILE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.file = open(path, 'ab')
+
+    def write(self, line):
+        """
+        Writes a line, rotating the file first if it is full.
+        """
+        # Sizes are counted in bytes, characters of non-ASCII output take up to 4 of them
+        data = line.encode('utf-8')
+        with self.lock:
+            if self.size >= self.max_size:
+                self.file.close()
+                os.replace(self.path, f"{self.path}.1")
+                self.file = open(self.path, 'wb')
+                self.size = 0
+            self.file.write(data)
+            self.size += len(data)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_terraform_output(stream, tail, lines=None, shipper=None, ui_stream=None, output_file=None, log_level=None):
+
+    """
+    Read a Terraform output stream line by line until it is closed.
+
+    Only the tail of the output is kept in memory, unless the lines are collected. Lines which aren't
+    shipped to CloudWatch Logs are logged to the function log in chunks of TERRAFORM_OUTPUT_LOG_CHUNK_SIZE.
+
+    Args:
+        stream (file): The stdout or stderr pipe of the Terraform process.
+        tail (TerraformOutputTail): The tail of the output, for error reasons.
+        lines (list): The list to collect all lines in, for commands whose output is parsed (optional).
+        shipper (CloudWatchLogsShipper): The log shipper to stream the lines to (optional).
+        ui_stream (TerraformUIStream): The parser of the machine-readable UI to feed the lines to (optional).
+        output_file (TerraformOutputFile): The file to spill the lines to (optional).
+        log_level (int): The level to log the lines at in the function log, they aren't logged if None.
+    """
+    chunk = []
+    chunk_size = 0
+    for line in stream:
+        tail.append(line)
+        if lines is not None:
+            lines.append(line)
+        if output_file:
+            output_file.write(line)
+        if shipper:
+            shipper.put(line)
+        if ui_stream:
+            ui_stream.feed(line)
+        if log_level is not None:
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= TERRAFORM_OUTPUT_LOG_CHUNK_SIZE:
+                logger.log(log_level, ''.join(chunk).rstrip('\n'))
+                chunk = []
+                chunk_size = 0
+    if chunk:
+        logger.log(log_level, ''.join(chunk).rstrip('\n'))
+    stream.close()
+
+class TerraformUIStream:
+    """
+    Parses the machine-readable UI of a Terraform command run with '-json' while the command runs,
+    see https://developer.hashicorp.com/terraform/internals/machine-readable-ui.
+
+    Records how long applying each resource took, the change summary, the root module outputs and
+    error diagnostics, which give a compact failure reason naming the resource that failed.
+    """
 
-    if log_events:
+    def __init__(self):
+        self.started = {}
+        self.resources = {}
+        self.change_summary = None
+        self.outputs = None
+        self.errors = []
+
+    def feed(self, line):
+        """
+        Processes a line of the UI stream, lines which are not JSON messages are ignored.
+        """
         try:
-            response = cloudwatch_logs.put_log_events(
-                logGroupName=log_group,
-                logStreamName=log_stream_name,
-                logEvents=log_events
-            )
-            logger.info(f"Terraform command output successfully sent to CloudWatch Logs: {response}")
-        except ClientError as e:
-            logger.error(f"Failed to send logs to CloudWatch Logs: {e}")
+            message = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+
+        message_type = message.get('type')
+        hook = message.get('hook') or {}
+        address = (hook.get('resource') or {}).get('addr')
+
+        if message_type == 'apply_start':
+            self.started[address] = time.monotonic()
+        elif message_type in ('apply_complete', 'apply_errored'):
+            # Lines are parsed as they are written, which is more precise than the whole seconds of 'elapsed_seconds'
+            start_time = self.started.pop(address, None)
+            self.resources[address] = {
+                'action': hook.get('action'),
+                'duration': time.monotonic() - start_time if start_time is not None else hook.get('elapsed_seconds', 0),
+                'errored': message_type == 'apply_errored',
+            }
+        elif message_type == 'change_summary':
+            self.change_summary = message.get('changes')
+        elif message_type == 'outputs':
+            self.outputs = message.get('outputs', {})
+        elif message_type == 'diagnostic':
+            diagnostic = message.get('diagnostic') or {}
+            if diagnostic.get('severity') == 'error':
+                self.errors.append(diagnostic)
+
+    def slowest_resources(self, count=TERRAFORM_SLOWEST_RESOURCES_COUNT):
+        """
+        Returns the addresses and details of the resources which took longest to apply, slowest first.
+        """
+        return sorted(self.resources.items(), key=lambda item: item[1]['duration'], reverse=True)[:count]
+
+    def failure_reason(self):
+        """
+        Returns a compact failure reason naming the resource that failed, or None if there are no errors.
+        """
+        errored_addresses = [address for address, resource in self.resources.items() if resource['errored']]
+        if not self.errors and not errored_addresses:
+            return None
+
+        diagnostic = self.errors[0] if self.errors else {}
+        address = diagnostic.get('address') or (errored_addresses[0] if errored_addresses else None)
+        reason = diagnostic.get('summary') or 'the provider reported an error'
+        detail = (diagnostic.get('detail') or '').strip().splitlines()
+        if detail:
+            reason = f"{reason} - {detail[0]}"
+
+        if address:
+            action = self.resources.get(address, {}).get('action') or 'apply'
+            reason = f"Failed to {action} {address}: {reason}"
+        if len(self.errors) > 1:
+            reason = f"{reason} (and {len(self.errors) - 1} more error(s))"
+
+        return reason
+
+    def log_report(self):
+        """
+        Logs the change summary, the durations of all applied resources and the slowest ones.
+        """
+        if self.change_summary:
+            operation = self.change_summary.get('operation', 'apply')
+            verbs = ('to add', 'to change', 'to destroy') if operation == 'plan' else ('added', 'changed', 'destroyed')
+            counts = (self.change_summary.get('add', 0), self.change_summary.get('change', 0), self.change_summary.get('remove', 0))
+            logger.info(f"Terraform {operation} summary: " + ', '.join(f"{count} {verb}" for count, verb in zip(counts, verbs)))
+
+        if not self.resources:
+            return
+
+        rows = [
+            f"{resource['duration']:9.1f}s  {resource['action'] or '':<8} {'errored' if resource['errored'] else 'complete':<9} {address}"
+            for address, resource in self.slowest_resources(len(self.resources))
+        ]
+        logger.info("Resource durations:\n" + "\n".join(rows))
+
+        slowest = ', '.join(f"{address} ({resource['duration']:.1f}s)" for address, resource in self.slowest_resources())
+        logger.info(f"Slowest resources: {slowest}")
+
+class ExecutionDeadlineExceeded(Exception):
+    """
+    Raised when an execution phase runs out of its time budget, see ExecutionDeadline.
+    """
+
+class ExecutionDeadline:
+    """
+    Schedules the execution phases (fetch, init, apply or destroy, output) of an invocation so that
+    the response is sent to CloudFormation before the Lambda function times out.
+
+    Each phase may run until the invocation deadline, less the time reserved for responding and for
+    the phases which follow it (EXECUTION_PHASE_RESERVES). Terraform commands are interrupted with
+    SIGINT early enough to stop gracefully, see run_terraform_command.
+
+    Args:
+        remaining_time (float): Seconds left until the Lambda function times out.
+    """
+
+    def __init__(self, remaining_time):
+        self.deadline = time.monotonic() + remaining_time - EXECUTION_RESPONSE_RESERVE
+        self.phase = None
+
+    @classmethod
+    def from_context(cls, context):
+        """
+        Creates the deadline of the invocation from the Lambda context, or returns None if the
+        context doesn't provide the remaining time.
+        """
+        get_remaining_time_in_millis = getattr(context, 'get_remaining_time_in_millis', None)
+        if not callable(get_remaining_time_in_millis):
+            return None
+
+        return cls(get_remaining_time_in_millis() / 1000)
+
+    def fork(self):
+        """
+        Returns a deadline with the same end and its own phases, for work running in parallel.
+        """
+        forked = object.__new__(type(self))
+        forked.deadline = self.deadline
+        forked.phase = self.phase
+        return forked
+
+    def budget(self, phase=None):
+        """
+        Returns the seconds left for the given phase, by default the current one.
+        """
+        phase = phase or self.phase
+        return self.deadline - time.monotonic() - EXECUTION_PHASE_RESERVES.get(phase, 0)
+
+    def start_phase(self, phase):
+        """
+        Starts the given phase.
+
+        A phase which runs Terraform needs more time than TERRAFORM_INTERRUPT_GRACE_PERIOD, otherwise
+        Terraform would be interrupted as soon as it starts, possibly before it holds the state lock.
+
+        Raises:
+            ExecutionDeadlineExceeded: If there is no time left for the phase.
+        """
+        self.phase = phase
+        budget = self.budget()
+        minimum_budget = TERRAFORM_INTERRUPT_GRACE_PERIOD if phase in TERRAFORM_EXECUTION_PHASES else 0
+        if budget <= minimum_budget:
+            raise ExecutionDeadlineExceeded(f"Not enough time left to start the {phase} phase before the Lambda function times out.")
+
+        logger.info(f"Starting the {phase} phase with a time budget of {budget:.0f}s")
+
+    def terraform_timeout(self):
+        """
+        Returns the seconds a Terraform command of the current phase may run before it is interrupted.
+        """
+        return max(0, self.budget() - TERRAFORM_INTERRUPT_GRACE_PERIOD)
+
+def wait_terraform_process(process, command, deadline=None):
+    """
+    Waits for a Terraform process to exit, interrupting it if the current execution phase runs out of time.
+
+    Terraform receives SIGINT first, which makes it stop gracefully: cancel running operations, persist
+    the state and release the state lock. If it doesn't exit within TERRAFORM_INTERRUPT_GRACE_PERIOD,
+    it is killed.
+
+    Args:
+        process (subprocess.Popen): The Terraform process.
+        command (list): The Terraform command, for error messages.
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+
+    Raises:
+        ExecutionDeadlineExceeded: If the process has been interrupted.
+    """
+    if not deadline:
+        process.wait()
+        return
+
+    timeout = deadline.terraform_timeout()
+    try:
+        process.wait(timeout=timeout)
+        return
+    except subprocess.TimeoutExpired:
+        pass
+
+    logger.warning(f"The {deadline.phase} phase ran out of time, interrupting Terraform...")
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=TERRAFORM_INTERRUPT_GRACE_PERIOD)
+        outcome = "Terraform stopped gracefully"
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Terraform didn't stop within {TERRAFORM_INTERRUPT_GRACE_PERIOD}s after SIGINT, killing it...")
+        process.kill()
+        process.wait()
+        outcome = "Terraform was killed, the state lock may have to be released manually"
+
+    raise ExecutionDeadlineExceeded(
+        f"Terraform command '{' '.join(command[1:])}' was interrupted after {timeout:.0f}s "
+        f"because the {deadline.phase} phase ran out of time before the Lambda function timeout. {outcome}."
+    )
 
-def run_terraform_command(command, log_group=None, log_stream_name=None, environment=None):
+def run_terraform_command(command, log_group=None, log_stream_name=None, environment=None, working_dir=None, allowed_return_codes=(0,), log_stdout=True, deadline=None, ui_stream=None, capture_stdout=False):
 
     """
     Runs a Terraform command and logs output to CloudWatch if log group and stream are provided,
     otherwise logs to the console. Raises a RuntimeError if the command fails.
 
+    Output is streamed, so that memory doesn't grow with it, e.g. with TF_LOG set: only the tails
+    of stdout and stderr are kept (see TerraformOutputTail), unless stdout is captured, and the
+    logged output is spilled to TERRAFORM_OUTPUT_FILE_NAME in the working directory.
+
     Args:
         command (list): Terraform command to run (as a list of strings).
         log_group (str): CloudWatch log group name for logging Terraform output (optional).
         log_stream_name (str): CloudWatch log stream name for logging Terraform output (optional).
         environment (dict): Environment variables for the command (optional).
+        working_dir (str): The Terraform working directory of the custom resource.
+        allowed_return_codes (tuple): Return codes which don't indicate a failure, e.g. 2 for 'plan -detailed-exitcode'.
+        log_stdout (bool): Whether to log stdout of the command, stderr is always logged.
+        deadline (ExecutionDeadline): The invocation deadline, the command is interrupted when it is exceeded (optional).
+        ui_stream (TerraformUIStream): The parser of the machine-readable UI, for commands run with '-json' (optional).
+        capture_stdout (bool): Whether to keep the whole stdout, for commands whose output is parsed.
 
     Returns:
-        result: The result of the Terraform command (stdout and stderr).
+        result: The result of the Terraform command, with the whole stdout if captured, otherwise its tail, and the tail of stderr.
 
     Raises:
         RuntimeError: For Terraform errors or subprocess failures.
+        ExecutionDeadlineExceeded: If the command has been interrupted, see wait_terraform_process.
     """
     try:
         # Run the terraform command and capture the result
         logger.info(f"Running Terraform command: {' '.join(command)}")
-        result = subprocess.run(command, cwd='/tmp', env=environment, capture_output=True, text=True)
+        process = subprocess.Popen(command, cwd=working_dir, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+
+        # Stream Terraform outputs to CloudWatch while the command runs, if the log group is provided, otherwise to the console
+        shipper = get_cloudwatch_logs_shipper(log_group, log_stream_name) if log_group and log_stream_name else None
+        stdout_tail = TerraformOutputTail()
+        stderr_tail = TerraformOutputTail()
+        stdout_lines = [] if capture_stdout else None
+        # Output which isn't logged, e.g. of 'terraform show -json', isn't spilled either
+        output_file = TerraformOutputFile(os.path.join(working_dir, TERRAFORM_OUTPUT_FILE_NAME)) if working_dir else None
+        readers = [
+            threading.Thread(target=read_terraform_output, args=(process.stdout, stdout_tail, stdout_lines, shipper if log_stdout else None, ui_stream, output_file if log_stdout else None, logging.INFO if log_stdout and not shipper else None)),
+            threading.Thread(target=read_terraform_output, args=(process.stderr, stderr_tail, None, shipper, None, output_file, logging.ERROR if not shipper else None)),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            wait_terraform_process(process, command, deadline)
+        finally:
+            for reader in readers:
+                reader.join()
+            if output_file:
+                output_file.close()
+
+            result = subprocess.CompletedProcess(command, process.returncode, ''.join(stdout_lines) if capture_stdout else stdout_tail.getvalue(), stderr_tail.getvalue())
+            record_metric('TerraformStdoutBytes', stdout_tail.total_bytes, 'Bytes')
 
-        # Log Terraform outputs (stdout/stderr) based on log group availability
-        log_output(result.stdout, result.stderr, log_group, log_stream_name)
+            if ui_stream:
+                ui_stream.log_report()
 
-        # Check for terraform-specific error (return code 1)
+        # Check for terraform-specific error (return code 1), reported in the UI stream when it is machine-readable
         if result.returncode == 1:
-            raise RuntimeError(f"Terraform error: {result.stderr}")
+            raise RuntimeError(f"Terraform error: {(ui_stream and ui_stream.failure_reason()) or result.stderr}")
 
-        # Check for other non-zero return codes
-        if result.returncode != 0:
+        # Check for other unexpected return codes
+        if result.returncode not in allowed_return_codes:
             error_message = (
                 f"Terraform command '{' '.join(command)}' failed with return code {result.returncode}.\n"
-                f"STDOUT: {result.stdout}\n"
+                f"STDOUT: {stdout_tail.getvalue()}\n"
                 f"STDERR: {result.stderr}\n"
             )
             logger.error(error_message)
 
-            # Raise a RuntimeError with the detailed message
-            raise RuntimeError(error_message)
+            # Raise a RuntimeError with the detailed message
+            raise RuntimeError(error_message)
+
+        return result
+
+    except subprocess.SubprocessError as e:
+        # Catch subprocess errors, log them to console, and re-raise as RuntimeError
+        logger.error(f"Subprocess error: {str(e)}")
+        raise RuntimeError(f"Subprocess error occurred: {str(e)}") from e
+
+    except ExecutionDeadlineExceeded:
+        raise
+
+    except Exception as e:
+        # General exception handler for unexpected issues, log to console
+        logger.error(f"Unexpected error: {str(e)}")
+        raise RuntimeError(f"Unexpected error: {str(e)}") from e
+
+def get_backend_auto_config_s3_key(event):
+    # Get stack name, guid and logical resource ID to generate discriminating key
+    """
+    Generates an S3 key for storing Terraform state files.
+
+    The key is constructed using the stack name, a unique GUID, and the logical resource ID
+    derived from the CloudFormation event.
+
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+
+    Returns:
+        str: A formatted S3 key for Terraform state storage.
+    """
+    stack_name = event['StackId'].split('/')[-2]
+    guid = event['StackId'].split('/')[-1]
+    logical_resource_id = event['LogicalResourceId']
+
+    key = f"terraform-state/{stack_name}/{guid}/{logical_resource_id}"
+
+    return key
+
+def get_backend_auto_config_s3_content(event):
+    """
+    Generates the Terraform backend configuration content based on environment variables and event data.
+
+    The content is generated using the 'bucket', 'dynamodb_table', and 'key' values.
+    The 'key' is generated using the stack name, a unique GUID, and the logical resource ID
+    derived from the CloudFormation event.
+
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+
+    Returns:
+        str: The auto-generated Terraform backend configuration content.
+    """
+    bucket = os.environ.get("TERRAFORM_BACKEND_S3_BUCKET")
+    dynamodb_table = os.environ.get("TERRAFORM_BACKEND_S3_DYNAMODB_TABLE")
+
+    if not bucket or not dynamodb_table:
+        raise Exception("Environment variables TERRAFORM_BACKEND_S3_BUCKET and TERRAFORM_BACKEND_S3_DYNAMODB_TABLE must be set.")
+
+    key = get_backend_auto_config_s3_key(event)
+
+    # Auto-generated backend-config values
+    backend_config_content = textwrap.dedent(f"""
+        bucket         = "{bucket}"
+        dynamodb_table = "{dynamodb_table}"
+        key            = "{key}"
+        encrypt        = "true"
+        """)
+
+    return backend_config_content
+
+def build_terraform_init_cmd(terraform_binary, backend_config, event, working_dir):
+
+    """
+    Builds the Terraform init command, adding -backend-config if necessary.
+
+    Args:
+        terraform_binary (str): The path to the Terraform binary.
+        backend_config (str): The backend configuration. If set to 'Auto', the backend configuration
+            is generated using environment variables and the CloudFormation event data.
+        event (dict): The CloudFormation event data.
+        working_dir (str): The Terraform working directory of the custom resource.
+
+    Returns:
+        list: The Terraform init command as a list of arguments.
+    """
+    init_cmd = [terraform_binary, "init", "-no-color"]
+
+    if backend_config:
+        if not isinstance(backend_config, str):
+            raise Exception("Backend property, if set, must be a string.")
+        if backend_config == "Auto":
+            logger.info("Using auto-generated backend configuration")
+            backend_config_content = get_backend_auto_config_s3_content(event)
+        else:
+            logger.info("Using provided backend configuration")
+            backend_config_content = backend_config
+
+        # Write backend properties to a file
+        backend_file_path = os.path.join(working_dir, "config.generated.tfbackend")
+        with open(backend_file_path, 'w') as backend_file:
+            backend_file.write(backend_config_content)
+
+        logger.info(f"Backend configuration written to {backend_file_path}")
+
+        # Provide the backend config file to terraform
+        init_cmd.extend(["-backend-config", backend_file_path])
+
+    return init_cmd
+
+def list_terraform_mirrored_providers(mirror_dir=TERRAFORM_PROVIDERS_MIRROR_DIR):
+
+    """
+    List providers available in a Terraform provider filesystem mirror.
+
+    The mirror is produced by 'terraform providers mirror' and uses the layout
+    <hostname>/<namespace>/<type>/..., so the first three levels identify a provider.
+
+    Args:
+        mirror_dir (str): The root of the provider mirror.
+
+    Returns:
+        list: Provider source addresses in form '<hostname>/<namespace>/<type>'.
+    """
+    if not os.path.isdir(mirror_dir):
+        return []
+
+    providers = []
+    for hostname in sorted(os.listdir(mirror_dir)):
+        hostname_dir = os.path.join(mirror_dir, hostname)
+        if not os.path.isdir(hostname_dir):
+            continue
+        for namespace in sorted(os.listdir(hostname_dir)):
+            namespace_dir = os.path.join(hostname_dir, namespace)
+            if not os.path.isdir(namespace_dir):
+                continue
+            for provider_type in sorted(os.listdir(namespace_dir)):
+                if os.path.isdir(os.path.join(namespace_dir, provider_type)):
+                    providers.append(f"{hostname}/{namespace}/{provider_type}")
+
+    return providers
+
+def build_terraform_cli_config_content(mirrored_providers, provider_installation):
+
+    """
+    Builds a Terraform CLI configuration which installs providers from the bundled mirror first.
+
+    Mirrored providers are excluded from direct installation, otherwise Terraform would still
+    query their registries to pick the newest version across all installation methods. Direct
+    installation is omitted altogether if network access is forbidden.
+
+    Args:
+        mirrored_providers (list): Provider source addresses available in the mirror.
+        provider_installation (str): One of SUPPORTED_PROVIDER_INSTALLATION_MODES.
+
+    Returns:
+        str: The Terraform CLI configuration content.
+    """
+    provider_addresses = json.dumps(mirrored_providers)
+
+    cli_config_content = textwrap.dedent(f"""
+        provider_installation {{
+          filesystem_mirror {{
+            path    = "{TERRAFORM_PROVIDERS_MIRROR_DIR}"
+            include = {provider_addresses}
+          }}
+        """)
+
+    if provider_installation != 'Offline':
+        cli_config_content += textwrap.indent(textwrap.dedent(f"""
+            direct {{
+              exclude = {provider_addresses}
+            }}
+            """), '  ')
+
+    cli_config_content += "}\n"
+
+    return cli_config_content
+
+def setup_terraform_provider_installation(resource_properties, environment, working_dir):
+
+    """
+    Configure Terraform to install providers from the filesystem mirror bundled into the Lambda package.
+
+    The generated CLI configuration is provided to Terraform with the 'TF_CLI_CONFIG_FILE' environment
+    variable, unless it is set explicitly in the 'Environment' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+        environment (dict): The environment variables for the Terraform command, updated in place.
+        working_dir (str): The Terraform working directory of the custom resource.
+
+    Returns:
+        str: The provider installation mode, one of SUPPORTED_PROVIDER_INSTALLATION_MODES.
+    """
+    provider_installation = resource_properties.get('ProviderInstallation', 'Auto')
+    if provider_installation not in SUPPORTED_PROVIDER_INSTALLATION_MODES:
+        raise Exception(f"ProviderInstallation property, if set, must be one of: {', '.join(SUPPORTED_PROVIDER_INSTALLATION_MODES)}.")
+
+    if 'TF_CLI_CONFIG_FILE' in resource_properties.get('Environment', {}):
+        if provider_installation == 'Offline':
+            raise Exception("ProviderInstallation property can't be set to 'Offline' if 'TF_CLI_CONFIG_FILE' environment variable is provided.")
+        logger.info("Using provided Terraform CLI configuration, provider mirror is not used")
+        return provider_installation
+
+    mirrored_providers = list_terraform_mirrored_providers()
+    if not mirrored_providers:
+        if provider_installation == 'Offline':
+            raise Exception(f"ProviderInstallation property is set to 'Offline', but the provider mirror {TERRAFORM_PROVIDERS_MIRROR_DIR} is empty.")
+        logger.info("Provider mirror is empty, installing providers from their registries")
+        return provider_installation
+
+    cli_config_path = os.path.join(working_dir, TERRAFORM_CLI_CONFIG_FILE_NAME)
+    with open(cli_config_path, 'w') as cli_config_file:
+        cli_config_file.write(build_terraform_cli_config_content(mirrored_providers, provider_installation))
+
+    logger.info(f"Terraform CLI configuration written to {cli_config_path}, mirrored providers: {', '.join(mirrored_providers)}")
+    environment['TF_CLI_CONFIG_FILE'] = cli_config_path
+
+    return provider_installation
+
+def run_terraform_init(init_cmd, provider_installation, log_group=None, log_stream_name=None, environment=None, working_dir=None, deadline=None):
+
+    """
+    Runs 'terraform init' and reports how long it took.
+
+    If providers fail to install from the bundled mirror, for example because the configuration
+    requires a provider version which is not mirrored, init is retried with the default provider
+    installation, unless network access is forbidden with the 'Offline' provider installation mode.
+
+    Args:
+        init_cmd (list): The Terraform init command, see build_terraform_init_cmd.
+        provider_installation (str): One of SUPPORTED_PROVIDER_INSTALLATION_MODES.
+        log_group (str): CloudWatch log group name for logging Terraform output (optional).
+        log_stream_name (str): CloudWatch log stream name for logging Terraform output (optional).
+        environment (dict): Environment variables for the command (optional).
+        working_dir (str): The Terraform working directory of the custom resource.
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+
+    Returns:
+        result: The result of the Terraform init command (stdout and stderr).
+    """
+    uses_provider_mirror = environment is not None and os.path.basename(environment.get('TF_CLI_CONFIG_FILE', '')) == TERRAFORM_CLI_CONFIG_FILE_NAME
+    mirror_description = "with" if uses_provider_mirror else "without"
+
+    start_time = time.monotonic()
+    try:
+        result = run_terraform_command(init_cmd, log_group, log_stream_name, environment, working_dir, deadline=deadline)
+    except RuntimeError as e:
+        logger.info(f"'terraform init' failed after {time.monotonic() - start_time:.2f}s {mirror_description} the provider mirror")
+        if not uses_provider_mirror or provider_installation == 'Offline':
+            raise
+        if not any(error in str(e) for error in TERRAFORM_PROVIDER_INSTALLATION_ERRORS):
+            raise
+
+        logger.warning("Failed to install providers from the provider mirror, retrying 'terraform init' without it")
+        environment = {key: value for key, value in environment.items() if key != 'TF_CLI_CONFIG_FILE'}
+        mirror_description = "without"
+        start_time = time.monotonic()
+        result = run_terraform_command(init_cmd, log_group, log_stream_name, environment, working_dir, deadline=deadline)
+
+    logger.info(f"'terraform init' completed in {time.monotonic() - start_time:.2f}s {mirror_description} the provider mirror")
+
+    return result
+
+def hash_file_content(file_path):
+
+    """
+    Calculate the SHA-256 digest of a file.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hex digest of the file content, or None if the file doesn't exist.
+    """
+    if not file_path or not os.path.isfile(file_path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+# Terraform versions by binary path and modification time, resolved once per container
+terraform_versions = {}
+
+def get_terraform_version(terraform_binary):
+
+    """
+    Get the version of a Terraform binary.
+
+    The version is resolved with 'terraform version -json' once per binary and cached for
+    subsequent (warm) invocations.
+
+    Args:
+        terraform_binary (str): The path to the Terraform binary.
+
+    Returns:
+        str: The Terraform version.
+    """
+    cache_key = (terraform_binary, os.path.getmtime(terraform_binary))
+    if cache_key not in terraform_versions:
+        result = subprocess.run([terraform_binary, 'version', '-json'], capture_output=True, text=True, check=True)
+        terraform_versions[cache_key] = json.loads(result.stdout)['terraform_version']
+
+    return terraform_versions[cache_key]
+
+# Locks and user counts of the downloaded Terraform binaries used by running invocations, by version
+terraform_release_locks = {}
+terraform_releases_lock = threading.Lock()
+
+def get_terraform_release_platform():
+
+    """
+    Get the platform of Terraform release archives matching the Lambda function architecture.
+
+    Returns:
+        str: The platform, e.g. 'linux_amd64'.
+    """
+    return {'x86_64': 'linux_amd64', 'aarch64': 'linux_arm64'}.get(platform.machine(), f"linux_{platform.machine()}")
+
+def open_terraform_release_file(url):
+
+    """
+    Open a file of a Terraform release on an HTTP(S) or S3 mirror for streaming.
+
+    Args:
+        url (str): The URL of the file.
+
+    Returns:
+        A binary file-like object with the file content, to be closed by the caller.
+    """
+    parsed_url = urllib3.util.parse_url(url)
+
+    if parsed_url.scheme == 's3':
+        try:
+            return get_aws_client('s3').get_object(Bucket=parsed_url.host, Key=parsed_url.path.lstrip('/'))['Body']
+        except Exception as e:
+            raise Exception(f"Failed to get Terraform release file from S3 {url} - {e}")
+
+    try:
+        response = http.request('GET', url, redirect=True, preload_content=False, timeout=urllib3.Timeout(connect=5, read=TERRAFORM_RELEASE_READ_TIMEOUT))
+    except Exception as e:
+        raise Exception(f"Failed to get Terraform release file from URL {url} - {e}")
+    if not 200 <= response.status < 300:
+        response.release_conn()
+        raise Exception(f"Failed to get Terraform release file from URL {url} - received non-2xx status {response.status}")
+
+    return response
+
+def download_terraform_release(version, destination_dir):
+
+    """
+    Download a Terraform release from the releases mirror, verify and extract its binary.
+
+    The mirror has the layout of https://releases.hashicorp.com/terraform and is set with the
+    TERRAFORM_RELEASES_MIRROR environment variable. The archive is streamed to a temporary file
+    while its SHA-256 digest is calculated, and compared with the digest in the SHA256SUMS file
+    of the release before the binary is extracted.
+
+    Args:
+        version (str): The Terraform version.
+        destination_dir (str): The directory the 'terraform' binary is extracted into.
+
+    Returns:
+        str: The path to the extracted binary.
+    """
+    mirror = (os.environ.get('TERRAFORM_RELEASES_MIRROR') or TERRAFORM_RELEASES_MIRROR_DEFAULT).rstrip('/')
+    archive_name = f"terraform_{version}_{get_terraform_release_platform()}.zip"
+
+    with contextlib.closing(open_terraform_release_file(f"{mirror}/{version}/terraform_{version}_SHA256SUMS")) as stream:
+        checksums = dict(reversed(line.split()) for line in stream.read().decode('utf-8').splitlines() if line.strip())
+    if archive_name not in checksums:
+        raise Exception(f"Terraform release {version} has no {archive_name} in {mirror}")
+
+    start_time = time.monotonic()
+    os.makedirs(TERRAFORM_VERSIONS_CACHE_DIR, exist_ok=True)
+    os.makedirs(TERRAFORM_VERSIONS_STAGING_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=TERRAFORM_VERSIONS_STAGING_DIR) as download_dir:
+        archive_path = os.path.join(download_dir, archive_name)
+        digest = hashlib.sha256()
+        with contextlib.closing(open_terraform_release_file(f"{mirror}/{version}/{archive_name}")) as stream, open(archive_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(2**20), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != checksums[archive_name]:
+            raise Exception(f"Checksum of {archive_name} from {mirror} doesn't match its SHA256SUMS")
+        record_metric('TerraformDownloadBytes', os.path.getsize(archive_path), 'Bytes')
+
+        # Extract to the staging directory and rename, so that a partially extracted binary is never used
+        extract_dir = os.path.join(download_dir, 'extract')
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extract('terraform', extract_dir)
+        os.chmod(os.path.join(extract_dir, 'terraform'), 0o755)
+        shutil.rmtree(destination_dir, ignore_errors=True)
+        os.replace(extract_dir, destination_dir)
+
+    logger.info(f"Downloaded Terraform {version} from {mirror} in {time.monotonic() - start_time:.2f}s")
+
+    return os.path.join(destination_dir, 'terraform')
+
+def evict_terraform_releases(max_size):
+
+    """
+    Remove least recently used downloaded Terraform binaries until all of them fit into the given size.
+
+    Binaries are ordered by the modification time of their directory, which is updated every time
+    a binary is resolved. Binaries used by running invocations are never evicted, and neither are
+    entries which aren't versions, downloads are staged in TERRAFORM_VERSIONS_STAGING_DIR. The
+    caller must hold terraform_releases_lock.
+
+    Args:
+        max_size (int): The maximum total size of the downloaded binaries in bytes.
+    """
+    releases = []
+    for version in os.listdir(TERRAFORM_VERSIONS_CACHE_DIR):
+        if not re.fullmatch(TERRAFORM_VERSION_PATTERN, version):
+            continue
+        release_path = os.path.join(TERRAFORM_VERSIONS_CACHE_DIR, version)
+        releases.append((os.path.getmtime(release_path), version, release_path, get_directory_size(release_path)))
+
+    total_size = sum(size for _, _, _, size in releases)
+    for _, version, release_path, size in sorted(releases):
+        if total_size <= max_size:
+            break
+        if version in terraform_release_locks:
+            continue
+        logger.info(f"Evicting Terraform {version} from {TERRAFORM_VERSIONS_CACHE_DIR}")
+        shutil.rmtree(release_path, ignore_errors=True)
+        total_size -= size
+
+@contextlib.contextmanager
+def terraform_release(version=None):
+
+    """
+    Resolve the Terraform binary of a version for the duration of a block.
+
+    Binaries are looked up in this order:
+
+    - The default binary bundled into the Lambda package (TERRAFORM_BINARY), if no version is
+      requested or it has the requested version.
+    - Binaries of other versions bundled under TERRAFORM_BUNDLED_VERSIONS_DIR.
+    - Binaries downloaded by previous invocations under TERRAFORM_VERSIONS_CACHE_DIR.
+    - The releases mirror, see download_terraform_release.
+
+    Least recently used downloaded binaries are evicted to keep them within a share of the ephemeral
+    storage, configured with the TERRAFORM_VERSIONS_STORAGE_SHARE environment variable.
+
+    Args:
+        version (str): The Terraform version, e.g. '1.9.8' (optional).
+
+    Yields:
+        str: The path to the Terraform binary.
+    """
+    release = None
+    try:
+        with measure_phase('TerraformResolution'):
+            terraform_binary = get_bundled_terraform_binary(version)
+            if not terraform_binary:
+                with terraform_releases_lock:
+                    release = terraform_release_locks.setdefault(version, {'lock': threading.Lock(), 'users': 0})
+                    # Register the binary as used before eviction, so that it is not evicted
+                    release['users'] += 1
+
+                release_dir = os.path.join(TERRAFORM_VERSIONS_CACHE_DIR, version)
+                terraform_binary = os.path.join(release_dir, 'terraform')
+                with release['lock']:
+                    if os.path.isfile(terraform_binary):
+                        logger.info(f"Using Terraform {version} downloaded by a previous invocation")
+                    else:
+                        with measure_phase('TerraformDownload'):
+                            download_terraform_release(version, release_dir)
+                    os.utime(release_dir)
+
+                with terraform_releases_lock:
+                    evict_terraform_releases(get_ephemeral_storage_share('TERRAFORM_VERSIONS_STORAGE_SHARE', TERRAFORM_VERSIONS_STORAGE_SHARE_DEFAULT))
+
+        yield terraform_binary
+    finally:
+        if release:
+            with terraform_releases_lock:
+                release['users'] -= 1
+                if not release['users']:
+                    del terraform_release_locks[version]
+
+def get_bundled_terraform_binary(version=None):
+
+    """
+    Get the Terraform binary of a version bundled into the Lambda package.
+
+    Args:
+        version (str): The Terraform version (optional).
+
+    Returns:
+        str: The path to the default binary if no version is requested or it has the requested
+            version, the path to another bundled binary, or None if the version isn't bundled.
+    """
+    if not version or get_terraform_version(TERRAFORM_BINARY) == version:
+        return TERRAFORM_BINARY
+
+    if not isinstance(version, str) or not re.fullmatch(TERRAFORM_VERSION_PATTERN, version):
+        raise Exception("TerraformVersion property, if set, must be a Terraform version, e.g. '1.9.8'.")
+
+    bundled_binary = os.path.join(TERRAFORM_BUNDLED_VERSIONS_DIR, version, 'terraform')
+    if os.path.isfile(bundled_binary):
+        logger.info(f"Using bundled Terraform {version}")
+        return bundled_binary
+
+    return None
+
+def extract_terraform_backend_blocks(configuration_content):
+
+    """
+    Extract backend blocks from Terraform configuration content.
+
+    Braces are matched naively, which is sufficient to detect changes of the backend
+    configuration between invocations.
+
+    Args:
+        configuration_content (str): The Terraform configuration content.
+
+    Returns:
+        list: The text of every 'backend' block found in the configuration.
+    """
+    backend_blocks = []
+    for match in re.finditer(r'\bbackend\s+"[^"]*"\s*\{', configuration_content):
+        depth = 0
+        for position in range(match.end() - 1, len(configuration_content)):
+            if configuration_content[position] == '{':
+                depth += 1
+            elif configuration_content[position] == '}':
+                depth -= 1
+                if depth == 0:
+                    backend_blocks.append(configuration_content[match.start():position + 1])
+                    break
+
+    return backend_blocks
+
+def get_terraform_init_fingerprint(terraform_binary, init_cmd, environment, working_dir):
+
+    """
+    Calculate the fingerprint of 'terraform init' inputs.
+
+    The fingerprint consists of independent parts, so that the caller can decide how much
+    of 'terraform init' has to be repeated:
+
+    - 'terraform_version': the version of the Terraform binary.
+    - 'backend': the backend blocks of the configuration and the backend configuration file.
+    - 'configuration': the files of the configuration tree, including local modules, other than
+      the files preserved in the workspace and the generated ones, and the Terraform CLI configuration.
+    - 'lock': the dependency lock file which comes with the configuration, otherwise the one of the
+      previous init, see clean_terraform_cache.
+
+    Args:
+        terraform_binary (str): The path to the Terraform binary.
+        init_cmd (list): The Terraform init command, see build_terraform_init_cmd.
+        environment (dict): The environment variables for the Terraform command.
+        working_dir (str): The directory Terraform is initialized in.
+
+    Returns:
+        dict: The fingerprint.
+    """
+    configuration_digest = hashlib.sha256()
+    backend_digest = hashlib.sha256()
+
+    for root, dir_names, file_names in os.walk(working_dir):
+        preserved_files = TERRAFORM_WORKSPACE_PRESERVED_FILES if root == working_dir else []
+        dir_names[:] = sorted(dir_name for dir_name in dir_names if dir_name not in preserved_files)
+        for file_name in sorted(file_names):
+            # Variables and the generated files don't affect 'terraform init', the backend and CLI configurations are hashed below
+            if file_name in preserved_files or file_name in TERRAFORM_INIT_FINGERPRINT_IGNORED_FILES or '.generated.' in file_name:
+                continue
+            file_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(file_path, working_dir)
+            with open(file_path, 'rb') as f:
+                configuration_content = f.read()
+            configuration_digest.update(f"{relative_path}\0".encode('utf-8'))
+            configuration_digest.update(hashlib.sha256(configuration_content).digest())
+            # Backend blocks are only allowed in the root module
+            if root == working_dir and file_name.endswith(('.tf', '.tf.json')):
+                for backend_block in extract_terraform_backend_blocks(configuration_content.decode('utf-8', errors='replace')):
+                    backend_digest.update(backend_block.encode('utf-8'))
+
+    backend_file_path = init_cmd[init_cmd.index('-backend-config') + 1] if '-backend-config' in init_cmd else None
+    backend_digest.update(f"{hash_file_content(backend_file_path)}".encode('utf-8'))
+
+    cli_config_path = (environment or {}).get('TF_CLI_CONFIG_FILE')
+    configuration_digest.update(f"{cli_config_path}\0{hash_file_content(cli_config_path)}".encode('utf-8'))
+
+    return {
+        'terraform_version': get_terraform_version(terraform_binary),
+        'backend': backend_digest.hexdigest(),
+        'configuration': configuration_digest.hexdigest(),
+        'lock': hash_file_content(get_terraform_lock_file_path(working_dir)),
+    }
+
+def get_terraform_lock_file_path(working_dir):
+
+    """
+    Get the path of the dependency lock file 'terraform init' will use.
+
+    Args:
+        working_dir (str): The directory Terraform is initialized in.
+
+    Returns:
+        str: The path of the lock file which comes with the configuration, if any, otherwise the
+            path of the lock file of the previous init set aside by clean_terraform_cache.
+    """
+    lock_file_path = os.path.join(working_dir, TERRAFORM_LOCK_FILE_NAME)
+    if os.path.exists(lock_file_path):
+        return lock_file_path
+
+    return os.path.join(working_dir, '.terraform', TERRAFORM_PREVIOUS_LOCK_FILE_NAME)
+
+def terraform_providers_installed(working_dir):
+
+    """
+    Check that providers installed in the .terraform directory are still available.
+
+    Providers are linked from the plugin cache, which is pruned independently from the
+    .terraform directory.
+
+    Args:
+        working_dir (str): The directory Terraform was initialized in.
+
+    Returns:
+        bool: True if every installed provider resolves to an existing directory.
+    """
+    providers_dir = os.path.join(working_dir, '.terraform', 'providers')
+
+    return all(
+        os.path.isdir(os.path.join(providers_dir, key))
+        for key in list_terraform_provider_packages(providers_dir)
+    )
+
+def prepare_terraform_init_cmd(init_cmd, fingerprint, working_dir):
+
+    """
+    Decide how much of 'terraform init' has to be run, based on the fingerprint of the previous init.
+
+    - If the fingerprint is unchanged, init is skipped altogether.
+    - If only the configuration or the lock file changed, init runs with '-backend=false' to
+      install modules and providers, and the lock file is regenerated.
+    - Otherwise the .terraform directory and the lock file are removed and init runs in full.
+
+    A lock file which comes with the configuration pins the provider versions, it is never removed.
+    Otherwise the lock file of the previous init is put back in place.
+
+    Args:
+        init_cmd (list): The Terraform init command, see build_terraform_init_cmd.
+        fingerprint (dict): The fingerprint of the current init inputs, see get_terraform_init_fingerprint.
+        working_dir (str): The directory Terraform is initialized in.
+
+    Returns:
+        list: The Terraform init command to run, or None if init can be skipped.
+    """
+    terraform_dir = os.path.join(working_dir, '.terraform')
+    fingerprint_path = os.path.join(terraform_dir, TERRAFORM_INIT_FINGERPRINT_FILE_NAME)
+    lock_file_path = os.path.join(working_dir, TERRAFORM_LOCK_FILE_NAME)
+    previous_lock_file_path = os.path.join(terraform_dir, TERRAFORM_PREVIOUS_LOCK_FILE_NAME)
+
+    configuration_lock_file = os.path.exists(lock_file_path)
+    if os.path.exists(previous_lock_file_path):
+        if configuration_lock_file:
+            os.remove(previous_lock_file_path)
+        else:
+            os.replace(previous_lock_file_path, lock_file_path)
+
+    previous_fingerprint = {}
+    if os.path.exists(fingerprint_path):
+        try:
+            with open(fingerprint_path) as f:
+                previous_fingerprint = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load 'terraform init' fingerprint - {e}")
+
+    if previous_fingerprint == fingerprint and terraform_providers_installed(working_dir):
+        logger.info("'terraform init' inputs are unchanged, skipping 'terraform init'")
+        return None
+
+    # The fingerprint is saved again only if init succeeds
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
+
+    if all(previous_fingerprint.get(part) == fingerprint[part] for part in ('terraform_version', 'backend')):
+        logger.info("Terraform backend is unchanged, running 'terraform init' with '-backend=false'")
+        if os.path.exists(lock_file_path) and not configuration_lock_file:
+            os.remove(lock_file_path)
+        init_cmd = list(init_cmd)
+        if '-backend-config' in init_cmd:
+            position = init_cmd.index('-backend-config')
+            del init_cmd[position:position + 2]
+        return [*init_cmd, '-backend=false']
+
+    if os.path.exists(terraform_dir):
+        logger.info("Removing cached .terraform directory")
+        shutil.rmtree(terraform_dir)
+    if os.path.exists(lock_file_path) and not configuration_lock_file:
+        os.remove(lock_file_path)
+
+    return init_cmd
+
+def save_terraform_init_fingerprint(fingerprint, working_dir):
+
+    """
+    Store the fingerprint of a successful 'terraform init' in the .terraform directory.
+
+    The lock file part of the fingerprint is updated, as init may have (re)generated the lock file.
+
+    Args:
+        fingerprint (dict): The fingerprint of the init inputs, see get_terraform_init_fingerprint.
+        working_dir (str): The directory Terraform was initialized in.
+    """
+    fingerprint = {**fingerprint, 'lock': hash_file_content(os.path.join(working_dir, TERRAFORM_LOCK_FILE_NAME))}
+
+    terraform_dir = os.path.join(working_dir, '.terraform')
+    os.makedirs(terraform_dir, exist_ok=True)
+    with open(os.path.join(terraform_dir, TERRAFORM_INIT_FINGERPRINT_FILE_NAME), 'w') as f:
+        json.dump(fingerprint, f)
+
+def check_cloudformation_stack_status(stack_name):
+    """
+    Retrieves the current status of a CloudFormation stack.
+
+    Args:
+        stack_name (str): The name of the CloudFormation stack.
+
+    Returns:
+        str: The current status of the stack, or None if an error occurs.
+    """
+    client = get_aws_client('cloudformation')
+
+    try:
+        response = client.describe_stacks(StackName=stack_name)
+        stack_status = response['Stacks'][0]['StackStatus']
+        return stack_status
+
+    except client.exceptions.ClientError as e:
+        print(f"Error checking stack status: {e}")
+        return None
+
+def get_backend_auto_config_s3_state_location(event, backend_config, environment=None):
+    """
+    Returns the location of the Terraform state of the auto-configured S3 backend.
+
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+        backend_config (str): The 'Backend' property.
+        environment (dict): The environment variables for the Terraform command.
+
+    Returns:
+        tuple: The S3 bucket and key of the state, or None for other backends and non-default workspaces.
+    """
+    if backend_config != 'Auto' or (environment or {}).get('TF_WORKSPACE', 'default') != 'default':
+        return None
+
+    return os.environ.get("TERRAFORM_BACKEND_S3_BUCKET"), get_backend_auto_config_s3_key(event)
+
+def read_terraform_state_summary(stream, chunk_size=TERRAFORM_STATE_READ_CHUNK_SIZE):
+    """
+    Reads the outputs of a Terraform state and whether it has any resources, without loading all of it.
+
+    Terraform writes the top-level fields of a state (format version 4) in a fixed order, with the
+    outputs before the resources, so the stream is read in chunks only up to the first character of
+    the resources list. Fields are decoded one at a time and dropped from the buffer once decoded.
+
+    Args:
+        stream: A binary file-like object with the state document.
+        chunk_size (int): The number of bytes read from the stream at a time.
+
+    Returns:
+        dict: The state 'version', the 'outputs' as in 'terraform output -json', 'has_resources',
+            and the number of 'bytes_read'.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    summary = {'version': None, 'outputs': {}, 'has_resources': False, 'bytes_read': 0}
+    buffer = ''
+    position = 0
+    end_of_stream = False
+
+    def read_more(size):
+        nonlocal buffer, end_of_stream
+        chunk = stream.read(size)
+        summary['bytes_read'] += len(chunk)
+        end_of_stream = not chunk
+        buffer += text_decoder.decode(chunk, final=end_of_stream)
+
+    def next_character():
+        # Skips whitespace and returns the next significant character, or '' at the end of the stream
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer) or end_of_stream:
+                return buffer[position:position + 1]
+            read_more(chunk_size)
+
+    def decode_value():
+        # Numbers can be cut at the end of the buffer, so a value must be followed by at least one character
+        nonlocal buffer, position
+        next_character()
+        read_size = chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or end_of_stream:
+                    buffer, position = buffer[end:], 0
+                    return value
+            except json.JSONDecodeError:
+                if end_of_stream:
+                    raise
+            read_more(read_size)
+            read_size *= 2
+
+    if next_character() != '{':
+        raise Exception("Terraform state is not a JSON object")
+    position += 1
+
+    while True:
+        character = next_character()
+        if character == ',':
+            position += 1
+            character = next_character()
+        if character in ('}', ''):
+            break
+
+        key = decode_value()
+        if next_character() != ':':
+            raise Exception("Terraform state is not a valid JSON object")
+        position += 1
+
+        if key == 'resources':
+            if next_character() != '[':
+                raise Exception("Terraform state resources are not a list")
+            position += 1
+            summary['has_resources'] = next_character() != ']'
+            break
+
+        value = decode_value()
+        if key in ('version', 'outputs'):
+            summary[key] = value
+
+    if summary['version'] != 4:
+        raise Exception(f"Unsupported Terraform state version: {summary['version']}")
+
+    return summary
+
+def read_terraform_s3_state_summary(state_location):
+    """
+    Reads the summary of a Terraform state stored in S3, see read_terraform_state_summary.
+
+    A missing state object is read as an empty state, like Terraform does. The response body is
+    closed once the summary is read, without downloading the rest of the state.
+
+    Args:
+        state_location (tuple): The S3 bucket and key of the state.
+
+    Returns:
+        dict: The state summary.
+    """
+    bucket, key = state_location
+    start_time = time.monotonic()
+    try:
+        response = get_aws_client('s3').get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ['NoSuchKey', '404']:
+            raise
+        logger.info(f"Terraform state s3://{bucket}/{key} doesn't exist yet")
+        return {'version': 4, 'outputs': {}, 'has_resources': False, 'bytes_read': 0}
+
+    with contextlib.closing(response['Body']) as body:
+        summary = read_terraform_state_summary(body)
+
+    logger.info(f"Read {summary['bytes_read']} of {response.get('ContentLength')} bytes of the Terraform state s3://{bucket}/{key} in {time.monotonic() - start_time:.2f}s")
+    return summary
+
+def get_terraform_state_lock(event, state_location):
+    """
+    Returns the DynamoDB state lock of the auto-configured S3 backend, see run_terraform_locking_command.
+
+    Args:
+        event (dict): The Lambda event, its request ID identifies the invocation owning the lock.
+        state_location (tuple): The S3 bucket and key of the state, see get_backend_auto_config_s3_state_location.
+
+    Returns:
+        dict: The DynamoDB 'table', the 'lock_id' of the lock item and the 'request_id' of the
+            invocation, or None if the state location or the table isn't known.
+    """
+    table = os.environ.get("TERRAFORM_BACKEND_S3_DYNAMODB_TABLE")
+    if not state_location or not table:
+        return None
+
+    bucket, key = state_location
+    return {'table': table, 'lock_id': f"{bucket}/{key}", 'request_id': event.get('RequestId')}
+
+def read_terraform_state_lock(state_lock):
+    """
+    Reads the state lock item written by Terraform and the owner marker written by the invocation which abandoned it.
+
+    Args:
+        state_lock (dict): The state lock, see get_terraform_state_lock.
+
+    Returns:
+        tuple: The lock info (with 'ID', 'Operation', 'Who' and 'Created') or None if the state isn't
+            locked, and the owner marker (with 'RequestId', 'Created', 'Expires' and the 'LockId' of
+            the lock it abandoned) or None.
+    """
+    dynamodb = get_aws_client('dynamodb')
+    lock_item = dynamodb.get_item(TableName=state_lock['table'], Key={'LockID': {'S': state_lock['lock_id']}}, ConsistentRead=True).get('Item')
+    owner_item = dynamodb.get_item(TableName=state_lock['table'], Key={'LockID': {'S': state_lock['lock_id'] + TERRAFORM_STATE_LOCK_OWNER_SUFFIX}}, ConsistentRead=True).get('Item')
+
+    lock = json.loads(lock_item['Info']['S']) if lock_item and 'Info' in lock_item else None
+    owner = None
+    if owner_item:
+        owner = {'RequestId': owner_item['RequestId']['S'], 'Created': float(owner_item['Created']['N']), 'Expires': float(owner_item['Expires']['N']), 'LockId': owner_item.get('LockId', {}).get('S')}
+
+    return lock, owner
+
+def is_stale_terraform_state_lock(lock, owner):
+    """
+    Checks whether a state lock was left by an invocation which timed out, e.g. because Terraform was killed.
+
+    A lock is stale if the owner marker of an invocation recorded its ID, see
+    record_abandoned_terraform_state_lock, more than TERRAFORM_STATE_LOCK_STALE_GRACE_PERIOD ago.
+    Locks without an owner marker, e.g. acquired by Terraform run outside of the Lambda function,
+    or acquired after the marker recorded another lock, are never stale.
+
+    Args:
+        lock (dict): The lock info, see read_terraform_state_lock.
+        owner (dict): The owner marker, see read_terraform_state_lock.
+
+    Returns:
+        bool: True if the lock is stale.
+    """
+    if not lock or not owner or not lock.get('ID'):
+        return False
+
+    return lock['ID'] == owner['LockId'] and time.time() > owner['Expires'] + TERRAFORM_STATE_LOCK_STALE_GRACE_PERIOD
+
+def record_abandoned_terraform_state_lock(state_lock, started):
+    """
+    Records the invocation as the owner of the state lock its interrupted Terraform command left behind, if any.
+
+    Terraform killed after the execution deadline can't release the state lock. Terraform doesn't
+    report the ID of the lock it acquires, so the lock item is read once the process has exited: a
+    lock created on this host ('Who' of the lock info) since the command started is the
+    invocation's own, locks of other hosts are never recorded. The owner marker is a DynamoDB item
+    next to the lock item, with the request ID, the time the lock was abandoned and the ID of the
+    lock, see is_stale_terraform_state_lock. Commands which aren't interrupted make no DynamoDB calls.
+
+    Args:
+        state_lock (dict): The state lock, see get_terraform_state_lock.
+        started (float): The time the Terraform command started (seconds since the epoch).
+    """
+    try:
+        lock, _ = read_terraform_state_lock(state_lock)
+        if not lock or not lock.get('ID') or not lock.get('Created') or not str(lock.get('Who')).endswith(f"@{socket.gethostname()}"):
+            return
+        # Terraform records the creation time in UTC with nanoseconds, whole seconds are enough
+        if calendar.timegm(time.strptime(lock['Created'][:19], '%Y-%m-%dT%H:%M:%S')) < int(started):
+            return
+
+        now = time.time()
+        get_aws_client('dynamodb').put_item(
+            TableName=state_lock['table'],
+            Item={
+                'LockID': {'S': state_lock['lock_id'] + TERRAFORM_STATE_LOCK_OWNER_SUFFIX}, 'RequestId': {'S': str(state_lock['request_id'])},
+                'Created': {'N': f"{started:.3f}"}, 'Expires': {'N': f"{now:.3f}"}, 'LockId': {'S': lock['ID']},
+            },
+        )
+        logger.warning(f"Recorded state lock {lock['ID']} as abandoned by request {state_lock['request_id']}, it is released by the next invocation")
+    except ClientError as e:
+        logger.warning(f"Failed to record the owner of the abandoned state lock: {e}")
+
+def wait_terraform_state_lock(state_lock, terraform_binary, environment=None, working_dir=None, timeout=0):
+    """
+    Waits until the state lock is released, polling the lock item with jittered exponential backoff.
+
+    Stale locks, see is_stale_terraform_state_lock, are released with 'terraform force-unlock' of
+    the lock ID recorded by their owner instead of waiting for them. If the lock is still held after the timeout, the caller's
+    Terraform command waits for it with '-lock-timeout' and fails if it can't acquire it.
+
+    Args:
+        state_lock (dict): The state lock, see get_terraform_state_lock.
+        terraform_binary (str): The path to the Terraform binary.
+        environment (dict): The environment variables for the Terraform command.
+        working_dir (str): The initialized Terraform working directory of the custom resource.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        float: The number of seconds waited.
+    """
+    start_time = time.monotonic()
+    attempt = 0
+    while True:
+        lock, owner = read_terraform_state_lock(state_lock)
+        if not lock:
+            break
+
+        if is_stale_terraform_state_lock(lock, owner):
+            logger.warning(f"Releasing state lock {lock['ID']} left by request {owner['RequestId']}, which timed out")
+            run_terraform_command([terraform_binary, "force-unlock", "-force", lock['ID']], environment=environment, working_dir=working_dir)
+            try:
+                get_aws_client('dynamodb').delete_item(
+                    TableName=state_lock['table'], Key={'LockID': {'S': state_lock['lock_id'] + TERRAFORM_STATE_LOCK_OWNER_SUFFIX}},
+                    ConditionExpression='RequestId = :request_id', ExpressionAttributeValues={':request_id': {'S': owner['RequestId']}}
+                )
+            except ClientError as e:
+                logger.warning(f"Failed to remove the owner of the stale state lock: {e}")
+            record_metric('StateLockForceUnlocks', 1)
+            break
+
+        elapsed = time.monotonic() - start_time
+        if elapsed >= timeout:
+            break
+
+        if not attempt:
+            logger.info(f"State is locked for {lock.get('Operation')} by {lock.get('Who')} since {lock.get('Created')} (lock ID {lock.get('ID')}), waiting up to {timeout:.0f}s...")
+        delay = min(TERRAFORM_STATE_LOCK_RETRY_BASE_DELAY * 2 ** attempt, TERRAFORM_STATE_LOCK_RETRY_MAX_DELAY)
+        time.sleep(min(random.uniform(delay / 2, delay), timeout - elapsed))
+        attempt += 1
+
+    return time.monotonic() - start_time
+
+def get_terraform_state_lock_timeout(deadline=None):
+    """
+    Returns the seconds Terraform commands of the current phase may wait for the state lock in total.
+
+    Args:
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+
+    Returns:
+        float: A share of the time budget of the phase, see TERRAFORM_STATE_LOCK_TIMEOUT_SHARE.
+    """
+    if not deadline:
+        return TERRAFORM_STATE_LOCK_TIMEOUT_MAX
+
+    return min(TERRAFORM_STATE_LOCK_TIMEOUT_MAX, deadline.terraform_timeout() * TERRAFORM_STATE_LOCK_TIMEOUT_SHARE)
+
+def run_terraform_locking_command(command, log_group=None, log_stream_name=None, environment=None, working_dir=None, allowed_return_codes=(0,), deadline=None, ui_stream=None, state_lock=None):
+    """
+    Runs a Terraform command which locks the state, see run_terraform_command, waiting for the state
+    lock within the time budget of the current phase instead of failing right away.
+
+    Terraform waits for the lock itself with '-lock-timeout'. If it still can't acquire it, the
+    command is retried with jittered exponential backoff, up to TERRAFORM_STATE_LOCK_MAX_ATTEMPTS
+    times in total, as long as the lock wait budget (get_terraform_state_lock_timeout) allows.
+    With the Auto backend, DynamoDB is only queried once Terraform reports a lock conflict: the
+    first attempt doesn't wait for the lock, and the lock item is polled before every retry, so
+    that stale locks are released instead of waited for (see wait_terraform_state_lock). A command
+    interrupted by the deadline records the lock it may have left behind (see
+    record_abandoned_terraform_state_lock). The time spent waiting is recorded as the
+    StateLockWaitDuration metric.
+
+    Args:
+        command (list): Terraform command to run, the subcommand must accept '-lock-timeout'.
+        log_group (str): CloudWatch log group name for logging Terraform output (optional).
+        log_stream_name (str): CloudWatch log stream name for logging Terraform output (optional).
+        environment (dict): Environment variables for the command (optional).
+        working_dir (str): The Terraform working directory of the custom resource.
+        allowed_return_codes (tuple): Return codes which don't indicate a failure.
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+        ui_stream (TerraformUIStream): The parser of the machine-readable UI (optional).
+        state_lock (dict): The state lock of the Auto backend, see get_terraform_state_lock (optional).
+
+    Returns:
+        result: The result of the Terraform command (stdout and stderr).
+    """
+    lock_budget = get_terraform_state_lock_timeout(deadline)
+    wait_time = 0
+    try:
+        for attempt in range(TERRAFORM_STATE_LOCK_MAX_ATTEMPTS):
+            lock_timeout = max(0, lock_budget - wait_time)
+            if state_lock and not attempt:
+                # A stale lock is only detected by polling it, which waiting in Terraform would delay
+                lock_timeout = 0
+            elif state_lock:
+                try:
+                    wait_time += wait_terraform_state_lock(state_lock, command[0], environment, working_dir, lock_timeout)
+                except ClientError as e:
+                    logger.warning(f"Failed to read the state lock, leaving the wait to Terraform - {e}")
+                lock_timeout = max(0, lock_budget - wait_time)
+
+            locking_command = [*command[:2], f"-lock-timeout={lock_timeout:.0f}s", *command[2:]]
+            start_time = time.monotonic()
+            started = time.time()
+            try:
+                return run_terraform_command(locking_command, log_group, log_stream_name, environment, working_dir, allowed_return_codes, deadline=deadline, ui_stream=ui_stream)
+            except ExecutionDeadlineExceeded:
+                if state_lock:
+                    record_abandoned_terraform_state_lock(state_lock, started)
+                raise
+            except RuntimeError as e:
+                if TERRAFORM_STATE_LOCK_ERROR not in str(e) or attempt == TERRAFORM_STATE_LOCK_MAX_ATTEMPTS - 1:
+                    raise
+                wait_time += time.monotonic() - start_time
+                delay = min(TERRAFORM_STATE_LOCK_RETRY_BASE_DELAY * 2 ** attempt, TERRAFORM_STATE_LOCK_RETRY_MAX_DELAY)
+                # The first conflict with the Auto backend is followed by polling the lock, which backs off itself
+                delay = random.uniform(delay / 2, delay) if attempt or not state_lock else 0
+                if wait_time + delay >= lock_budget:
+                    raise
+                logger.warning(f"Terraform failed to acquire the state lock, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                wait_time += delay
+                # The lock error of the failed attempt would be reported as the failure reason of the next one
+                if ui_stream:
+                    ui_stream.errors.clear()
+    finally:
+        record_metric('StateLockWaitDuration', wait_time * 1000, 'Milliseconds')
+
+def terraform_has_provisioned_resources(terraform_binary, log_group=None, log_stream_name=None, environment=None, working_dir=None, deadline=None, state_location=None):
+
+    """
+    Check if Terraform has provisioned any resources in the current state.
+
+    The state of the auto-configured S3 backend is read directly, see read_terraform_s3_state_summary,
+    other states are listed with 'terraform state list'.
+
+    Returns:
+        bool: True if resources are provisioned, False otherwise.
+    """
+    if state_location:
+        try:
+            has_resources = read_terraform_s3_state_summary(state_location)['has_resources']
+            logger.info(f"Terraform has {'provisioned' if has_resources else 'not provisioned any'} resources.")
+            return has_resources
+        except Exception as e:
+            logger.warning(f"Failed to read the Terraform state, falling back to 'terraform state list' - {e}")
+
+    try:
+        # Use run_terraform_command to check the state list
+        result = run_terraform_command(
+            [terraform_binary, 'state', 'list'],
+            log_group=log_group,
+            log_stream_name=log_stream_name,
+            environment=environment,
+            working_dir=working_dir,
+            deadline=deadline
+        )
+
+        # Check if there are any resources in the state, the tail of the output is enough for that
+        resources = result.stdout.strip()
+
+        if resources:
+            logger.info("Terraform has provisioned the following resources:")
+            logger.info(resources)
+            return True
+        else:
+            logger.info("Terraform has not provisioned any resources.")
+            return False
+
+    except ExecutionDeadlineExceeded:
+        raise
+
+    except Exception as e:
+        logger.error(f"An error occurred while checking Terraform state: {e}")
+        return False
+
+def get_execution_mode(resource_properties):
+    """
+    Returns the execution mode of Create and Update requests from the 'ExecutionMode' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        str: The execution mode, one of SUPPORTED_EXECUTION_MODES.
+    """
+    execution_mode = resource_properties.get('ExecutionMode', 'Apply')
+    if execution_mode not in SUPPORTED_EXECUTION_MODES:
+        raise Exception(f"ExecutionMode property, if set, must be one of: {', '.join(SUPPORTED_EXECUTION_MODES)}.")
+
+    return execution_mode
+
+def get_execution_logs_format(resource_properties):
+    """
+    Returns the format of Terraform output from the 'ExecutionLogsFormat' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        str: The execution logs format, one of SUPPORTED_EXECUTION_LOGS_FORMATS.
+    """
+    execution_logs_format = resource_properties.get('ExecutionLogsFormat', 'Text')
+    if execution_logs_format not in SUPPORTED_EXECUTION_LOGS_FORMATS:
+        raise Exception(f"ExecutionLogsFormat property, if set, must be one of: {', '.join(SUPPORTED_EXECUTION_LOGS_FORMATS)}.")
+
+    return execution_logs_format
+
+def get_parallelism(resource_properties):
+    """
+    Returns the number of concurrent operations of Terraform from the 'Parallelism' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        int or str: The parallelism, or 'Auto' to pick it from the function resources, see get_auto_terraform_parallelism.
+    """
+    parallelism = resource_properties.get('Parallelism', TERRAFORM_PARALLELISM_DEFAULT)
+    if parallelism == 'Auto':
+        return parallelism
+
+    # CloudFormation passes numbers of custom resource properties as strings
+    if isinstance(parallelism, str) and parallelism.isdigit():
+        parallelism = int(parallelism)
+    if isinstance(parallelism, bool) or not isinstance(parallelism, int) or not 1 <= parallelism <= TERRAFORM_PARALLELISM_MAX:
+        raise Exception(f"Parallelism property, if set, must be 'Auto' or a number between 1 and {TERRAFORM_PARALLELISM_MAX}.")
+
+    return parallelism
+
+def get_auto_terraform_parallelism():
+    """
+    Picks the number of concurrent operations of Terraform from the resources of the function.
+
+    Lambda allocates CPU in proportion to memory, so both the vCPUs and the memory left after the
+    Terraform and provider processes (TERRAFORM_PARALLELISM_MEMORY_RESERVE) bound the parallelism.
+    The apply of a saved plan is further limited to the number of planned changes, see
+    run_terraform_plan_and_apply.
+
+    Returns:
+        int: The parallelism, between TERRAFORM_PARALLELISM_AUTO_MIN and TERRAFORM_PARALLELISM_AUTO_MAX.
+    """
+    memory_size = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    memory_size = int(memory_size) if memory_size else os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+    vcpus = min(os.cpu_count() or 1, memory_size / LAMBDA_MEMORY_PER_VCPU)
+
+    parallelism = min(
+        int(vcpus * TERRAFORM_PARALLELISM_PER_VCPU),
+        (memory_size - TERRAFORM_PARALLELISM_MEMORY_RESERVE) // TERRAFORM_PARALLELISM_MEMORY_PER_OPERATION,
+    )
+    parallelism = max(TERRAFORM_PARALLELISM_AUTO_MIN, min(TERRAFORM_PARALLELISM_AUTO_MAX, parallelism))
+
+    logger.info(f"Picked parallelism {parallelism} for {vcpus:.2f} vCPUs and {memory_size} MB of memory")
+    return parallelism
+
+def get_terraform_planned_changes(plan_result, ui_stream=None):
+    """
+    Returns the number of resources a plan adds, changes or destroys.
+
+    Args:
+        plan_result (subprocess.CompletedProcess): The result of 'terraform plan', with the tail of stdout.
+        ui_stream (TerraformUIStream): The parser of the machine-readable plan output (optional).
+
+    Returns:
+        int: The number of planned changes, or None if they aren't reported.
+    """
+    if ui_stream:
+        changes = ui_stream.change_summary or {}
+        return changes.get('add', 0) + changes.get('change', 0) + changes.get('remove', 0) if changes else None
+
+    match = re.search(r'Plan: (\d+) to add, (\d+) to change, (\d+) to destroy', plan_result.stdout or '')
+    return sum(int(count) for count in match.groups()) if match else None
+
+def run_with_terraform_parallelism(operation, run, parallelism, deadline=None):
+    """
+    Runs a Terraform operation with the given parallelism, retrying it with half the parallelism if
+    cloud APIs throttle it (TERRAFORM_THROTTLING_PATTERN), up to TERRAFORM_THROTTLING_MAX_ATTEMPTS
+    times in total, as long as the phase of the operation has time left. Every retry restarts the
+    phase of the operation, even if the failed attempt had moved on to another one, e.g. 'output'.
+    The parallelism of every attempt is logged with its duration, retries are recorded as the
+    ThrottledRetries metric.
+
+    Args:
+        operation (str): The operation, also its execution phase: 'apply' or 'destroy'.
+        run (callable): Runs the operation with the parallelism passed as the argument.
+        parallelism (int): The parallelism of the first attempt.
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+
+    Returns:
+        The result of the operation.
+    """
+    for attempt in range(TERRAFORM_THROTTLING_MAX_ATTEMPTS):
+        start_time = time.monotonic()
+        try:
+            result = run(parallelism)
+        except RuntimeError as e:
+            logger.info(f"Terraform {operation} with parallelism {parallelism} failed after {time.monotonic() - start_time:.2f}s")
+            if not re.search(TERRAFORM_THROTTLING_PATTERN, str(e)) or parallelism == 1 or attempt == TERRAFORM_THROTTLING_MAX_ATTEMPTS - 1:
+                raise
+            parallelism = max(1, parallelism // 2)
+            logger.warning(f"Terraform {operation} was throttled by cloud APIs, retrying with parallelism {parallelism}...")
+            record_metric('ThrottledRetries', 1)
+            if deadline:
+                deadline.start_phase(operation)
+            continue
+
+        logger.info(f"Terraform {operation} with parallelism {parallelism} completed in {time.monotonic() - start_time:.2f}s")
+        return result
+
+def get_terraform_outputs(terraform_binary, log_group=None, log_stream_name=None, environment=None, working_dir=None, deadline=None, state_location=None):
+    """
+    Reads the root module outputs from the Terraform state with 'terraform output -json'.
+
+    The state of the auto-configured S3 backend is read directly instead, see
+    read_terraform_s3_state_summary, which saves starting Terraform and loading its providers.
+
+    Returns:
+        dict: The Terraform outputs by name, each with its 'value' and whether it is 'sensitive'.
+    """
+    if deadline:
+        deadline.start_phase('output')
+
+    if state_location:
+        try:
+            with measure_phase('Output'):
+                return read_terraform_s3_state_summary(state_location)['outputs']
+        except Exception as e:
+            logger.warning(f"Failed to read outputs from the Terraform state, falling back to 'terraform output' - {e}")
+
+    start_time = time.monotonic()
+    with measure_phase('Output'):
+        output_result = run_terraform_command([terraform_binary, "output", "-json"], log_group, log_stream_name, environment, working_dir, deadline=deadline, capture_stdout=True)
+    logger.info(f"'terraform output' completed in {time.monotonic() - start_time:.2f}s")
+
+    return json.loads(output_result.stdout)
+
+def get_terraform_outputs_from_apply(ui_stream):
+    """
+    Returns the root module outputs from the machine-readable output of 'terraform apply -json'.
+
+    Terraform emits a single 'outputs' message after a successful apply, and none if the configuration
+    has no outputs. Values of sensitive outputs are redacted in it, so they have no 'value'.
+
+    Args:
+        ui_stream (TerraformUIStream): The parser the output of 'terraform apply -json' was fed to.
+
+    Returns:
+        dict: The Terraform outputs by name, each with its 'value' and whether it is 'sensitive'.
+    """
+    return ui_stream.outputs or {}
+
+def get_terraform_outputs_from_plan(terraform_binary, plan_file, environment=None, working_dir=None, deadline=None):
+    """
+    Reads the root module outputs from a saved plan with 'terraform show -json', which doesn't load
+    the state from the backend. Used when the plan has no changes and the apply is skipped.
+    The plan holds every resource attribute, so its JSON representation is not logged.
+
+    Returns:
+        dict: The Terraform outputs by name, each with its 'value' and whether it is 'sensitive'.
+    """
+    if deadline:
+        deadline.start_phase('output')
+    start_time = time.monotonic()
+    with measure_phase('Output'):
+        show_result = run_terraform_command([terraform_binary, "show", "-json", plan_file], environment=environment, working_dir=working_dir, log_stdout=False, deadline=deadline, capture_stdout=True)
+    logger.info(f"'terraform show' completed in {time.monotonic() - start_time:.2f}s")
+
+    return json.loads(show_result.stdout).get('planned_values', {}).get('outputs', {})
+
+def run_terraform_apply(terraform_binary, log_group=None, log_stream_name=None, environment=None, working_dir=None, deadline=None, execution_logs_format='Text', state_location=None, state_lock=None, parallelism=TERRAFORM_PARALLELISM_DEFAULT):
+    """
+    Runs 'terraform apply -auto-approve' and reads the outputs, see get_terraform_outputs.
+
+    With the 'Json' execution logs format, outputs are read from the machine-readable apply output
+    instead, where values of sensitive outputs are redacted. The apply waits for the state lock,
+    see run_terraform_locking_command, and runs up to the given number of concurrent operations.
+
+    Returns:
+        dict: The Terraform outputs, see get_terraform_outputs.
+    """
+    if execution_logs_format == 'Json':
+        apply_cmd = [terraform_binary, "apply", "-auto-approve", "-input=false", "-json", f"-parallelism={parallelism}"]
+        ui_stream = TerraformUIStream()
+    else:
+        apply_cmd = [terraform_binary, "apply", "-auto-approve", "-no-color", f"-parallelism={parallelism}"]
+        ui_stream = None
+
+    logger.info("Running 'terraform apply'...")
+    start_time = time.monotonic()
+    with measure_phase('Apply'):
+        run_terraform_locking_command(apply_cmd, log_group, log_stream_name, environment, working_dir, deadline=deadline, ui_stream=ui_stream, state_lock=state_lock)
+    logger.info(f"'terraform apply' completed in {time.monotonic() - start_time:.2f}s")
+
+    if ui_stream:
+        return get_terraform_outputs_from_apply(ui_stream)
+
+    logger.info("Capturing Terraform outputs...")
+    return get_terraform_outputs(terraform_binary, log_group, log_stream_name, environment, working_dir, deadline, state_location)
+
+def run_terraform_plan_and_apply(terraform_binary, request_type, log_group=None, log_stream_name=None, environment=None, working_dir=None, deadline=None, execution_logs_format='Text', state_lock=None, parallelism=TERRAFORM_PARALLELISM_DEFAULT, auto_parallelism=False):
+    """
+    Runs 'terraform plan' saving the plan to a file and applies the saved plan, if it has any changes.
+
+    The state is refreshed during planning only, and not at all on Create. Outputs are read from the
+    machine-readable apply output, where values of sensitive outputs are redacted, or from the saved
+    plan if the apply is skipped, instead of running 'terraform output', which loads the state from
+    the backend once more. With automatic parallelism, the apply runs no more concurrent operations
+    than there are planned changes. The saved plan is removed from the workspace afterwards, as it
+    contains sensitive values in plain text.
+
+    Args:
+        terraform_binary (str): The path to the Terraform binary.
+        request_type (str): The CloudFormation request type, 'Create' or 'Update'.
+        log_group (str): CloudWatch log group name for logging Terraform output (optional).
+        log_stream_name (str): CloudWatch log stream name for logging Terraform output (optional).
+        environment (dict): Environment variables for the command (optional).
+        working_dir (str): The Terraform working directory of the custom resource.
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+        execution_logs_format (str): One of SUPPORTED_EXECUTION_LOGS_FORMATS, the apply is always machine-readable.
+        state_lock (dict): The state lock of the Auto backend, see run_terraform_locking_command (optional).
+        parallelism (int): The number of concurrent operations of the plan and the apply.
+        auto_parallelism (bool): Whether the parallelism was picked by get_auto_terraform_parallelism.
+
+    Returns:
+        dict: The Terraform outputs, see get_terraform_outputs.
+    """
+    plan_format = "-json" if execution_logs_format == 'Json' else "-no-color"
+    plan_cmd = [terraform_binary, "plan", "-input=false", plan_format, "-detailed-exitcode", f"-parallelism={parallelism}", f"-out={TERRAFORM_PLAN_FILE_NAME}"]
+    if request_type == 'Create':
+        # Nothing has been provisioned yet, there is nothing to refresh
+        plan_cmd.append("-refresh=false")
+
+    try:
+        logger.info("Running 'terraform plan'...")
+        start_time = time.monotonic()
+        plan_ui_stream = TerraformUIStream() if execution_logs_format == 'Json' else None
+        with measure_phase('Plan'):
+            plan_result = run_terraform_locking_command(
+                plan_cmd, log_group, log_stream_name, environment, working_dir, allowed_return_codes=(0, 2), deadline=deadline,
+                ui_stream=plan_ui_stream, state_lock=state_lock
+            )
+        logger.info(f"'terraform plan' completed in {time.monotonic() - start_time:.2f}s")
+
+        # Return code 0 of 'plan -detailed-exitcode' means that there are no changes, neither to resources nor to outputs
+        if plan_result.returncode == 0:
+            logger.info("No changes planned. Skipping 'terraform apply'...")
+            return get_terraform_outputs_from_plan(terraform_binary, TERRAFORM_PLAN_FILE_NAME, environment, working_dir, deadline)
+
+        if auto_parallelism:
+            planned_changes = get_terraform_planned_changes(plan_result, plan_ui_stream)
+            if planned_changes is not None and planned_changes < parallelism:
+                parallelism = max(1, planned_changes)
+                logger.info(f"Reduced parallelism to {parallelism} for {planned_changes} planned changes")
+
+        logger.info("Running 'terraform apply' of the saved plan...")
+        start_time = time.monotonic()
+        apply_ui_stream = TerraformUIStream()
+        with measure_phase('Apply'):
+            run_terraform_locking_command(
+                [terraform_binary, "apply", "-input=false", "-json", f"-parallelism={parallelism}", TERRAFORM_PLAN_FILE_NAME], log_group, log_stream_name, environment, working_dir,
+                deadline=deadline, ui_stream=apply_ui_stream, state_lock=state_lock
+            )
+        logger.info(f"'terraform apply' completed in {time.monotonic() - start_time:.2f}s")
+
+        return get_terraform_outputs_from_apply(apply_ui_stream)
+    finally:
+        # The saved plan holds the values of sensitive variables and outputs in plain text
+        plan_path = os.path.join(working_dir, TERRAFORM_PLAN_FILE_NAME)
+        if os.path.exists(plan_path):
+            os.remove(plan_path)
+
+def get_outputs_offload_target(resource_properties):
+    """
+    Returns where outputs which don't fit into the CloudFormation response are stored, from the 'OutputsOffload' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        str: The outputs offload target, one of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+    """
+    offload_target = resource_properties.get('OutputsOffload', 'S3')
+    if offload_target not in SUPPORTED_OUTPUTS_OFFLOAD_TARGETS:
+        raise Exception(f"OutputsOffload property, if set, must be one of: {', '.join(SUPPORTED_OUTPUTS_OFFLOAD_TARGETS)}.")
+
+    return offload_target
+
+def get_sensitive_outputs_mode(resource_properties):
+    """
+    Returns whether sensitive Terraform outputs are returned to CloudFormation, from the 'SensitiveOutputs' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        str: The sensitive outputs mode, one of SUPPORTED_SENSITIVE_OUTPUTS_MODES.
+    """
+    sensitive_outputs = resource_properties.get('SensitiveOutputs', 'Exclude')
+    if sensitive_outputs not in SUPPORTED_SENSITIVE_OUTPUTS_MODES:
+        raise Exception(f"SensitiveOutputs property, if set, must be one of: {', '.join(SUPPORTED_SENSITIVE_OUTPUTS_MODES)}.")
+
+    return sensitive_outputs
+
+def flatten_terraform_output_value(name, value):
+    """
+    Flattens a Terraform output value into response attributes with dotted keys.
+
+    Objects and maps are flattened by key and lists holding objects or lists by index, e.g. output
+    'db' with value {"endpoint": {"host": "h"}} becomes 'db.endpoint.host'. Scalars, empty
+    collections and lists of scalars are kept as they are, as Fn::GetAtt can return them.
+
+    Args:
+        name (str): The attribute name of the value.
+        value: The output value.
+
+    Returns:
+        dict: The flattened attributes.
+    """
+    if isinstance(value, dict) and value:
+        items = value.items()
+    elif isinstance(value, list) and any(isinstance(item, (dict, list)) for item in value):
+        items = enumerate(value)
+    else:
+        return {name: value}
+
+    flattened = {}
+    for key, item in items:
+        flattened.update(flatten_terraform_output_value(f"{name}.{key}", item))
+
+    return flattened
+
+def get_response_body_size(event, context, response_data, no_echo=False, reason=None):
+    """
+    Returns the size of the SUCCESS response body which cfnresponse sends for the given data.
+
+    Args:
+        event (dict): The Lambda event.
+        context (object): The Lambda function context object.
+        response_data (dict): The custom resource attributes.
+        no_echo (bool): Whether the attributes are masked.
+        reason (str): The response reason, defaults to the one cfnresponse sends.
+
+    Returns:
+        int: The size of the response body in bytes.
+    """
+    response_body = {
+        'Status': cfnresponse.SUCCESS,
+        'Reason': reason if reason is not None else f"See the details in CloudWatch Log Stream: {context.log_stream_name}",
+        'PhysicalResourceId': event['LogicalResourceId'],
+        'StackId': event['StackId'],
+        'RequestId': event['RequestId'],
+        'LogicalResourceId': event['LogicalResourceId'],
+        'NoEcho': no_echo,
+        'Data': response_data,
+    }
+
+    return len(json.dumps(response_body).encode('utf-8'))
+
+def trim_response_reason(reason, max_size):
+    """
+    Trims a response reason to fit into the given size once encoded into the response body.
+
+    The beginning of the reason, which says what failed, and its end, where Terraform reports the
+    last errors, are kept.
+
+    Args:
+        reason (str): The response reason.
+        max_size (int): The maximum size of the JSON-encoded reason in bytes.
+
+    Returns:
+        str: The reason, trimmed in the middle if it is too long.
+    """
+    def get_encoded_size(text):
+        # cfnresponse escapes non-ASCII characters
+        return len(json.dumps(text)) - 2
+
+    if get_encoded_size(reason) <= max_size:
+        return reason
+
+    marker = ' [...] '
+    keep = max_size - len(marker)
+    while keep > 0:
+        head = keep // 4
+        trimmed = reason[:head] + marker + reason[len(reason) - (keep - head):]
+        overflow = get_encoded_size(trimmed) - max_size
+        if overflow <= 0:
+            return trimmed
+        keep -= overflow
+
+    return ''
+
+def get_outputs_offload_location(event, offload_target):
+    """
+    Returns where the outputs of a custom resource are offloaded, next to its auto-configured backend state.
+
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+        offload_target (str): One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+
+    Returns:
+        str: The S3 URI of the outputs object, or the SSM parameter path of the outputs.
+    """
+    stack_name = event['StackId'].split('/')[-2]
+    guid = event['StackId'].split('/')[-1]
+    logical_resource_id = event['LogicalResourceId']
+
+    if offload_target == 'SSM':
+        return f"/terraform-outputs/{stack_name}/{guid}/{logical_resource_id}"
+
+    bucket = os.environ.get("OUTPUTS_OFFLOAD_S3_BUCKET") or os.environ.get("TERRAFORM_BACKEND_S3_BUCKET")
+    if not bucket:
+        raise Exception("Outputs exceed the CloudFormation response limit and no S3 bucket is configured to offload them: set OUTPUTS_OFFLOAD_S3_BUCKET or TERRAFORM_BACKEND_S3_BUCKET, or set the OutputsOffload property to SSM.")
+
+    return f"s3://{bucket}/terraform-outputs/{stack_name}/{guid}/{logical_resource_id}.json"
+
+def get_outputs_parameter_name(parameter_path, key):
+    # SSM parameter names may only contain letters, digits and '.-_/', other characters of map keys are replaced
+    return f"{parameter_path}/{re.sub(r'[^a-zA-Z0-9_.-]', '_', key)}"
+
+def offload_terraform_outputs(offload_location, offload_target, attributes, offloaded_keys, sensitive_keys):
+    """
+    Stores outputs which don't fit into the CloudFormation response.
+
+    The S3 object holds all the attributes as a JSON document, so it can be read in one request,
+    encrypted with SSE-KMS if it holds sensitive outputs. SSM gets one parameter per offloaded
+    attribute, a SecureString for sensitive ones, and the parameters of the attributes which are
+    gone since the previous request are deleted.
+
+    Args:
+        offload_location (str): The S3 URI or SSM parameter path, see get_outputs_offload_location.
+        offload_target (str): One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+        attributes (dict): All the flattened attributes.
+        offloaded_keys (list): The attributes which are left out of the response.
+        sensitive_keys (set): The attributes of sensitive outputs.
+    """
+    if offload_target == 'S3':
+        bucket, key = offload_location[len('s3://'):].split('/', 1)
+        put_object_args = {'Bucket': bucket, 'Key': key, 'Body': json.dumps(attributes).encode('utf-8'), 'ContentType': 'application/json'}
+        # Sensitive outputs are never stored with the bucket's default encryption only, like SecureString parameters
+        if sensitive_keys:
+            put_object_args['ServerSideEncryption'] = 'aws:kms'
+        get_aws_client('s3').put_object(**put_object_args)
+        return
+
+    ssm = get_aws_client('ssm')
+    parameter_names = set()
+    for key in offloaded_keys:
+        value = attributes[key]
+        value = value if isinstance(value, str) else json.dumps(value)
+        if len(value.encode('utf-8')) > SSM_PARAMETER_MAX_SIZE:
+            raise Exception(f"Output '{key}' exceeds the SSM parameter size limit of {SSM_PARAMETER_MAX_SIZE} bytes, set the OutputsOffload property to S3.")
+
+        parameter_name = get_outputs_parameter_name(offload_location, key)
+        ssm.put_parameter(Name=parameter_name, Value=value, Type='SecureString' if key in sensitive_keys else 'String', Tier='Intelligent-Tiering', Overwrite=True)
+        parameter_names.add(parameter_name)
+
+    delete_outputs_parameters(offload_location, keep=parameter_names)
+
+def delete_outputs_parameters(parameter_path, keep=()):
+    """
+    Deletes the SSM parameters of offloaded outputs under a path.
+
+    Args:
+        parameter_path (str): The SSM parameter path, see get_outputs_offload_location.
+        keep (set): The parameter names which are not deleted.
+    """
+    ssm = get_aws_client('ssm')
+    stale_names = []
+    for page in ssm.get_paginator('get_parameters_by_path').paginate(Path=parameter_path, Recursive=True):
+        stale_names.extend(parameter['Name'] for parameter in page['Parameters'] if parameter['Name'] not in keep)
 
-        return result
+    # DeleteParameters accepts at most 10 names per request
+    for index in range(0, len(stale_names), 10):
+        ssm.delete_parameters(Names=stale_names[index:index + 10])
 
-    except subprocess.SubprocessError as e:
-        # Catch subprocess errors, log them to console, and re-raise as RuntimeError
-        logger.error(f"Subprocess error: {str(e)}")
-        raise RuntimeError(f"Subprocess error occurred: {str(e)}") from e
+def get_outputs_offload_record_s3_location(event):
+    """
+    Returns the location of the record of where the outputs of a custom resource are offloaded, next to its auto-configured backend state.
 
-    except Exception as e:
-        # General exception handler for unexpected issues, log to console
-        logger.error(f"Unexpected error: {str(e)}")
-        raise RuntimeError(f"Unexpected error: {str(e)}") from e
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
 
-def get_backend_auto_config_s3_key(event):
-    # Get stack name, guid and logical resource ID to generate discriminating key
+    Returns:
+        tuple: The S3 bucket and key of the outputs offload record.
     """
-    Generates an S3 key for storing Terraform state files.
+    return os.environ.get("TERRAFORM_BACKEND_S3_BUCKET"), f"{get_backend_auto_config_s3_key(event)}.outputs-offload.json"
 
-    The key is constructed using the stack name, a unique GUID, and the logical resource ID
-    derived from the CloudFormation event.
+def read_outputs_offload_record(event, resource_properties):
+    """
+    Returns where a previous request offloaded the outputs of a custom resource, so that they are
+    only deleted if there are any.
+
+    Without a bucket to keep the record in, or if it can't be read, outputs may have been offloaded
+    to the target of the previous properties, which is returned instead.
 
     Args:
-        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+        event (dict): The Lambda event.
+        resource_properties (dict): The resource properties for the custom resource.
 
     Returns:
-        str: A formatted S3 key for Terraform state storage.
+        str: One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS, or None if the outputs weren't offloaded.
     """
-    stack_name = event['StackId'].split('/')[-2]
-    guid = event['StackId'].split('/')[-1]
-    logical_resource_id = event['LogicalResourceId']
+    previous_offload_target = event.get('OldResourceProperties', resource_properties).get('OutputsOffload', 'S3')
+    bucket, key = get_outputs_offload_record_s3_location(event)
+    if not bucket:
+        return previous_offload_target
 
-    key = f"terraform-state/{stack_name}/{guid}/{logical_resource_id}"
+    try:
+        return json.loads(get_aws_client('s3').get_object(Bucket=bucket, Key=key)['Body'].read())['offload_target']
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return None
+        logger.warning(f"Failed to read the outputs offload record from s3://{bucket}/{key}: {e}")
 
-    return key
+    return previous_offload_target
 
-def get_backend_auto_config_s3_content(event):
+def save_outputs_offload_record(event, offload_target):
     """
-    Generates the Terraform backend configuration content based on environment variables and event data.
+    Records where the outputs of a custom resource are offloaded, see read_outputs_offload_record.
 
-    The content is generated using the 'bucket', 'dynamodb_table', and 'key' values.
-    The 'key' is generated using the stack name, a unique GUID, and the logical resource ID
-    derived from the CloudFormation event.
+    Args:
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+        offload_target (str): One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+    """
+    bucket, key = get_outputs_offload_record_s3_location(event)
+    if bucket:
+        get_aws_client('s3').put_object(Bucket=bucket, Key=key, Body=json.dumps({'offload_target': offload_target}).encode('utf-8'), ContentType='application/json')
+
+def delete_offloaded_terraform_outputs(event, offload_target):
+    """
+    Deletes the offloaded outputs of a custom resource, and then the record of where they are
+    offloaded. Failures are logged and ignored, the record is kept if the outputs aren't deleted.
 
     Args:
         event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
+        offload_target (str): One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+    """
+    try:
+        if offload_target == 'SSM':
+            delete_outputs_parameters(get_outputs_offload_location(event, 'SSM'))
+        elif os.environ.get("OUTPUTS_OFFLOAD_S3_BUCKET") or os.environ.get("TERRAFORM_BACKEND_S3_BUCKET"):
+            bucket, key = get_outputs_offload_location(event, 'S3')[len('s3://'):].split('/', 1)
+            get_aws_client('s3').delete_object(Bucket=bucket, Key=key)
+
+        bucket, key = get_outputs_offload_record_s3_location(event)
+        if bucket:
+            get_aws_client('s3').delete_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        logger.warning(f"Failed to delete offloaded outputs from {offload_target}: {e}")
 
-    Returns:
-        str: The auto-generated Terraform backend configuration content.
+def encode_terraform_outputs(event, context, outputs, offload_target='S3', sensitive_outputs='Exclude', previous_offload_target=None):
     """
-    bucket = os.environ.get("TERRAFORM_BACKEND_S3_BUCKET")
-    dynamodb_table = os.environ.get("TERRAFORM_BACKEND_S3_DYNAMODB_TABLE")
+    Encodes Terraform outputs into custom resource attributes which fit into the CloudFormation response.
 
-    if not bucket or not dynamodb_table:
-        raise Exception("Environment variables TERRAFORM_BACKEND_S3_BUCKET and TERRAFORM_BACKEND_S3_DYNAMODB_TABLE must be set.")
+    Outputs are flattened to dotted keys, see flatten_terraform_output_value, and sensitive outputs
+    are left out unless they are included explicitly, in which case the response is sent with NoEcho.
+    If the response body exceeds CLOUDFORMATION_RESPONSE_MAX_SIZE, the outputs are offloaded, the
+    smallest attributes that fit are still returned, and the rest is replaced with pointer attributes:
+    'OutputsS3Uri' or 'OutputsParameterPath', and 'OffloadedOutputCount'. Outputs offloaded by a
+    previous request are deleted once they fit into the response again, or once they are offloaded
+    to a different target.
 
-    key = get_backend_auto_config_s3_key(event)
+    Args:
+        event (dict): The Lambda event.
+        context (object): The Lambda function context object.
+        outputs (dict): The Terraform outputs, see get_terraform_outputs.
+        offload_target (str): One of SUPPORTED_OUTPUTS_OFFLOAD_TARGETS.
+        sensitive_outputs (str): One of SUPPORTED_SENSITIVE_OUTPUTS_MODES.
+        previous_offload_target (str): Where a previous request offloaded the outputs, see read_outputs_offload_record (optional).
 
-    # Auto-generated backend-config values
-    backend_config_content = textwrap.dedent(f"""
-        bucket         = "{bucket}"
-        dynamodb_table = "{dynamodb_table}"
-        key            = "{key}"
-        encrypt        = "true"
-        """)
+    Returns:
+        tuple: The response data and whether it must be sent with NoEcho.
+    """
+    attributes = {}
+    sensitive_keys = set()
+    for name, output in outputs.items():
+        if output.get('sensitive'):
+            if sensitive_outputs != 'Include':
+                logger.info(f"Sensitive output '{name}' is excluded from the response")
+                continue
+            flattened = flatten_terraform_output_value(name, output.get('value'))
+            sensitive_keys.update(flattened)
+        else:
+            flattened = flatten_terraform_output_value(name, output.get('value'))
+        attributes.update(flattened)
+
+    no_echo = bool(sensitive_keys)
+    logger.info(f"Terraform output attributes: {sorted(attributes)}")
+
+    response_size = get_response_body_size(event, context, attributes, no_echo)
+    if response_size <= CLOUDFORMATION_RESPONSE_MAX_SIZE:
+        # Outputs offloaded by a previous request would be left behind, with values that are out of date
+        if previous_offload_target:
+            delete_offloaded_terraform_outputs(event, previous_offload_target)
+        return attributes, no_echo
+
+    offload_location = get_outputs_offload_location(event, offload_target)
+    pointer_attribute = 'OutputsParameterPath' if offload_target == 'SSM' else 'OutputsS3Uri'
+
+    # Keep the smallest attributes in the response, each of them adds its key, value and separators to the body
+    response_data = {pointer_attribute: offload_location, 'OffloadedOutputCount': len(attributes)}
+    remaining_size = CLOUDFORMATION_RESPONSE_MAX_SIZE - get_response_body_size(event, context, response_data, no_echo)
+    inline_keys = set()
+    for key in sorted(attributes, key=lambda key: len(json.dumps(key)) + len(json.dumps(attributes[key]))):
+        attribute_size = len(json.dumps({key: attributes[key]}).encode('utf-8'))
+        if attribute_size > remaining_size:
+            break
+        inline_keys.add(key)
+        remaining_size -= attribute_size
+
+    offloaded_keys = [key for key in attributes if key not in inline_keys]
+    response_data['OffloadedOutputCount'] = len(offloaded_keys)
+    response_data.update((key, value) for key, value in attributes.items() if key in inline_keys)
+
+    logger.info(f"Response of {response_size} bytes exceeds the CloudFormation limit of {CLOUDFORMATION_RESPONSE_MAX_SIZE} bytes, offloading {len(offloaded_keys)} of {len(attributes)} output attributes to {offload_location}")
+    with measure_phase('OutputOffload'):
+        if previous_offload_target != offload_target:
+            if previous_offload_target:
+                delete_offloaded_terraform_outputs(event, previous_offload_target)
+            # Recorded before the outputs are written, so that they are never left behind unrecorded
+            save_outputs_offload_record(event, offload_target)
+        offload_terraform_outputs(offload_location, offload_target, attributes, offloaded_keys, sensitive_keys)
+
+    return response_data, no_echo
+
+def get_update_behavior(resource_properties):
+    """
+    Returns whether Updates which don't change anything skip Terraform, from the 'UpdateBehavior' property.
 
-    return backend_config_content
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
 
-def build_terraform_init_cmd(terraform_binary, backend_config, event):
+    Returns:
+        str: The update behavior, one of SUPPORTED_UPDATE_BEHAVIORS.
+    """
+    update_behavior = resource_properties.get('UpdateBehavior', 'SkipUnchanged')
+    if update_behavior not in SUPPORTED_UPDATE_BEHAVIORS:
+        raise Exception(f"UpdateBehavior property, if set, must be one of: {', '.join(SUPPORTED_UPDATE_BEHAVIORS)}.")
 
+    return update_behavior
+
+def get_terraform_inputs_hash(terraform_binary, resource_properties, working_dir):
     """
-    Builds the Terraform init command, adding -backend-config if necessary.
+    Calculate the hash of the effective inputs of a Terraform apply.
+
+    The hash covers every file of the prepared working directory, that is the fetched configuration,
+    the rendered variables and the Terraform CLI configuration, the resource properties other than
+    TERRAFORM_INPUT_IGNORED_PROPERTIES, such as Environment and Backend, and the Terraform version.
 
     Args:
         terraform_binary (str): The path to the Terraform binary.
-        backend_config (str): The backend configuration. If set to 'Auto', the backend configuration
-            is generated using environment variables and the CloudFormation event data.
-        event (dict): The CloudFormation event data.
+        resource_properties (dict): The resource properties for the custom resource.
+        working_dir (str): The Terraform working directory, after prepare_terraform_configuration.
 
     Returns:
-        list: The Terraform init command as a list of arguments.
+        str: The hex digest of the inputs.
     """
-    init_cmd = [terraform_binary, "init", "-no-color"]
-
-    if backend_config:
-        if not isinstance(backend_config, str):
-            raise Exception("Backend property, if set, must be a string.")
-        if backend_config == "Auto":
-            logger.info("Using auto-generated backend configuration")
-            backend_config_content = get_backend_auto_config_s3_content(event)
-        else:
-            logger.info("Using provided backend configuration")
-            backend_config_content = backend_config
-
-        # Write backend properties to a file
-        backend_file_path = "/tmp/config.generated.tfbackend"
-        with open(backend_file_path, 'w') as backend_file:
-            backend_file.write(backend_config_content)
+    digest = hashlib.sha256()
 
-        logger.info(f"Backend configuration written to {backend_file_path}")
+    for root, dir_names, file_names in os.walk(working_dir):
+        preserved_files = TERRAFORM_WORKSPACE_PRESERVED_FILES if root == working_dir else []
+        dir_names[:] = sorted(dir_name for dir_name in dir_names if dir_name not in preserved_files)
+        for file_name in sorted(file_names):
+            if file_name in preserved_files:
+                continue
+            file_path = os.path.join(root, file_name)
+            digest.update(f"{os.path.relpath(file_path, working_dir)}\0{hash_file_content(file_path)}\0".encode('utf-8'))
 
-        # Provide the backend config file to terraform
-        init_cmd.extend(["-backend-config", backend_file_path])
+    properties = {key: value for key, value in resource_properties.items() if key not in TERRAFORM_INPUT_IGNORED_PROPERTIES}
+    digest.update(json.dumps(properties, sort_keys=True).encode('utf-8'))
+    digest.update(get_terraform_version(terraform_binary).encode('utf-8'))
 
-    return init_cmd
+    return digest.hexdigest()
 
-def check_cloudformation_stack_status(stack_name):
+def get_terraform_apply_record_s3_location(event):
     """
-    Retrieves the current status of a CloudFormation stack.
+    Returns the location of the apply record of a custom resource, next to its auto-configured backend state.
 
     Args:
-        stack_name (str): The name of the CloudFormation stack.
+        event (dict): The event data containing 'StackId' and 'LogicalResourceId' keys.
 
     Returns:
-        str: The current status of the stack, or None if an error occurs.
+        tuple: The S3 bucket and key of the apply record.
+    """
+    return os.environ.get("TERRAFORM_BACKEND_S3_BUCKET"), f"{get_backend_auto_config_s3_key(event)}.apply-record.json"
+
+def save_terraform_apply_record(event, inputs_hash, outputs):
     """
-    client = boto3.client('cloudformation')
+    Records the inputs hash and the outputs of a successful apply, see reuse_terraform_apply_record.
 
+    Values of sensitive outputs aren't recorded. Failures are logged and ignored, the next Update
+    then runs Terraform.
+
+    Args:
+        event (dict): The Lambda event.
+        inputs_hash (str): The hash of the apply inputs, see get_terraform_inputs_hash.
+        outputs (dict): The Terraform outputs, see get_terraform_outputs.
+    """
+    outputs = {name: output if not output.get('sensitive') else {'sensitive': True} for name, output in outputs.items()}
+    bucket, key = get_terraform_apply_record_s3_location(event)
     try:
-        response = client.describe_stacks(StackName=stack_name)
-        stack_status = response['Stacks'][0]['StackStatus']
-        return stack_status
+        get_aws_client('s3').put_object(Bucket=bucket, Key=key, Body=json.dumps({'inputs_hash': inputs_hash, 'outputs': outputs}).encode('utf-8'), ContentType='application/json')
+    except Exception as e:
+        logger.warning(f"Failed to save the apply record to s3://{bucket}/{key}: {e}")
 
-    except client.exceptions.ClientError as e:
-        print(f"Error checking stack status: {e}")
-        return None
+def delete_terraform_apply_record(event):
+    """
+    Deletes the apply record of a custom resource, so that it can't be reused.
 
-def terraform_has_provisioned_resources(terraform_binary, log_group=None, log_stream_name=None, environment=None):
+    Args:
+        event (dict): The Lambda event.
+    """
+    bucket, key = get_terraform_apply_record_s3_location(event)
+    get_aws_client('s3').delete_object(Bucket=bucket, Key=key)
 
+def reuse_terraform_apply_record(event, inputs_hash, update_behavior='SkipUnchanged', sensitive_outputs='Exclude'):
     """
-    Check if Terraform has provisioned any resources in the current state.
+    Returns the recorded outputs of the last successful apply if an Update doesn't change anything.
+
+    An Update is unchanged if its resource properties equal the old ones, apart from
+    TERRAFORM_INPUT_IGNORED_PROPERTIES, and the hash of its inputs, which also covers the content
+    of remote configurations and variables, equals the recorded one. Drift of the provisioned
+    resources isn't detected, the 'AlwaysApply' update behavior always runs Terraform.
+
+    Otherwise the record of an Update is deleted before Terraform runs, so that a failed apply can't
+    leave a record which a later rollback to the recorded inputs would reuse. This fails closed: if
+    the record can't be deleted, the Update fails without running Terraform, unlike a Delete, which
+    only logs a warning. A Create always runs Terraform and overwrites any record once it succeeds.
+
+    Args:
+        event (dict): The Lambda event.
+        inputs_hash (str): The hash of the apply inputs, see get_terraform_inputs_hash.
+        update_behavior (str): One of SUPPORTED_UPDATE_BEHAVIORS.
+        sensitive_outputs (str): One of SUPPORTED_SENSITIVE_OUTPUTS_MODES.
 
     Returns:
-        bool: True if resources are provisioned, False otherwise.
+        dict: The recorded Terraform outputs, or None if Terraform has to run.
     """
-    try:
-        # Use run_terraform_command to check the state list
-        result = run_terraform_command(
-            [terraform_binary, 'state', 'list'],
-            log_group=log_group,
-            log_stream_name=log_stream_name,
-            environment=environment
-        )
-
-        # Check if there are any resources in the state
-        resources = result.stdout.strip()
+    def get_inputs(resource_properties):
+        return {key: value for key, value in resource_properties.items() if key not in TERRAFORM_INPUT_IGNORED_PROPERTIES}
 
-        if resources:
-            logger.info("Terraform has provisioned the following resources:")
-            logger.info(resources)
-            return True
+    if event['RequestType'] == 'Update' and update_behavior == 'SkipUnchanged' and get_inputs(event['ResourceProperties']) == get_inputs(event.get('OldResourceProperties', {})):
+        bucket, key = get_terraform_apply_record_s3_location(event)
+        try:
+            record = json.loads(get_aws_client('s3').get_object(Bucket=bucket, Key=key)['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ['NoSuchKey', '404']:
+                raise
+            record = {}
+
+        outputs = record.get('outputs', {})
+        if record.get('inputs_hash') != inputs_hash:
+            logger.info("Update inputs differ from the last successful apply")
+        elif sensitive_outputs == 'Include' and any(output.get('sensitive') for output in outputs.values()):
+            logger.info("Values of sensitive outputs aren't recorded, running Terraform")
         else:
-            logger.info("Terraform has not provisioned any resources.")
-            return False
+            logger.info("Update inputs are unchanged since the last successful apply, skipping Terraform")
+            record_metric('UpdateSkipped', 1)
+            return outputs
 
-    except Exception as e:
-        logger.error(f"An error occurred while checking Terraform state: {e}")
-        return False
+    if event['RequestType'] == 'Update':
+        record_metric('UpdateSkipped', 0)
+        try:
+            delete_terraform_apply_record(event)
+        except Exception as e:
+            raise Exception(f"Failed to delete the apply record before running Terraform: {e}")
 
-def execute_terraform_command(event, stack_status, terraform_binary, backend_contents, environment, log_group, log_stream_name):
+    return None
+
+def execute_terraform_command(event, stack_status, terraform_binary, backend_contents, environment, log_group, log_stream_name, provider_installation='Auto', working_dir=None, execution_mode='Apply', deadline=None, execution_logs_format='Text', sensitive_outputs='Exclude', parallelism=TERRAFORM_PARALLELISM_DEFAULT):
     """
     Execute the appropriate Terraform command based on the request type.
 
@@ -475,41 +3959,91 @@ def execute_terraform_command(event, stack_status, terraform_binary, backend_con
         environment (dict): The environment variables for the Terraform command.
         log_group (str): The CloudWatch log group name for logging Terraform output (optional).
         log_stream_name (str): The CloudWatch log stream name for logging Terraform output (optional).
+        provider_installation (str): The provider installation mode, one of SUPPORTED_PROVIDER_INSTALLATION_MODES.
+        working_dir (str): The Terraform working directory of the custom resource, see terraform_workspace.
+        execution_mode (str): The execution mode of Create and Update requests, one of SUPPORTED_EXECUTION_MODES.
+        deadline (ExecutionDeadline): The invocation deadline, see ExecutionDeadline (optional).
+        execution_logs_format (str): The format of Terraform output, one of SUPPORTED_EXECUTION_LOGS_FORMATS.
+        sensitive_outputs (str): Whether values of sensitive outputs are needed, one of SUPPORTED_SENSITIVE_OUTPUTS_MODES.
+        parallelism (int or str): The number of concurrent operations of apply and destroy, or 'Auto', see get_parallelism.
 
     Returns:
-        dict: The flattened Terraform outputs for the given request type.
+        dict: The Terraform outputs for the given request type, see get_terraform_outputs.
     """
     try:
         request_type = event['RequestType']
+        # Throttled applies and destroys are retried with reduced parallelism, see run_with_terraform_parallelism
+        terraform_parallelism = get_auto_terraform_parallelism() if parallelism == 'Auto' else parallelism
+
+        # The state of the auto-configured backend is read directly, without running Terraform
+        state_location = get_backend_auto_config_s3_state_location(event, backend_contents, environment)
+        # Terraform commands which lock the state wait for locks held by concurrent invocations, see run_terraform_locking_command
+        state_lock = get_terraform_state_lock(event, state_location)
+        if request_type == 'Delete' and state_location:
+            try:
+                if not read_terraform_s3_state_summary(state_location)['has_resources']:
+                    logger.info("Terraform state has no resources, skipping 'terraform init' and 'terraform destroy'")
+                    return {}
+            except Exception as e:
+                logger.warning(f"Failed to read the Terraform state, running 'terraform destroy' - {e}")
 
         # Step 1: Run `terraform init` to initialize the backend and configuration
         logger.info("Initializing Terraform...")
-        init_cmd = build_terraform_init_cmd(terraform_binary, backend_contents, event)
-        run_terraform_command(init_cmd, log_group, log_stream_name, environment)
+        init_cmd = build_terraform_init_cmd(terraform_binary, backend_contents, event, working_dir)
+        init_fingerprint = get_terraform_init_fingerprint(terraform_binary, init_cmd, environment, working_dir)
+        init_cmd = prepare_terraform_init_cmd(init_cmd, init_fingerprint, working_dir)
+        if init_cmd:
+            if deadline:
+                deadline.start_phase('init')
+            init_environment = environment
+            if not os.path.exists(os.path.join(working_dir, TERRAFORM_LOCK_FILE_NAME)):
+                # Without a lock file to check them against, the cache would never be used for the first install
+                init_environment = {'TF_PLUGIN_CACHE_MAY_BREAK_DEPENDENCY_LOCK_FILE': 'true', **environment}
+            # The plugin cache is not safe for concurrent use, see https://developer.hashicorp.com/terraform/cli/config/config-file#provider-plugin-cache
+            with terraform_plugin_cache_lock, measure_phase('Init'):
+                run_terraform_init(init_cmd, provider_installation, log_group, log_stream_name, init_environment, working_dir, deadline)
+                plugin_cache_stats = update_terraform_plugin_cache(working_dir)
+            save_terraform_init_fingerprint(init_fingerprint, working_dir)
+            record_metric('PluginCacheHits', plugin_cache_stats['hits'])
+            record_metric('PluginCacheMisses', plugin_cache_stats['misses'])
+        record_metric('InitSkipped', 0 if init_cmd else 1)
 
         # Step 2: Handle request types for apply or destroy
         if request_type in ['Create', 'Update']:
-            logger.info(f"Running 'terraform apply' for {request_type}...")
-            run_terraform_command([terraform_binary, "apply", "-auto-approve", "-no-color"], log_group, log_stream_name, environment)
-
-            # Step 3: Capture and return Terraform outputs using run_terraform_command
-            logger.info("Capturing Terraform outputs...")
-            output_cmd = [terraform_binary, "output", "-json"]
-            output_result = run_terraform_command(output_cmd, log_group, log_stream_name, environment)
-
-            terraform_outputs = json.loads(output_result.stdout)
-            flattened_outputs = {key: value['value'] for key, value in terraform_outputs.items()}
-            logger.info(f"Flattened Terraform outputs: {flattened_outputs}")
-            return flattened_outputs
+            # Apply the configuration and capture Terraform outputs
+            logger.info(f"Applying Terraform configuration for {request_type} in {execution_mode} execution mode...")
+            if deadline:
+                deadline.start_phase('apply')
+            if execution_mode == 'PlanAndApply':
+                outputs = run_with_terraform_parallelism('apply', lambda value: run_terraform_plan_and_apply(
+                    terraform_binary, request_type, log_group, log_stream_name, environment, working_dir, deadline, execution_logs_format, state_lock, value, parallelism == 'Auto'
+                ), terraform_parallelism, deadline)
+            else:
+                outputs = run_with_terraform_parallelism('apply', lambda value: run_terraform_apply(
+                    terraform_binary, log_group, log_stream_name, environment, working_dir, deadline, execution_logs_format, state_location, state_lock, value
+                ), terraform_parallelism, deadline)
+
+            # Values of sensitive outputs are redacted in the machine-readable apply output
+            if sensitive_outputs == 'Include' and any('value' not in output for output in outputs.values()):
+                logger.info("Sensitive outputs are redacted in the apply output, capturing Terraform outputs...")
+                outputs = get_terraform_outputs(terraform_binary, log_group, log_stream_name, environment, working_dir, deadline, state_location)
+
+            return outputs
 
         elif request_type == 'Delete':
+            if deadline:
+                deadline.start_phase('destroy')
+
             # Support cases when stack status is ROLLBACK_IN_PROGRESS and Terraform is misconfigured as a result of previous failed Create event
             if stack_status == "ROLLBACK_IN_PROGRESS":
                 try:
-                    if not terraform_has_provisioned_resources(terraform_binary, log_group, log_stream_name, environment):
+                    if not terraform_has_provisioned_resources(terraform_binary, log_group, log_stream_name, environment, working_dir, deadline, state_location):
                         logger.info("No provisioned terraform resources. Skipping 'terraform destroy'...")
                         return {}
 
+                except ExecutionDeadlineExceeded:
+                    raise
+
                 except Exception as e:
                     logger.info(f"Terraform misconfiguration: {e}")
                     logger.info("Misconfigured terraform state during deletion in rollback state. Skipping 'terraform destroy'...")
@@ -517,7 +4051,18 @@ def execute_terraform_command(event, stack_status, terraform_binary, backend_con
 
             # Otherwise, continue with the normal destroy operation
             logger.info("Running 'terraform destroy'...")
-            run_terraform_command([terraform_binary, "destroy", "-auto-approve", "-no-color"], log_group, log_stream_name, environment)
+
+            def run_destroy(value):
+                if execution_logs_format == 'Json':
+                    destroy_cmd = [terraform_binary, "destroy", "-auto-approve", "-input=false", "-json", f"-parallelism={value}"]
+                    ui_stream = TerraformUIStream()
+                else:
+                    destroy_cmd = [terraform_binary, "destroy", "-auto-approve", "-no-color", f"-parallelism={value}"]
+                    ui_stream = None
+                run_terraform_locking_command(destroy_cmd, log_group, log_stream_name, environment, working_dir, deadline=deadline, ui_stream=ui_stream, state_lock=state_lock)
+
+            with measure_phase('Destroy'):
+                run_with_terraform_parallelism('destroy', run_destroy, terraform_parallelism, deadline)
 
             return {}
 
@@ -539,13 +4084,14 @@ def validate_supported_resource_properties(resource_properties):
         if prop not in SUPPORTED_RESOURCE_PROPERTIES:
             raise Exception(f"Unsupported property: {prop}")
 
-def setup_cloudwatch_logging(context, resource_properties):
+def setup_cloudwatch_logging(context, resource_properties, name=None):
     """
     Set up logging to CloudWatch Logs if ExecutionLogsTargetArn is provided.
 
     Args:
         context (object): The Lambda function context object.
         resource_properties (dict): The resource properties for the custom resource.
+        name (str): The name of a configuration of the 'Configurations' property, logged to a stream of its own (optional).
 
     Returns:
         tuple: A tuple containing (log_group, log_stream_name) if ExecutionLogsTargetArn is provided, otherwise None.
@@ -557,17 +4103,427 @@ def setup_cloudwatch_logging(context, resource_properties):
 
     if execution_logs_target_arn:
         log_group = execution_logs_target_arn.split(':')[-2]
-        log_stream_name = f"{context.log_stream_name}-terraform-output"
+        log_stream_name = f"{context.log_stream_name}-{name}-terraform-output" if name else f"{context.log_stream_name}-terraform-output"
 
         # Ensure the log stream exists
         try:
-            cloudwatch_logs.create_log_stream(logGroupName=log_group, logStreamName=log_stream_name)
+            get_aws_client('logs').create_log_stream(logGroupName=log_group, logStreamName=log_stream_name)
         except ClientError as e:
             if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
                 raise Exception(f"Error creating log stream: {e}")
 
     return log_group, log_stream_name
 
+def run_terraform_configuration(event, stack_status, resource_properties, log_group=None, log_stream_name=None, deadline=None, dependency_outputs=None, sensitive_outputs=None, configuration_content=None):
+    """
+    Run Terraform for a configuration in the workspace of its custom resource.
+
+    Args:
+        event (dict): The Lambda event, or the event of a configuration of the 'Configurations' property.
+        stack_status (str): The current status of the CloudFormation stack.
+        resource_properties (dict): The resource properties with the 'Configuration' to run.
+        log_group (str): The CloudWatch log group name for logging Terraform output (optional).
+        log_stream_name (str): The CloudWatch log stream name for logging Terraform output (optional).
+        deadline (ExecutionDeadline): The invocation deadline, see ExecutionDeadline (optional).
+        dependency_outputs (dict): Output values of the configurations this one depends on, by
+            configuration name, passed as variables (optional).
+        sensitive_outputs (str): Overrides the 'SensitiveOutputs' property, e.g. to pass values of
+            sensitive outputs to dependent configurations (optional).
+        configuration_content (str): The content of the configuration fetched ahead, see SetupStage (optional).
+
+    Returns:
+        dict: The Terraform outputs, see get_terraform_outputs, or an empty dict on Delete.
+    """
+    # Resolve the Terraform binary of the requested version, downloading it if it isn't bundled or cached
+    with terraform_workspace(event) as working_dir, terraform_release(resource_properties.get('TerraformVersion')) as terraform_binary:
+        # Clean the files generated by the previous invocation for this resource
+        clean_terraform_cache(working_dir)
+
+        # Set up environment variables for Terraform
+        environment = setup_environment_variables(resource_properties)
+
+        # Install providers from the bundled provider mirror, if any
+        provider_installation = setup_terraform_provider_installation(resource_properties, environment, working_dir)
+
+        # Choose how Create and Update requests are applied and how Terraform output is logged
+        execution_mode = get_execution_mode(resource_properties)
+        execution_logs_format = get_execution_logs_format(resource_properties)
+        sensitive_outputs = sensitive_outputs or get_sensitive_outputs_mode(resource_properties)
+        parallelism = get_parallelism(resource_properties)
+
+        # Prepare Terraform configuration
+        if deadline:
+            deadline.start_phase('fetch')
+        with measure_phase('ConfigurationFetch'):
+            prepare_terraform_configuration(resource_properties, working_dir, event['RequestType'], configuration_content)
+        if dependency_outputs:
+            with open(os.path.join(working_dir, TERRAFORM_DEPENDENCY_VARIABLES_FILE_NAME), 'w') as f:
+                f.write(json.dumps(dependency_outputs))
+
+        # Determine the request type and execute the appropriate Terraform command
+        backend_contents = resource_properties.get('Backend')
+        # Skip Terraform for Updates which change nothing since the last successful apply, recorded next to the Auto backend state
+        update_behavior = get_update_behavior(resource_properties)
+        inputs_hash = None
+        outputs = None
+        if backend_contents == 'Auto' and event['RequestType'] in ['Create', 'Update']:
+            inputs_hash = get_terraform_inputs_hash(terraform_binary, resource_properties, working_dir)
+            outputs = reuse_terraform_apply_record(event, inputs_hash, update_behavior, sensitive_outputs)
+
+        if outputs is None:
+            outputs = execute_terraform_command(event, stack_status, terraform_binary, backend_contents, environment, log_group, log_stream_name, provider_installation, working_dir, execution_mode, deadline, execution_logs_format, sensitive_outputs, parallelism)
+            if inputs_hash:
+                save_terraform_apply_record(event, inputs_hash, outputs)
+
+        if event['RequestType'] == 'Delete' and backend_contents == 'Auto':
+            try:
+                delete_terraform_apply_record(event)
+            except Exception as e:
+                logger.warning(f"Failed to delete the apply record: {e}")
+
+    return outputs
+
+def get_terraform_configurations(resource_properties):
+    """
+    Validate the 'Configurations' property.
+
+    Args:
+        resource_properties (dict): The resource properties for the custom resource.
+
+    Returns:
+        dict: The configurations by name, in the order of the property, each with a 'DependsOn' list.
+    """
+    if 'Configuration' in resource_properties or 'Variables' in resource_properties:
+        raise Exception("Configuration and Variables properties can't be used together with Configurations, set them for each configuration instead.")
+    if resource_properties.get('Backend') != 'Auto':
+        raise Exception("Configurations property requires the Backend property to be 'Auto'.")
+
+    configurations = resource_properties.get('Configurations')
+    if not isinstance(configurations, list) or not configurations:
+        raise Exception("Configurations property, if set, must be a non-empty list.")
+
+    configurations_by_name = {}
+    for configuration in configurations:
+        if not isinstance(configuration, dict):
+            raise Exception("Each item of the Configurations property must be an object with Name and Configuration.")
+        for key in configuration:
+            if key not in SUPPORTED_CONFIGURATIONS_ITEM_PROPERTIES:
+                raise Exception(f"Unsupported property of a Configurations item: {key}")
+
+        name = configuration.get('Name')
+        if not isinstance(name, str) or not re.match(CONFIGURATION_NAME_PATTERN, name):
+            raise Exception(f"Name of each Configurations item must be a valid Terraform variable name, got '{name}'.")
+        if name in configurations_by_name:
+            raise Exception(f"Configurations item name '{name}' is not unique.")
+        if not configuration.get('Configuration'):
+            raise Exception(f"Configuration of Configurations item '{name}' is required.")
+
+        depends_on = configuration.get('DependsOn', [])
+        depends_on = [depends_on] if isinstance(depends_on, str) else depends_on
+        if not isinstance(depends_on, list) or not all(isinstance(dependency, str) for dependency in depends_on):
+            raise Exception(f"DependsOn of Configurations item '{name}', if set, must be a name or a list of names.")
+
+        configurations_by_name[name] = {**configuration, 'DependsOn': depends_on}
+
+    for name, configuration in configurations_by_name.items():
+        for dependency in configuration['DependsOn']:
+            if dependency not in configurations_by_name:
+                raise Exception(f"Configurations item '{name}' depends on unknown item '{dependency}'.")
+
+    # Kahn's algorithm, whatever is left unsorted is part of a cycle
+    remaining = {name: set(configuration['DependsOn']) for name, configuration in configurations_by_name.items()}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise Exception(f"Configurations items have a dependency cycle: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+    return configurations_by_name
+
+def run_terraform_task_graph(prerequisites, run, max_workers=CONFIGURATIONS_MAX_WORKERS):
+    """
+    Run the tasks of a dependency graph with a bounded pool of threads.
+
+    A task starts once all its prerequisites succeeded. If any of them failed or was skipped, the
+    task is skipped, while tasks which don't depend on it continue. Worker threads record metrics
+    of the invocation which started the graph.
+
+    Args:
+        prerequisites (dict): The names of the tasks which must succeed before each task, by task name.
+        run (callable): Runs a task by name and returns its result, raises if the task fails.
+        max_workers (int): The maximum number of tasks running at the same time.
+
+    Returns:
+        dict: By task name, the 'status' (SUCCESS, FAILED or SKIPPED), and the 'result' or the
+            'reason' and the 'duration' in seconds.
+    """
+    metrics = getattr(current_invocation, 'metrics', None)
+
+    def run_task(name):
+        current_invocation.metrics = metrics
+        start_time = time.monotonic()
+        try:
+            return {'status': 'SUCCESS', 'result': run(name), 'duration': time.monotonic() - start_time}
+        except Exception as e:
+            logger.error(f"{name} failed: {e}", exc_info=True)
+            return {'status': 'FAILED', 'reason': str(e), 'duration': time.monotonic() - start_time}
+        finally:
+            current_invocation.metrics = None
+
+    results = {}
+    pending = dict(prerequisites)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, names in list(pending.items()):
+                failed = [prerequisite for prerequisite in names if results.get(prerequisite, {}).get('status') in ('FAILED', 'SKIPPED')]
+                if failed:
+                    results[name] = {'status': 'SKIPPED', 'reason': f"{', '.join(failed)} didn't succeed", 'duration': 0}
+                    del pending[name]
+                elif all(prerequisite in results for prerequisite in names):
+                    running[executor.submit(run_task, name)] = name
+                    del pending[name]
+
+            if not running:
+                if pending:
+                    raise Exception(f"Tasks with unknown prerequisites: {', '.join(pending)}")
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return results
+
+def run_terraform_configurations(event, context, stack_status, resource_properties, deadline=None):
+    """
+    Run the configurations of the 'Configurations' property of a custom resource.
+
+    Every configuration is a separate Terraform root module with its own workspace and its own
+    state, stored under the key of the custom resource followed by '/<name>'. Configurations run in
+    parallel in dependency order, see run_terraform_task_graph, and get output values of the
+    configurations they depend on as variables named after them. On Delete, configurations are
+    destroyed in reverse dependency order, with output values read from the states of their
+    dependencies. On Update, configurations removed from the property are destroyed once all the
+    others are applied.
+
+    Args:
+        event (dict): The Lambda event.
+        context (object): The Lambda function context object.
+        stack_status (str): The current status of the CloudFormation stack.
+        resource_properties (dict): The resource properties for the custom resource.
+        deadline (ExecutionDeadline): The invocation deadline, see ExecutionDeadline (optional).
+
+    Returns:
+        dict: The Terraform outputs of all configurations, named '<configuration name>.<output name>'.
+    """
+    request_type = event['RequestType']
+    configurations = get_terraform_configurations(resource_properties)
+    old_properties = event.get('OldResourceProperties', {}) if request_type == 'Update' else {}
+    if old_properties and 'Configurations' not in old_properties:
+        raise Exception("Switching from Configuration to Configurations isn't supported, replace the custom resource instead.")
+    old_configurations = get_terraform_configurations(old_properties) if old_properties else {}
+
+    def get_properties(properties, configuration):
+        properties = {key: value for key, value in properties.items() if key != 'Configurations'}
+        properties['Configuration'] = configuration['Configuration']
+        if 'Variables' in configuration:
+            properties['Variables'] = configuration['Variables']
+        return properties
+
+    def get_event(name, configuration_request_type, properties, old_configuration_properties=None):
+        # The logical resource ID of a configuration derives its workspace and its backend key
+        configuration_event = {key: value for key, value in event.items() if key != 'OldResourceProperties'}
+        configuration_event.update(RequestType=configuration_request_type, LogicalResourceId=f"{event['LogicalResourceId']}/{name}", ResourceProperties=properties)
+        if old_configuration_properties is not None:
+            configuration_event['OldResourceProperties'] = old_configuration_properties
+        return configuration_event
+
+    def read_outputs(name, properties):
+        state_location = get_backend_auto_config_s3_state_location(get_event(name, 'Delete', properties), 'Auto', properties.get('Environment'))
+        return read_terraform_s3_state_summary(state_location)['outputs'] if state_location else {}
+
+    outputs = {}
+
+    def run(name, configuration_request_type, properties, old_configuration_properties, dependencies, has_dependents):
+        if configuration_request_type == 'Delete':
+            dependency_outputs = {dependency: read_outputs(dependency, dependency_properties) for dependency, dependency_properties in dependencies.items()}
+        else:
+            dependency_outputs = {dependency: outputs[dependency] for dependency in dependencies}
+        dependency_values = {dependency: {key: output.get('value') for key, output in values.items()} for dependency, values in dependency_outputs.items()}
+
+        configuration_event = get_event(name, configuration_request_type, properties, old_configuration_properties)
+        log_group, log_stream_name = setup_cloudwatch_logging(context, properties, name)
+        try:
+            logger.info(f"Running {configuration_request_type} of configuration {name}")
+            outputs[name] = run_terraform_configuration(configuration_event, stack_status, properties, log_group, log_stream_name, deadline.fork() if deadline else None, dependency_values, 'Include' if has_dependents else None)
+        finally:
+            flush_cloudwatch_logs(log_group, log_stream_name)
+
+    def run_graph(names, configurations_by_name, configuration_request_type, properties):
+        if configuration_request_type == 'Delete':
+            # Dependents are destroyed before their dependencies
+            prerequisites = {name: [dependent for dependent in names if name in configurations_by_name[dependent]['DependsOn']] for name in names}
+        else:
+            prerequisites = {name: configurations_by_name[name]['DependsOn'] for name in names}
+
+        def run_configuration(name):
+            configuration = configurations_by_name[name]
+            has_dependents = any(name in other['DependsOn'] for other in configurations_by_name.values())
+            dependencies = {dependency: get_properties(properties, configurations_by_name[dependency]) for dependency in configuration['DependsOn']}
+            old_configuration = old_configurations.get(name)
+            actual_request_type = configuration_request_type if configuration_request_type != 'Update' or old_configuration else 'Create'
+            old_configuration_properties = get_properties(old_properties, old_configuration) if actual_request_type == 'Update' else None
+            run(name, actual_request_type, get_properties(properties, configuration), old_configuration_properties, dependencies, has_dependents)
+
+        results = run_terraform_task_graph(prerequisites, run_configuration)
+        for name in names:
+            result = results[name]
+            logger.info(f"Configuration {name}: {result['status']} in {result['duration']:.2f}s{' - ' + result['reason'] if result.get('reason') else ''}")
+
+        failed = [name for name in names if results[name]['status'] != 'SUCCESS']
+        record_metric('ConfigurationsFailed', len(failed))
+        if failed:
+            reasons = '; '.join(f"{name} {results[name]['status'].lower()}: {results[name]['reason']}" for name in failed)
+            raise Exception(f"{len(failed)} of {len(names)} configurations didn't succeed. {reasons}")
+
+    if request_type == 'Delete':
+        run_graph(list(configurations), configurations, 'Delete', resource_properties)
+        return {}
+
+    run_graph(list(configurations), configurations, request_type, resource_properties)
+
+    removed_names = [name for name in old_configurations if name not in configurations]
+    if removed_names:
+        logger.info(f"Destroying configurations removed from the Configurations property: {', '.join(removed_names)}")
+        run_graph(removed_names, old_configurations, 'Delete', old_properties)
+
+    return {f"{name}.{key}": output for name in configurations for key, output in outputs[name].items()}
+
+class SetupStage:
+    """
+    Runs the calls made before Terraform starts, such as checking the stack status, fetching the
+    configuration and creating the log stream, in parallel instead of one after another, as none of
+    them depends on another.
+
+    Results are collected in the order the calls were submitted, so that the error reported when
+    several calls fail doesn't depend on which one completes first. Every call must complete within
+    the timeout, counted from its submission. When the stage is closed early, e.g. because the
+    request is answered without running Terraform, calls which haven't started yet never run and
+    the ones in flight are abandoned. Worker threads record metrics of the invocation which started
+    the stage, the time saved by the overlap is recorded as the 'SetupTimeSaved' metric.
+
+    Args:
+        timeout (float): Seconds every call may take.
+    """
+
+    def __init__(self, timeout=SETUP_TASK_TIMEOUT):
+        self.timeout = timeout
+        self.metrics = getattr(current_invocation, 'metrics', None)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=SETUP_MAX_WORKERS, thread_name_prefix='setup')
+        self.tasks = {}
+        self.start_time = time.monotonic()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, name, function, *args):
+        """
+        Starts a call, its duration is recorded as the '<name>Duration' metric.
+        """
+        task = {'submitted_at': time.monotonic(), 'started_at': None, 'completed_at': None}
+
+        def run():
+            current_invocation.metrics = self.metrics
+            task['started_at'] = time.monotonic()
+            try:
+                with measure_phase(name):
+                    return function(*args)
+            finally:
+                task['completed_at'] = time.monotonic()
+                current_invocation.metrics = None
+
+        task['future'] = self.executor.submit(run)
+        self.tasks[name] = task
+
+    def result(self, name):
+        """
+        Waits for a call and returns its result.
+
+        Raises:
+            Exception: The error of the call, or if it doesn't complete within the timeout.
+        """
+        task = self.tasks[name]
+        try:
+            return task['future'].result(timeout=max(0, task['submitted_at'] + self.timeout - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            raise Exception(f"{name} didn't complete within {self.timeout:.0f}s.")
+
+    def results(self):
+        """
+        Waits for all calls in the order they were submitted and returns their results by name.
+        """
+        return {name: self.result(name) for name in self.tasks}
+
+    def close(self):
+        """
+        Cancels the calls which haven't completed and reports the time saved by running the completed ones in parallel.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+        completed = {name: task for name, task in self.tasks.items() if task['completed_at'] is not None}
+        cancelled = [name for name in self.tasks if name not in completed]
+        if cancelled:
+            logger.info(f"Abandoned setup calls: {', '.join(cancelled)}")
+        if not completed:
+            return
+
+        duration = max(task['completed_at'] for task in completed.values()) - self.start_time
+        sequential_duration = sum(task['completed_at'] - task['started_at'] for task in completed.values())
+        time_saved = max(0, sequential_duration - duration)
+        record_metric('SetupDuration', duration * 1000, 'Milliseconds')
+        record_metric('SetupTimeSaved', time_saved * 1000, 'Milliseconds')
+        logger.info(f"Setup calls {', '.join(completed)} took {sequential_duration:.2f}s in {duration:.2f}s, saving {time_saved:.2f}s")
+
+def get_setup_timeout(deadline=None):
+    """
+    Get the seconds each call made before Terraform starts may take, see SetupStage.
+
+    Args:
+        deadline (ExecutionDeadline): The invocation deadline (optional).
+
+    Returns:
+        float: SETUP_TASK_TIMEOUT, or less if the deadline leaves less time to fetch the configuration.
+    """
+    if not deadline:
+        return SETUP_TASK_TIMEOUT
+
+    return max(0, min(SETUP_TASK_TIMEOUT, deadline.budget('fetch')))
+
+def prefetch_terraform_release(version):
+    """
+    Resolve the Terraform binary of a version ahead of running Terraform, downloading it to the
+    cache if it isn't bundled or cached yet, see terraform_release.
+
+    Args:
+        version (str): The Terraform version.
+
+    Returns:
+        str: The path to the Terraform binary.
+    """
+    with terraform_release(version) as terraform_binary:
+        return terraform_binary
+
 def handler(event, context):
     """
     Lambda function handler for CloudFormation custom resource.
@@ -582,40 +4538,86 @@ def handler(event, context):
     logger.info(f"Event: {json.dumps(event)}")
     logger.info(f"Context: {context}")
 
-    try:
-        # Clean the .terraform directory cache
-        clean_terraform_cache()
-
-        stack_name = event['StackId'].split('/')[-2]
-        stack_status = check_cloudformation_stack_status(stack_name)
-
-        # Validate and extract properties
-        resource_properties = event.get('ResourceProperties', {})
-
-        if not (stack_status == "ROLLBACK_IN_PROGRESS" and event['RequestType'] == 'Delete'):
-            validate_supported_resource_properties(resource_properties)
-        else:
-            send_response(event=event, context=context, response_status=cfnresponse.SUCCESS, response_data={})
-            return
-
-        # Set up environment variables for Terraform
-        environment = setup_environment_variables(resource_properties)
-
-        # Prepare Terraform configuration
-        prepare_terraform_configuration(resource_properties)
+    log_group = None
+    log_stream_name = None
 
-        # Set up CloudWatch Logs, if required
-        log_group, log_stream_name = setup_cloudwatch_logging(context, resource_properties)
+    # Schedule the execution phases to respond before the Lambda function times out
+    deadline = ExecutionDeadline.from_context(context)
 
-        # Determine the request type and execute the appropriate Terraform command
-        terraform_binary = '/var/task/terraform'
-        backend_contents = resource_properties.get('Backend')
-        flattened_outputs = execute_terraform_command(event, stack_status, terraform_binary, backend_contents, environment, log_group, log_stream_name)
+    # Emit per-phase latency metrics of the invocation as an EMF log line
+    with invocation_metrics(event):
+        try:
+            # Ensure the provider plugin cache exists, Terraform doesn't create it
+            os.makedirs(TERRAFORM_PLUGIN_CACHE_DIR, exist_ok=True)
 
-        # Send success response
-        send_response(event=event, context=context, response_status=cfnresponse.SUCCESS, response_data=flattened_outputs)
+            stack_name = event['StackId'].split('/')[-2]
+            resource_properties = event.get('ResourceProperties', {})
 
-    except Exception as exception:
-        logger.error(f"Unexpected error: {exception}", exc_info=True)
-        send_response(event=event, context=context, response_status=cfnresponse.FAILED, response_reason=f"Reason: {str(exception)}")
+            # Overlap the calls made before Terraform starts, errors are still reported in this order
+            with SetupStage(get_setup_timeout(deadline)) as setup:
+                setup.submit('StackStatus', check_cloudformation_stack_status, stack_name)
 
+                # Validate and extract properties before making any other call, e.g. creating the log stream
+                validation_error = None
+                try:
+                    validate_supported_resource_properties(resource_properties)
+                    # Choose which outputs are returned and where the ones exceeding the response limit are stored
+                    outputs_offload_target = get_outputs_offload_target(resource_properties)
+                    sensitive_outputs = get_sensitive_outputs_mode(resource_properties)
+                except Exception as exception:
+                    validation_error = exception
+
+                # Outputs are only deleted on Update and Delete if a previous request offloaded them
+                if not validation_error and event['RequestType'] in ['Update', 'Delete']:
+                    setup.submit('OutputsOffloadRecord', read_outputs_offload_record, event, resource_properties)
+                if not validation_error and 'Configurations' not in resource_properties:
+                    # Set up CloudWatch Logs, if required
+                    if resource_properties.get('ExecutionLogsTargetArn'):
+                        setup.submit('LogStreamSetup', setup_cloudwatch_logging, context, resource_properties)
+                    if resource_properties.get('TerraformVersion'):
+                        setup.submit('TerraformPrefetch', prefetch_terraform_release, resource_properties['TerraformVersion'])
+                    terraform_configuration = resource_properties.get('Configuration')
+                    # Multi-file configurations are fetched into the workspace, which is acquired later
+                    if isinstance(terraform_configuration, str) and get_remote_fetch_function(terraform_configuration) and not is_multi_file_configuration(terraform_configuration):
+                        setup.submit('ConfigurationPrefetch', get_terraform_configuration_content, terraform_configuration, event['RequestType'])
+
+                stack_status = setup.result('StackStatus')
+
+                # Properties aren't required to be valid for the Delete of a rollback
+                if stack_status == "ROLLBACK_IN_PROGRESS" and event['RequestType'] == 'Delete':
+                    # The calls still in flight are abandoned
+                    setup.close()
+                    with measure_phase('Response'):
+                        send_response(event=event, context=context, response_status=cfnresponse.SUCCESS, response_data={})
+                    return
+                if validation_error:
+                    raise validation_error
+
+                setup_results = setup.results()
+
+            if 'Configurations' in resource_properties:
+                # Run each configuration with its own workspace, state and log stream
+                outputs = run_terraform_configurations(event, context, stack_status, resource_properties, deadline)
+            else:
+                log_group, log_stream_name = setup_results.get('LogStreamSetup', (None, None))
+                outputs = run_terraform_configuration(event, stack_status, resource_properties, log_group, log_stream_name, deadline, configuration_content=setup_results.get('ConfigurationPrefetch'))
+
+            # Encode outputs into the response, offloading the ones exceeding the response limit
+            previous_offload_target = setup_results.get('OutputsOffloadRecord')
+            if event['RequestType'] == 'Delete':
+                response_data, no_echo = {}, False
+                if previous_offload_target:
+                    delete_offloaded_terraform_outputs(event, previous_offload_target)
+            else:
+                response_data, no_echo = encode_terraform_outputs(event, context, outputs, outputs_offload_target, sensitive_outputs, previous_offload_target)
+
+            # Send success response
+            flush_cloudwatch_logs(log_group, log_stream_name)
+            with measure_phase('Response'):
+                send_response(event=event, context=context, response_status=cfnresponse.SUCCESS, response_data=response_data, no_echo=no_echo)
+
+        except Exception as exception:
+            logger.error(f"Unexpected error: {exception}", exc_info=True)
+            flush_cloudwatch_logs(log_group, log_stream_name)
+            with measure_phase('Response'):
+                send_response(event=event, context=context, response_status=cfnresponse.FAILED, response_reason=f"Reason: {str(exception)}")
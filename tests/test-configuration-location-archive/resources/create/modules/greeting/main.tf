@@ -0,0 +1,3 @@
+output "result" {
+  value = "create success"
+}
@@ -0,0 +1,11 @@
+terraform {
+  backend "local" {}
+}
+
+module "greeting" {
+  source = "./modules/greeting"
+}
+
+output "result" {
+  value = module.greeting.result
+}
@@ -0,0 +1,8 @@
+# A new module call within a local module, which requires 'terraform init' to run again
+module "suffix" {
+  source = "../suffix"
+}
+
+output "result" {
+  value = "update ${module.suffix.result}"
+}
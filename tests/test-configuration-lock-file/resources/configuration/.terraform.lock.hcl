@@ -0,0 +1,7 @@
+# The version pinned by this lock file doesn't match the version constraint of the configuration,
+# 'terraform init' must fail instead of generating a new lock file.
+
+provider "registry.terraform.io/hashicorp/random" {
+  version     = "3.5.1"
+  constraints = "~> 3.5.0"
+}
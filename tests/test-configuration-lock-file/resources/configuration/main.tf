@@ -0,0 +1,16 @@
+terraform {
+  backend "local" {}
+
+  required_providers {
+    random = {
+      source  = "hashicorp/random"
+      version = "~> 3.6"
+    }
+  }
+}
+
+resource "random_pet" "pet_name" {}
+
+output "pet" {
+  value = random_pet.pet_name.id
+}